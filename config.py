@@ -25,11 +25,15 @@ def load_parameters():
 
     # Evaluation params
     METRICS = ['coco']                            # Metric used for evaluating the model.
+                                                  # 'fast': in-process BLEU, chrF and TER (see utils/mt_metrics.py).
     EVAL_ON_SETS = ['val']                        # Possible values: 'train', 'val' and 'test' (external evaluator).
     EVAL_ON_SETS_KERAS = []                       # Possible values: 'train', 'val' and 'test' (Keras' evaluator). Untested..
     START_EVAL_ON_EPOCH = 1                       # First epoch to start the model evaluation.
     EVAL_EACH_EPOCHS = True                       # Select whether evaluate between N epochs or N updates.
     EVAL_EACH = 1                                 # Sets the evaluation frequency (epochs or updates).
+    ASYNC_EVALUATION = False                      # Evaluate the stored models in a background process, without
+                                                  # stopping the training.
+    ASYNC_EVALUATION_DEVICES = None               # CUDA_VISIBLE_DEVICES of the evaluation process (None: inherited).
 
     # Search parameters
     SAMPLING = 'max_likelihood'                   # Possible values: multinomial or max_likelihood (recommended).
@@ -39,6 +43,17 @@ def load_parameters():
     OPTIMIZED_SEARCH = True                       # Compute annotations only a single time per sample.
     SEARCH_PRUNING = False                        # Apply pruning strategies to the beam search method..
                                                   # It will likely increase decoding speed, but decrease quality..
+    SEARCH_BATCH_SIZE = 1                         # Number of sentences decoded together by sample_ensemble.py.
+                                                  # If 1, sentences are decoded one by one.
+    BEAM_BATCH_SIZE = 0                           # Maximum number of hypotheses fed together to the models at each
+                                                  # step of the batched search (0: all of them).
+    SEARCH_BUCKET_WIDTH = 1                       # Sentences decoded together differ in less than this number of words.
+                                                  # If 1, their hypotheses are the same as if decoded one by one.
+    SHORTLIST = False                             # Restrict the output vocabulary of each sentence (sample_ensemble.py).
+    SHORTLIST_FREQUENT_WORDS = 1000               # Most frequent target words always included in the shortlist.
+    SHORTLIST_CANDIDATES = 10                     # Maximum number of translation candidates of each source word.
+    SHORTLIST_MAPPING = None                      # Source -- target candidates pkl (see utils/ttables_to_dict.py).
+                                                  # If None, MAPPING is used.
     MAXLEN_GIVEN_X = True                         # Generate translations of similar length to the source sentences.
     MAXLEN_GIVEN_X_FACTOR = 2                     # The hypotheses will have (as maximum) the number of words of the.
                                                   # source sentence * LENGTH_Y_GIVEN_X_FACTOR.
@@ -82,6 +97,9 @@ def load_parameters():
                                                   # See Dataset class (from stager_keras_wrapper) for more info.
     BPE_CODES_PATH = DATA_ROOT_PATH + '/training_codes.joint'    # If TOKENIZATION_METHOD = 'tokenize_bpe',
                                                   # sets the path to the learned BPE codes.
+    TOKENIZATION_JOBS = 1                         # Processes tokenizing the data files when building the dataset.
+                                                  # If > 1, the tokenized files are stored (and reused while their
+                                                  # content, the tokenization and the BPE codes do not change).
     DETOKENIZATION_METHOD = 'detokenize_none'     # Select which de-tokenization method we'll apply.
 
     APPLY_DETOKENIZATION = False                  # Wheter we apply a detokenization method.
@@ -148,6 +166,9 @@ def load_parameters():
 
     HOMOGENEOUS_BATCHES = False                   # Use batches with homogeneous output lengths (Dangerous!!).
     JOINT_BATCHES = 4                             # When using homogeneous batches, get this number of batches to sort.
+    MAX_TOKENS = 0                                # If > 0, batches hold up to this number of source + target tokens
+                                                  # (padding included), instead of BATCH_SIZE sentences.
+    BUCKET_WIDTH = 1                              # When batching by tokens, width of the length buckets.
     PARALLEL_LOADERS = 1                          # Parallel data batch loaders. Somewhat untested if > 1.
     EPOCHS_FOR_SAVE = 1                           # Number of epochs between model saves.
     WRITE_VALID_SAMPLES = True                    # Write valid samples in file.
@@ -303,6 +324,9 @@ def load_parameters():
     RELOAD_EPOCH = True                                # Select whether we reload epoch or update number.
 
     REBUILD_DATASET = True                             # Build again or use stored instance.
+    DATASET_CACHE = True                               # Reuse the stored instance while its files and params match
+    BINARY_CORPUS = False                              # Store the training split as memory-mapped token ids
+                                                       # (see data_engine/binary_corpus.py) instead of sentences.
     MODE = 'training'                                  # 'training' or 'sampling' (if 'sampling' then RELOAD must
                                                        # be greater than 0 and EVAL_ON_SETS will be used).
 
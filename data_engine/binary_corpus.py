@@ -0,0 +1,146 @@
+import codecs
+import logging
+
+import numpy as np
+
+from utils.ragged import RaggedArray, RaggedWriter
+
+
+def tokenized_lines(filepath, tokenize_f=None):
+    """
+    Reads a text file line by line.
+    :param filepath: Text file, one sentence per line
+    :param tokenize_f: Tokenization function applied to each line (e.g. a Dataset tokenization method)
+    :return: Generator of (tokenized) lines
+    """
+    with codecs.open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            yield tokenize_f(line) if tokenize_f is not None else line
+
+
+def binarize_text_file(filepath, dest, words2idx, unk_idx, tokenize_f=None, chunk_size=10000):
+    """
+    Converts a text file into a binary token-id corpus: the int32 word indices of all its sentences, concatenated,
+    plus an int64 offsets array (see utils.ragged.RaggedWriter).
+    The sentences are processed in chunks, so the text file is never fully loaded into memory.
+    :param filepath: Text file, one sentence per line
+    :param dest: Destination file of the word indices (the offsets are stored in dest + '.offsets')
+    :param words2idx: Vocabulary
+    :param unk_idx: Index of the out-of-vocabulary words
+    :param tokenize_f: Tokenization function applied to each line
+    :param chunk_size: Number of sentences written together
+    :return: Number of sentences
+    """
+    n_sentences = 0
+    with RaggedWriter(dest, dtype='int32') as writer:
+        chunk = []
+        for line in tokenized_lines(filepath, tokenize_f):
+            # The words are split as in Dataset.loadText
+            chunk.append([words2idx.get(word, unk_idx) for word in line.strip().split(' ')])
+            if len(chunk) >= chunk_size:
+                writer.extend(chunk)
+                n_sentences += len(chunk)
+                chunk = []
+        writer.extend(chunk)
+        n_sentences += len(chunk)
+    logging.info('Binarized %d sentences from %s into %s' % (n_sentences, filepath, dest))
+    return n_sentences
+
+
+class MemmapText:
+    def __init__(self, filepath, max_text_len, offset=0, fill='end', pad_idx=0, null_idx=2, index=None):
+        """
+        Sequence of sentences of a binary token-id corpus (see binarize_text_file), memory-mapped from disk.
+        Each item is the fixed-length row of word indices that Dataset.preprocessTextFeatures builds for a sentence, so
+        it can be used as the data of a 'text-features' input or output of a Dataset.
+        :param filepath: File of the word indices
+        :param max_text_len: Length of the rows (including the <eos> symbol)
+        :param offset: Shifts the text to the right, adding null symbols at the start (e.g. 1 for state_below)
+        :param fill: 'end', 'start' or 'center' (as in Dataset.setInput)
+        :param pad_idx: Index of the padding symbol
+        :param null_idx: Index of the null symbol
+        :param index: Order of the sentences (as returned by take). If None, the order of the file
+        """
+        self.filepath = filepath
+        self.max_text_len = max_text_len
+        self.offset = offset
+        self.fill = fill
+        self.pad_idx = pad_idx
+        self.null_idx = null_idx
+        self.index = index
+        self._open()
+
+    def _open(self):
+        self.sentences = RaggedArray(self.filepath, dtype='int32')
+
+    def __len__(self):
+        return len(self.sentences) if self.index is None else len(self.index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if self.index is not None:
+            i = self.index[i]
+        return self.row(self.sentences[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices):
+        """
+        Reordered view of the sentences, mapping the same data.
+        :param indices: Positions of the sentences of the view
+        :return: MemmapText instance
+        """
+        indices = np.asarray(indices, dtype='int64')
+        return MemmapText(self.filepath, self.max_text_len, offset=self.offset, fill=self.fill,
+                          pad_idx=self.pad_idx, null_idx=self.null_idx,
+                          index=indices if self.index is None else self.index[indices])
+
+    def lengths(self):
+        """
+        Number of words of each row (including the <eos> symbol), without reading the sentences.
+        :return: Array of lengths, in the order of the view
+        """
+        lengths = np.diff(self.sentences.offsets) + 1
+        if self.index is not None:
+            lengths = lengths[self.index]
+        return np.minimum(lengths, self.max_text_len)
+
+    def row(self, words):
+        """
+        Pads a sentence as Dataset.preprocessTextFeatures does.
+        :param words: Word indices of the sentence
+        :return: Row of max_text_len word indices
+        """
+        row = np.zeros(self.max_text_len, dtype='int64') + self.pad_idx
+        max_text_len = self.max_text_len - 1  # always leave space for <eos> symbol
+        len_j = len(words)
+        if self.fill == 'start':
+            offset_j = max_text_len - len_j - 1
+        elif self.fill == 'center':
+            offset_j = (max_text_len - len_j) // 2
+            len_j += offset_j
+        else:
+            offset_j = 0
+            len_j = min(len_j, max_text_len)
+        if offset_j < 0:
+            len_j += offset_j
+            offset_j = 0
+        len_j = min(len_j, len(words))
+        row[offset_j:offset_j + len_j] = words[:len_j]
+        if self.offset > 0:  # Move the text to the right -> null symbol
+            row = np.append([self.null_idx] * self.offset, row[:-self.offset])
+        return row
+
+    def __getstate__(self):
+        # The memory-mapped data is not pickled (e.g. by saveDataset), but mapped again when unpickling
+        state = self.__dict__.copy()
+        del state['sentences']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
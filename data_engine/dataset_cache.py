@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+
+from data_engine.parallel_tokenization import file_hash
+
+# Parameters that determine the content of a built Dataset. If any of them changes, the whole Dataset is rebuilt
+DATASET_PARAMS = ['DATASET_NAME', 'SRC_LAN', 'TRG_LAN', 'TOKENIZATION_METHOD', 'BPE_CODES_PATH',
+                  'INPUT_VOCABULARY_SIZE', 'OUTPUT_VOCABULARY_SIZE',
+                  'MIN_OCCURRENCES_INPUT_VOCAB', 'MIN_OCCURRENCES_OUTPUT_VOCAB',
+                  'MAX_INPUT_TEXT_LEN', 'MAX_OUTPUT_TEXT_LEN', 'PAD_ON_BATCH', 'FILL', 'SAMPLE_WEIGHTS',
+                  'LABEL_SMOOTHING', 'LOSS', 'INPUTS_IDS_DATASET', 'OUTPUTS_IDS_DATASET',
+                  'ALIGN_FROM_RAW', 'HOMOGENEOUS_BATCHES', 'BINARY_CORPUS', 'POS_UNK', 'HEURISTIC', 'MAPPING']
+
+
+def file_fingerprint(filepath, previous=None):
+    """
+    Fingerprint of a file: its path, size, modification time and content hash.
+    The file is only hashed if its size or modification time differ from the previous fingerprint.
+    :param filepath: File
+    :param previous: Previous fingerprint of the file (or None)
+    :return: Dictionary with the 'path', 'size', 'mtime' and 'sha1' of the file
+    """
+    fingerprint = {'path': filepath,
+                   'size': os.path.getsize(filepath),
+                   'mtime': os.path.getmtime(filepath)}
+    if previous is not None and all(previous.get(key) == fingerprint[key] for key in ['path', 'size', 'mtime']):
+        fingerprint['sha1'] = previous['sha1']
+    else:
+        fingerprint['sha1'] = file_hash(filepath)
+    return fingerprint
+
+
+def same_file(fingerprint1, fingerprint2):
+    """
+    Whether two file fingerprints correspond to the same file and content (regardless of their modification times).
+    """
+    return fingerprint1['path'] == fingerprint2['path'] and fingerprint1['sha1'] == fingerprint2['sha1']
+
+
+def dataset_fingerprint(params, text_files, previous=None):
+    """
+    Fingerprint of a Dataset built by build_dataset: the parameters that determine its content and the fingerprints
+    of the files of each split.
+    :param params: Parameters of the Dataset
+    :param text_files: Dictionary {(split, language): text file}
+    :param previous: Previous fingerprint of the Dataset (or None). The files whose size and modification time did not
+                     change are not hashed again.
+    :return: Dictionary (JSON-serializable)
+    """
+    previous_splits = previous.get('splits', {}) if previous is not None else {}
+    splits = dict()
+    for (split, lan), filepath in text_files.items():
+        splits.setdefault(split, dict())[lan] = file_fingerprint(filepath, previous_splits.get(split, {}).get(lan))
+    dataset_params = dict((key, params.get(key)) for key in DATASET_PARAMS)
+    dataset_params['LOSS'] = 'sparse' in params['LOSS']  # Only the type of the outputs depends on the loss
+    files = dict()
+    if 'bpe' in str(params.get('TOKENIZATION_METHOD')).lower() and params.get('BPE_CODES_PATH') is not None:
+        files['BPE_CODES_PATH'] = params['BPE_CODES_PATH']
+    if params.get('POS_UNK', False) and params.get('HEURISTIC', 0) > 0:
+        files['MAPPING'] = params['MAPPING']
+    previous_files = previous.get('files', {}) if previous is not None else {}
+    # Normalize the parameters as they are stored (e.g. tuples as lists)
+    return {'params': json.loads(json.dumps(dataset_params)),
+            'files': dict((key, file_fingerprint(filepath, previous_files.get(key)))
+                          for key, filepath in files.items()),
+            'splits': splits}
+
+
+def outdated_splits(previous, current):
+    """
+    Splits of a Dataset that must be rebuilt for updating it from the previous fingerprint to the current one.
+    :param previous: Fingerprint of the built Dataset
+    :param current: Current fingerprint
+    :return: Sorted list of splits. All the splits (current or previous) if the parameters changed.
+    """
+    all_splits = sorted(set(previous['splits']) | set(current['splits']))
+    if previous['params'] != current['params'] or sorted(previous['files']) != sorted(current['files']) or \
+            any(not same_file(previous['files'][key], current['files'][key]) for key in current['files']):
+        return all_splits
+    outdated = []
+    for split in all_splits:
+        previous_files = previous['splits'].get(split, {})
+        current_files = current['splits'].get(split, {})
+        if sorted(previous_files) != sorted(current_files) or \
+                any(not same_file(previous_files[lan], current_files[lan]) for lan in current_files):
+            outdated.append(split)
+    return outdated
+
+
+def load_fingerprint(filepath):
+    """
+    Loads a Dataset fingerprint.
+    :param filepath: Fingerprint file
+    :return: Fingerprint, or None if the file does not exist
+    """
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def save_fingerprint(fingerprint, filepath):
+    """
+    Stores a Dataset fingerprint.
+    :param fingerprint: Fingerprint (as returned by dataset_fingerprint)
+    :param filepath: Destination file
+    """
+    with open(filepath, 'w') as f:
+        json.dump(fingerprint, f, indent=2, sort_keys=True)
+    logging.info('Stored the dataset fingerprint in %s' % filepath)
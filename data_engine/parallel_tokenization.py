@@ -0,0 +1,119 @@
+import codecs
+import hashlib
+import logging
+import os
+from itertools import islice
+from multiprocessing import Pool
+
+_tokenize_f = None
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """
+    SHA-1 of the content of a file.
+    :param filepath: File to hash
+    :param block_size: Number of bytes read at once
+    :return: Hexadecimal digest
+    """
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def tokenization_hash(filepath, tokenization, bpe_codes=None):
+    """
+    Hash identifying the tokenization of a file: it changes with the content of the file, the tokenization method and
+    the content of the BPE codes (if used).
+    :param filepath: Text file
+    :param tokenization: Tokenization method (a Dataset method name, e.g. 'tokenize_bpe')
+    :param bpe_codes: BPE codes file
+    :return: Hexadecimal digest
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(file_hash(filepath).encode('utf-8'))
+    sha1.update(tokenization.encode('utf-8'))
+    if 'bpe' in tokenization.lower() and bpe_codes is not None:
+        sha1.update(file_hash(bpe_codes).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def dataset_tokenizer(tokenization, bpe_codes=None):
+    """
+    Tokenization method of a Dataset instance.
+    :param tokenization: Dataset method name
+    :param bpe_codes: BPE codes file (for BPE tokenizations)
+    :return: Tokenization function
+    """
+    from keras_wrapper.dataset import Dataset
+
+    ds = Dataset('tokenizer', '', silence=True)
+    if 'bpe' in tokenization.lower():
+        if bpe_codes is None:
+            raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+        ds.build_bpe(bpe_codes)
+    return getattr(ds, tokenization)
+
+
+def _init_worker(build_tokenizer, tokenization, bpe_codes):
+    global _tokenize_f
+    _tokenize_f = build_tokenizer(tokenization, bpe_codes)
+
+
+def _tokenize_chunk(lines):
+    return [_tokenize_f(line) for line in lines]
+
+
+def tokenize_files(filepaths, tokenization, dest_dir, bpe_codes=None, n_jobs=1, chunk_size=10000,
+                   build_tokenizer=dataset_tokenizer):
+    """
+    Tokenizes text files with a pool of processes, each one tokenizing chunks of chunk_size lines.
+    The tokenized files are stored in dest_dir, named after the original file and its tokenization_hash. Files whose
+    tokenization is already stored (e.g. when rebuilding a dataset) are not tokenized again.
+    :param filepaths: Dictionary {key: text file}
+    :param tokenization: Tokenization method (a Dataset method name, e.g. 'tokenize_bpe')
+    :param dest_dir: Directory where the tokenized files are stored
+    :param bpe_codes: BPE codes file (for BPE tokenizations)
+    :param n_jobs: Number of processes
+    :param chunk_size: Number of lines tokenized by each task
+    :param build_tokenizer: Function building the tokenization function from (tokenization, bpe_codes) in each process
+    :return: Dictionary {key: tokenized file}
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+    tokenized = dict()
+    missing = dict()
+    for key, filepath in filepaths.items():
+        tokenized_path = os.path.join(dest_dir, os.path.basename(filepath) + '.' +
+                                      tokenization_hash(filepath, tokenization, bpe_codes)[:16])
+        tokenized[key] = tokenized_path
+        if os.path.isfile(tokenized_path):
+            logging.info('Reusing the tokenization of %s (%s)' % (filepath, tokenized_path))
+        else:
+            missing[filepath] = tokenized_path
+    if not missing:
+        return tokenized
+
+    pool = Pool(processes=n_jobs, initializer=_init_worker, initargs=(build_tokenizer, tokenization, bpe_codes))
+    try:
+        for filepath, tokenized_path in sorted(missing.items()):
+            logging.info('Tokenizing %s with %d processes' % (filepath, n_jobs))
+            # The tokenized file is written under a temporary name, so interrupted runs are not reused
+            tmp_path = tokenized_path + '.tmp'
+            with codecs.open(filepath, 'r', encoding='utf-8') as f, codecs.open(tmp_path, 'w', encoding='utf-8') as out:
+                lines = (line.rstrip('\n') for line in f)
+                chunks = iter(lambda: list(islice(lines, chunk_size)), [])
+                while True:
+                    # Bound the number of chunks read ahead
+                    group = list(islice(chunks, 4 * n_jobs))
+                    if not group:
+                        break
+                    for tokenized_chunk in pool.map(_tokenize_chunk, group):
+                        for line in tokenized_chunk:
+                            out.write(line + u'\n')
+            os.rename(tmp_path, tokenized_path)
+    finally:
+        pool.close()
+        pool.join()
+    return tokenized
@@ -1,9 +1,132 @@
 import logging
+import os
+import random
 from keras_wrapper.dataset import Dataset, saveDataset, loadDataset
+from data_engine.binary_corpus import MemmapText, binarize_text_file, tokenized_lines
+from data_engine.dataset_cache import dataset_fingerprint, load_fingerprint, outdated_splits, save_fingerprint
+from data_engine.parallel_tokenization import tokenize_files
 
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 
 
+class BinaryCorpusDataset(Dataset):
+    """
+    Dataset whose splits may be stored as memory-mapped binary token-id corpora (MemmapText), see set_binary_text.
+    """
+
+    def shuffleTraining(self):
+        """
+        Applies a random shuffling to the training samples. The MemmapText samples are shuffled by reordering their
+        index, without loading them.
+        """
+        if not self.silence:
+            logging.info("Shuffling training samples.")
+        num = self.len_train
+        shuffled_order = random.sample([i for i in range(num)], num)
+        for samples in [self.X_train, self.Y_train]:
+            for sample_id in list(samples):
+                if isinstance(samples[sample_id], MemmapText):
+                    samples[sample_id] = samples[sample_id].take(shuffled_order)
+                else:
+                    samples[sample_id] = [samples[sample_id][s] for s in shuffled_order]
+        if not self.silence:
+            logging.info("Shuffling training done.")
+
+
+def set_binary_text(ds,
+                    text_filename,
+                    binary_filename,
+                    split,
+                    id,
+                    output=False,
+                    tokenization='tokenize_none',
+                    build_vocabulary=False,
+                    max_text_len=100,
+                    max_words=0,
+                    min_occ=0,
+                    offset=0,
+                    fill='end',
+                    pad_on_batch=True,
+                    sample_weights=False,
+                    label_smoothing=0.,
+                    bpe_codes=None,
+                    binarize=True):
+    """
+    Sets a text input or output of a Dataset split from a binary token-id corpus, as a 'text-features' input/output
+    whose samples are memory-mapped from disk (instead of a list of sentences).
+    The text file is only streamed for building the vocabulary and the binary corpus.
+
+    :param ds: BinaryCorpusDataset instance
+    :param text_filename: Sentences
+    :param binary_filename: Binary token-id corpus of the sentences
+    :param split: Split to set
+    :param id: Dataset id of the data
+    :param output: Whether to set an output (or an input)
+    :param tokenization: Tokenization applied to the sentences
+    :param build_vocabulary: True for building the vocabulary from the sentences, the id of the vocabulary to reuse
+                             or False if the Dataset already includes the vocabulary of this id
+    :param max_text_len: Maximum length of the text
+    :param max_words: Maximum number of words of the vocabulary
+    :param min_occ: Minimum occurrences of each word to be included in the vocabulary
+    :param offset: Shifts the text to the right, adding null symbols at the start
+    :param fill: 'end', 'start' or 'center'
+    :param pad_on_batch: Whether we get sentences with length of the maximum length of the minibatch
+    :param sample_weights: Whether to compute the output masks
+    :param label_smoothing: Label smoothing of the output
+    :param bpe_codes: Codes for the BPE tokenization
+    :param binarize: Whether to (re)write the binary corpus. If False, binary_filename must already exist
+
+    :return: None
+    """
+    if 'bpe' in tokenization.lower():
+        if bpe_codes is None:
+            raise AssertionError('bpe_codes must be specified when applying a BPE tokenization.')
+        ds.build_bpe(bpe_codes)
+    tokenize_f = getattr(ds, tokenization)
+    if build_vocabulary is True:
+        # Dataset.build_vocabulary only iterates once over the sentences: they are streamed from the file
+        ds.build_vocabulary(tokenized_lines(text_filename, tokenize_f), id, min_occ=min_occ, n_words=max_words)
+    elif build_vocabulary:
+        ds.vocabulary[id] = ds.vocabulary[build_vocabulary]
+        ds.vocabulary_len[id] = ds.vocabulary_len[build_vocabulary]
+    words2idx = ds.vocabulary[id]['words2idx']
+    if binarize:
+        binarize_text_file(text_filename, binary_filename, words2idx, words2idx[ds.unk_symbol], tokenize_f)
+    data = MemmapText(binary_filename, max_text_len, offset=offset, fill=fill,
+                      pad_idx=ds.extra_words[ds.pad_symbol], null_idx=words2idx[ds.null_symbol])
+
+    # Register the text with no samples (which sets its type, vocabulary, lengths...) and then set its samples
+    if output:
+        ds.setOutput([],
+                     split,
+                     type='text-features',
+                     id=id,
+                     build_vocabulary=False,
+                     pad_on_batch=pad_on_batch,
+                     sample_weights=sample_weights,
+                     fill=fill,
+                     max_text_len=max_text_len,
+                     max_words=max_words,
+                     offset=offset,
+                     label_smoothing=label_smoothing,
+                     overwrite_split=True)
+        getattr(ds, 'Y_' + split)[id] = data
+        setattr(ds, 'len_' + split, len(data))
+    else:
+        ds.setInput([],
+                    split,
+                    type='text-features',
+                    id=id,
+                    build_vocabulary=False,
+                    pad_on_batch=pad_on_batch,
+                    fill=fill,
+                    max_text_len=max_text_len,
+                    max_words=max_words,
+                    offset=offset,
+                    overwrite_split=True)
+        ds.replaceInput(data, split, 'text-features', id)
+
+
 def update_dataset_from_file(ds,
                              input_text_filename,
                              params,
@@ -109,14 +232,128 @@ def update_dataset_from_file(ds,
     return ds
 
 
+def set_eval_split(ds, params, split, text_files, raw_files, tokenization='tokenize_none', overwrite_split=False):
+    """
+    Sets the data of an evaluation split (val or test) of a Dataset built by build_dataset, whose vocabularies are
+    already built.
+    :param ds: Dataset instance
+    :param params: Parameters of the Dataset
+    :param split: Split to set
+    :param text_files: Dictionary {(split, language): text file}
+    :param raw_files: Dictionary {(split, language): original text file}, for ALIGN_FROM_RAW
+    :param tokenization: Tokenization applied to the text files
+    :param overwrite_split: Whether to replace the data of a split already set
+    :return: None
+    """
+    align_from_raw = params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False)
+    ds.setOutput(text_files[split, params['TRG_LAN']],
+                 split,
+                 type='dense_text' if 'sparse' in params['LOSS'] else 'text',
+                 id=params['OUTPUTS_IDS_DATASET'][0],
+                 pad_on_batch=params.get('PAD_ON_BATCH', True),
+                 tokenization=tokenization,
+                 sample_weights=params.get('SAMPLE_WEIGHTS', True),
+                 max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                 max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                 bpe_codes=params.get('BPE_CODES_PATH', None),
+                 label_smoothing=0.,
+                 overwrite_split=overwrite_split)
+    if align_from_raw and not overwrite_split:
+        ds.setRawOutput(raw_files[split, params['TRG_LAN']],
+                        split,
+                        type='file-name',
+                        id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
+    ds.setInput(text_files[split, params['SRC_LAN']],
+                split,
+                type='text',
+                id=params['INPUTS_IDS_DATASET'][0],
+                pad_on_batch=params.get('PAD_ON_BATCH', True),
+                tokenization=tokenization,
+                build_vocabulary=False,
+                fill=params.get('FILL', 'end'),
+                max_text_len=params.get('MAX_INPUT_TEXT_LEN', 70),
+                max_words=params.get('INPUT_VOCABULARY_SIZE', 0),
+                min_occ=params.get('MIN_OCCURRENCES_INPUT_VOCAB', 0),
+                bpe_codes=params.get('BPE_CODES_PATH', None),
+                overwrite_split=overwrite_split)
+    if len(params['INPUTS_IDS_DATASET']) > 1:
+        ds.setInput(None,
+                    split,
+                    type='ghost',
+                    id=params['INPUTS_IDS_DATASET'][-1],
+                    required=False,
+                    overwrite_split=overwrite_split)
+    if align_from_raw:
+        if overwrite_split:
+            # The raw data are just file names: setRawInput/setRawOutput would register their ids again
+            getattr(ds, 'X_raw_' + split)['raw_' + params['INPUTS_IDS_DATASET'][0]] = \
+                raw_files[split, params['SRC_LAN']]
+            getattr(ds, 'Y_raw_' + split)['raw_' + params['OUTPUTS_IDS_DATASET'][0]] = \
+                raw_files[split, params['TRG_LAN']]
+        else:
+            ds.setRawInput(raw_files[split, params['SRC_LAN']],
+                           split,
+                           type='file-name',
+                           id='raw_' + params['INPUTS_IDS_DATASET'][0])
+
+
+def tokenize_text_files(params, text_files):
+    """
+    Tokenizes the text files of a Dataset in parallel if params['TOKENIZATION_JOBS'] > 1 (see tokenize_files).
+    :param params: Parameters of the Dataset
+    :param text_files: Dictionary {(split, language): text file}
+    :return: Dictionary {(split, language): text file to load} and tokenization to apply when loading them
+    """
+    tokenization = params.get('TOKENIZATION_METHOD', 'tokenize_none')
+    if params.get('TOKENIZATION_JOBS', 1) > 1:
+        # Tokenize the files in parallel (or reuse their stored tokenizations) and load them as they are
+        name = params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
+        text_files = tokenize_files(text_files,
+                                    tokenization,
+                                    os.path.join(params['DATASET_STORE_PATH'], 'Dataset_' + name + '_tokenized'),
+                                    bpe_codes=params.get('BPE_CODES_PATH', None),
+                                    n_jobs=params['TOKENIZATION_JOBS'])
+        tokenization = 'tokenize_none'
+    return text_files, tokenization
+
+
 def build_dataset(params):
     """
     Builds (or loads) a Dataset instance.
+    If params['DATASET_CACHE'], the stored Dataset is reused while its fingerprint (its text files and the parameters
+    that determine its content, see dataset_cache) matches, regardless of params['REBUILD_DATASET']. When only the
+    files of the val or test splits changed, only these splits are rebuilt.
     :param params: Parameters specifying Dataset options
     :return: Dataset object
     """
+    base_path = params['DATA_ROOT_PATH']
+    name = params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
+    dataset_filename = params['DATASET_STORE_PATH'] + '/Dataset_' + name + '.pkl'
+    raw_files = dict()
+    for split in ['train', 'val', 'test']:
+        if params['TEXT_FILES'].get(split) is not None:
+            for lan in [params['SRC_LAN'], params['TRG_LAN']]:
+                raw_files[split, lan] = base_path + '/' + params['TEXT_FILES'][split] + lan
+
+    # Splits to (re)build: True for building the whole dataset
+    rebuild = params['REBUILD_DATASET']
+    fingerprint = None
+    if params.get('DATASET_CACHE', True):
+        fingerprint_filename = params['DATASET_STORE_PATH'] + '/Dataset_' + name + '.fingerprint'
+        previous_fingerprint = load_fingerprint(fingerprint_filename) if os.path.isfile(dataset_filename) else None
+        fingerprint = dataset_fingerprint(params, raw_files, previous_fingerprint)
+        if previous_fingerprint is not None:
+            rebuild = outdated_splits(previous_fingerprint, fingerprint)
+            if not rebuild:
+                logging.info('The stored dataset ' + dataset_filename + ' is up to date.')
+            elif 'train' in rebuild or any(split not in fingerprint['splits'] for split in rebuild):
+                logging.info('The stored dataset ' + dataset_filename + ' is outdated. Rebuilding it.')
+                rebuild = True
+            else:
+                logging.info('Rebuilding the ' + ', '.join(rebuild) + ' split(s) of the stored dataset ' +
+                             dataset_filename + '.')
 
-    if params['REBUILD_DATASET']:  # We build a new dataset instance
+    if rebuild is True:  # We build a new dataset instance
         if params['VERBOSE'] > 0:
             silence = False
             logging.info(
@@ -124,99 +361,134 @@ def build_dataset(params):
         else:
             silence = True
 
-        base_path = params['DATA_ROOT_PATH']
-        name = params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN']
-        ds = Dataset(name, base_path, silence=silence)
+        binary_corpus = params.get('BINARY_CORPUS', False)
+        if binary_corpus:
+            # The training split is stored as memory-mapped binary token-id corpora
+            if 'sparse' in params['LOSS']:
+                raise NotImplementedError('BINARY_CORPUS requires a non-sparse LOSS.')
+            ds = BinaryCorpusDataset(name, base_path, silence=silence)
+            binary_path = os.path.join(params['DATASET_STORE_PATH'], 'Dataset_' + name + '_binary')
+            if not os.path.isdir(binary_path):
+                os.makedirs(binary_path)
+            binary_trg = os.path.join(binary_path, 'train.' + params['TRG_LAN'])
+        else:
+            ds = Dataset(name, base_path, silence=silence)
+
+        text_files, tokenization = tokenize_text_files(params, raw_files)
+        align_from_raw = params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False)
 
         # OUTPUT DATA
-        # Let's load the train, val and test splits of the target language sentences (outputs)
+        # Let's load the train split of the target language sentences (outputs)
         #    the files include a sentence per line.
-        ds.setOutput(base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
-                     'train',
-                     type='dense_text' if 'sparse' in params['LOSS'] else 'text',
-                     id=params['OUTPUTS_IDS_DATASET'][0],
-                     tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
-                     build_vocabulary=True,
-                     pad_on_batch=params.get('PAD_ON_BATCH', True),
-                     sample_weights=params.get('SAMPLE_WEIGHTS', True),
-                     fill=params.get('FILL', 'end'),
-                     max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
-                     max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
-                     min_occ=params.get('MIN_OCCURRENCES_OUTPUT_VOCAB', 0),
-                     bpe_codes=params.get('BPE_CODES_PATH', None),
-                     label_smoothing=params.get('LABEL_SMOOTHING', 0.))
-        if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
-            ds.setRawOutput(base_path + '/' + params['TEXT_FILES']['train'] + params['TRG_LAN'],
+        if binary_corpus:
+            set_binary_text(ds,
+                            text_files['train', params['TRG_LAN']],
+                            binary_trg,
+                            'train',
+                            params['OUTPUTS_IDS_DATASET'][0],
+                            output=True,
+                            tokenization=tokenization,
+                            build_vocabulary=True,
+                            pad_on_batch=params.get('PAD_ON_BATCH', True),
+                            sample_weights=params.get('SAMPLE_WEIGHTS', True),
+                            fill=params.get('FILL', 'end'),
+                            max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                            max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                            min_occ=params.get('MIN_OCCURRENCES_OUTPUT_VOCAB', 0),
+                            bpe_codes=params.get('BPE_CODES_PATH', None),
+                            label_smoothing=params.get('LABEL_SMOOTHING', 0.))
+        else:
+            ds.setOutput(text_files['train', params['TRG_LAN']],
+                         'train',
+                         type='dense_text' if 'sparse' in params['LOSS'] else 'text',
+                         id=params['OUTPUTS_IDS_DATASET'][0],
+                         tokenization=tokenization,
+                         build_vocabulary=True,
+                         pad_on_batch=params.get('PAD_ON_BATCH', True),
+                         sample_weights=params.get('SAMPLE_WEIGHTS', True),
+                         fill=params.get('FILL', 'end'),
+                         max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                         max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                         min_occ=params.get('MIN_OCCURRENCES_OUTPUT_VOCAB', 0),
+                         bpe_codes=params.get('BPE_CODES_PATH', None),
+                         label_smoothing=params.get('LABEL_SMOOTHING', 0.))
+        if align_from_raw:
+            ds.setRawOutput(raw_files['train', params['TRG_LAN']],
                             'train',
                             type='file-name',
                             id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
 
-        for split in ['val', 'test']:
-            if params['TEXT_FILES'].get(split) is not None:
-                ds.setOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                             split,
-                             type='dense_text' if 'sparse' in params['LOSS'] else 'text',
-                             id=params['OUTPUTS_IDS_DATASET'][0],
-                             pad_on_batch=params.get('PAD_ON_BATCH', True),
-                             tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
-                             sample_weights=params.get('SAMPLE_WEIGHTS', True),
-                             max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
-                             max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
-                             bpe_codes=params.get('BPE_CODES_PATH', None),
-                             label_smoothing=0.)
-                if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
-                    ds.setRawOutput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                                    split,
-                                    type='file-name',
-                                    id='raw_' + params['OUTPUTS_IDS_DATASET'][0])
-
         # INPUT DATA
-        # We must ensure that the 'train' split is the first (for building the vocabulary)
-        for split in ['train', 'val', 'test']:
-            if params['TEXT_FILES'].get(split) is not None:
-                if split == 'train':
-                    build_vocabulary = True
-                else:
-                    build_vocabulary = False
-                ds.setInput(base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
-                            split,
-                            type='text',
-                            id=params['INPUTS_IDS_DATASET'][0],
+        # The 'train' split must be the first (for building the vocabulary)
+        if binary_corpus:
+            set_binary_text(ds,
+                            text_files['train', params['SRC_LAN']],
+                            os.path.join(binary_path, 'train.' + params['SRC_LAN']),
+                            'train',
+                            params['INPUTS_IDS_DATASET'][0],
                             pad_on_batch=params.get('PAD_ON_BATCH', True),
-                            tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
-                            build_vocabulary=build_vocabulary,
+                            tokenization=tokenization,
+                            build_vocabulary=True,
                             fill=params.get('FILL', 'end'),
                             max_text_len=params.get('MAX_INPUT_TEXT_LEN', 70),
                             max_words=params.get('INPUT_VOCABULARY_SIZE', 0),
                             min_occ=params.get('MIN_OCCURRENCES_INPUT_VOCAB', 0),
                             bpe_codes=params.get('BPE_CODES_PATH', None))
+        else:
+            ds.setInput(text_files['train', params['SRC_LAN']],
+                        'train',
+                        type='text',
+                        id=params['INPUTS_IDS_DATASET'][0],
+                        pad_on_batch=params.get('PAD_ON_BATCH', True),
+                        tokenization=tokenization,
+                        build_vocabulary=True,
+                        fill=params.get('FILL', 'end'),
+                        max_text_len=params.get('MAX_INPUT_TEXT_LEN', 70),
+                        max_words=params.get('INPUT_VOCABULARY_SIZE', 0),
+                        min_occ=params.get('MIN_OCCURRENCES_INPUT_VOCAB', 0),
+                        bpe_codes=params.get('BPE_CODES_PATH', None))
+
+        if len(params['INPUTS_IDS_DATASET']) > 1:
+            if binary_corpus:
+                # The state_below reuses the binary corpus of the target sentences
+                set_binary_text(ds,
+                                text_files['train', params['TRG_LAN']],
+                                binary_trg,
+                                'train',
+                                params['INPUTS_IDS_DATASET'][1],
+                                tokenization=tokenization,
+                                pad_on_batch=params.get('PAD_ON_BATCH', True),
+                                build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
+                                offset=1,
+                                fill=params.get('FILL', 'end'),
+                                max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                                max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                                bpe_codes=params.get('BPE_CODES_PATH', None),
+                                binarize=False)
+            else:
+                ds.setInput(text_files['train', params['TRG_LAN']],
+                            'train',
+                            type='text',
+                            id=params['INPUTS_IDS_DATASET'][1],
+                            required=False,
+                            tokenization=tokenization,
+                            pad_on_batch=params.get('PAD_ON_BATCH', True),
+                            build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
+                            offset=1,
+                            fill=params.get('FILL', 'end'),
+                            max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
+                            max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
+                            bpe_codes=params.get('BPE_CODES_PATH', None))
+        if align_from_raw:
+            ds.setRawInput(raw_files['train', params['SRC_LAN']],
+                           'train',
+                           type='file-name',
+                           id='raw_' + params['INPUTS_IDS_DATASET'][0])
 
-                if len(params['INPUTS_IDS_DATASET']) > 1:
-                    if 'train' in split:
-                        ds.setInput(base_path + '/' + params['TEXT_FILES'][split] + params['TRG_LAN'],
-                                    split,
-                                    type='text',
-                                    id=params['INPUTS_IDS_DATASET'][1],
-                                    required=False,
-                                    tokenization=params.get('TOKENIZATION_METHOD', 'tokenize_none'),
-                                    pad_on_batch=params.get('PAD_ON_BATCH', True),
-                                    build_vocabulary=params['OUTPUTS_IDS_DATASET'][0],
-                                    offset=1,
-                                    fill=params.get('FILL', 'end'),
-                                    max_text_len=params.get('MAX_OUTPUT_TEXT_LEN', 70),
-                                    max_words=params.get('OUTPUT_VOCABULARY_SIZE', 0),
-                                    bpe_codes=params.get('BPE_CODES_PATH', None))
-                    else:
-                        ds.setInput(None,
-                                    split,
-                                    type='ghost',
-                                    id=params['INPUTS_IDS_DATASET'][-1],
-                                    required=False)
-                if params.get('ALIGN_FROM_RAW', True) and not params.get('HOMOGENEOUS_BATCHES', False):
-                    ds.setRawInput(base_path + '/' + params['TEXT_FILES'][split] + params['SRC_LAN'],
-                                   split,
-                                   type='file-name',
-                                   id='raw_' + params['INPUTS_IDS_DATASET'][0])
+        # Let's load the val and test splits, with the vocabularies built from the train split
+        for split in ['val', 'test']:
+            if params['TEXT_FILES'].get(split) is not None:
+                set_eval_split(ds, params, split, text_files, raw_files, tokenization=tokenization)
 
         if params.get('POS_UNK', False):
             if params.get('HEURISTIC', 0) > 0:
@@ -230,12 +502,27 @@ def build_dataset(params):
 
     else:
         # We can easily recover it with a single line
-        ds = loadDataset(
-            params['DATASET_STORE_PATH'] + '/Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl')
+        ds = loadDataset(dataset_filename)
+
+        if rebuild:
+            # Only the files of some evaluation splits changed
+            previous_splits = previous_fingerprint['splits']
+            text_files, tokenization = tokenize_text_files(
+                params, dict((key, filepath) for key, filepath in raw_files.items() if key[0] in rebuild))
+            for split in rebuild:
+                set_eval_split(ds, params, split, text_files, raw_files, tokenization=tokenization,
+                               overwrite_split=split in previous_splits)
 
         # If we had multiple references per sentence
         keep_n_captions(ds, repeat=1, n=1, set_names=params['EVAL_ON_SETS'])
 
+        if rebuild:
+            saveDataset(ds, params['DATASET_STORE_PATH'])
+
+    if fingerprint is not None and (rebuild or previous_fingerprint is not None):
+        # The fingerprint also stores the modification times of the files, which may have changed
+        save_fingerprint(fingerprint, fingerprint_filename)
+
     return ds
 
 
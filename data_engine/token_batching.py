@@ -0,0 +1,125 @@
+import logging
+
+import numpy as np
+
+from data_engine.binary_corpus import MemmapText
+
+
+def text_lengths(ds, split, id, output=False):
+    """
+    Number of words of each sentence of a text input or output of a Dataset, as padded by the Dataset (including the
+    <eos> symbol and truncated to max_text_len).
+    :param ds: Dataset instance
+    :param split: Split of the sentences
+    :param id: Dataset id of the text
+    :param output: Whether the text is an output (or an input)
+    :return: Array of lengths
+    """
+    data = getattr(ds, ('Y_' if output else 'X_') + split)[id]
+    max_text_len = ds.max_text_len[id][split]
+    if isinstance(data, MemmapText):
+        return data.lengths()
+    lengths = np.asarray([len(sentence.split()) if isinstance(sentence, basestring) else len(sentence)
+                          for sentence in data], dtype='int64') + 1
+    return np.minimum(lengths, max_text_len)
+
+
+def token_batches(src_lengths, trg_lengths, max_tokens, bucket_width=1, max_batch_size=0, rng=None):
+    """
+    Groups sentences into batches of at most max_tokens source plus target tokens, counting the padding.
+    The lengths are rounded up to multiples of bucket_width, defining buckets of sentences of similar lengths. The
+    sentences are sorted by bucket and each batch is filled with consecutive sentences: since the buckets, and not the
+    sentences, determine the size of the batches, the number of batches does not change when shuffling.
+    :param src_lengths: Number of tokens of each source sentence
+    :param trg_lengths: Number of tokens of each target sentence
+    :param max_tokens: Maximum number of (padded) source plus target tokens of a batch. A sentence longer than
+                       max_tokens is a batch on its own.
+    :param bucket_width: Width of the length buckets. Wider buckets increase the padding and the randomness of the
+                         batches.
+    :param max_batch_size: Maximum number of sentences of a batch (0 for no limit)
+    :param rng: numpy RandomState for shuffling the sentences of each bucket and the order of the batches.
+                If None, the sentences are not shuffled.
+    :return: List of batches (arrays of sentence indices)
+    """
+    src_lengths = -(-np.asarray(src_lengths, dtype='int64') // bucket_width) * bucket_width
+    trg_lengths = -(-np.asarray(trg_lengths, dtype='int64') // bucket_width) * bucket_width
+    ties = rng.rand(len(src_lengths)) if rng is not None else np.arange(len(src_lengths))
+    order = np.lexsort((ties, src_lengths, trg_lengths))
+    batches = []
+    start = 0
+    max_src = max_trg = 0
+    for position, idx in enumerate(order):
+        batch_src = max(max_src, src_lengths[idx])
+        batch_trg = max(max_trg, trg_lengths[idx])
+        n_sentences = position - start
+        if n_sentences > 0 and ((n_sentences + 1) * (batch_src + batch_trg) > max_tokens or
+                                0 < max_batch_size <= n_sentences):
+            batches.append(order[start:position])
+            start = position
+            batch_src = src_lengths[idx]
+            batch_trg = trg_lengths[idx]
+        max_src = batch_src
+        max_trg = batch_trg
+    if start < len(order):
+        batches.append(order[start:])
+    if rng is not None:
+        rng.shuffle(batches)
+    return batches
+
+
+class TokenBatchGenerator:
+    def __init__(self, set_split, net, dataset, src_id, trg_id, max_tokens, bucket_width=1, max_batch_size=0,
+                 shuffle=True, seed=None):
+        """
+        Batch generator whose batches hold a similar number of tokens (see token_batches), instead of a fixed number of
+        sentences. The batches of each epoch are rebuilt from the length buckets, shuffling the sentences of each bucket
+        and the order of the batches.
+        :param set_split: Split (train, val, test) to retrieve data
+        :param net: Model_Wrapper which uses the data
+        :param dataset: Dataset instance
+        :param src_id: Dataset id of the source text input
+        :param trg_id: Dataset id of the target text output
+        :param max_tokens: Maximum number of source plus target tokens of a batch
+        :param bucket_width: Width of the length buckets
+        :param max_batch_size: Maximum number of sentences of a batch (0 for no limit)
+        :param shuffle: Whether to shuffle the batches of each epoch
+        :param seed: Seed of the shuffling
+        """
+        self.set_split = set_split
+        self.net = net
+        self.dataset = dataset
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.max_batch_size = max_batch_size
+        self.rng = np.random.RandomState(seed) if shuffle else None
+        self.src_lengths = text_lengths(dataset, set_split, src_id)
+        self.trg_lengths = text_lengths(dataset, set_split, trg_id, output=True)
+        self.batches = self.epoch_batches()
+        if not dataset.silence:
+            logging.info('Built %d batches of at most %d tokens for the %d sentences of the "%s" set.' %
+                         (len(self.batches), max_tokens, len(self.src_lengths), set_split))
+
+    def epoch_batches(self):
+        """
+        Batches of an epoch.
+        :return: List of batches (arrays of sentence indices)
+        """
+        return token_batches(self.src_lengths, self.trg_lengths, self.max_tokens, bucket_width=self.bucket_width,
+                             max_batch_size=self.max_batch_size, rng=self.rng)
+
+    def __len__(self):
+        """
+        Number of batches per epoch.
+        """
+        return len(self.batches)
+
+    def generator(self):
+        """
+        Gets and processes the data
+        :return: generator with the data
+        """
+        while True:
+            for batch in self.batches:
+                X_batch, Y_batch = self.dataset.getXY_FromIndices(self.set_split, batch)
+                yield self.net.prepareData(X_batch, Y_batch)
+            self.batches = self.epoch_batches()
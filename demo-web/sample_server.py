@@ -7,21 +7,29 @@ import time
 import sys
 import os
 import copy
+import threading
+import Queue
 import BaseHTTPServer
+import socket
 import urllib
 from collections import OrderedDict
 
+import numpy as np
+
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
 from keras_wrapper.beam_search_interactive import InteractiveBeamSearchSampler
-from keras_wrapper.cnn_model import loadModel, updateModel
+from keras_wrapper.cnn_model import loadModel
 from keras_wrapper.dataset import loadDataset
 from keras_wrapper.extra.isles_utils import *
 from keras_wrapper.extra.read_write import pkl2dict, list2file
 from keras_wrapper.online_trainer import OnlineTrainer
 from keras_wrapper.utils import decode_predictions_beam_search, flatten_list_of_lists
-from model_zoo import TranslationModel
+from model_zoo import TranslationModel, CUSTOM_OBJECTS, updateTranslationModel
 from online_models import build_online_models
+from utils.batched_search import BatchedBeamSearchEnsemble
+from utils.cache import LRUCache
 from utils.utils import update_parameters
+from utils.vocabulary import PrefixIndex
 from config_online import load_parameters as load_parameters_online
 from config import load_parameters
 
@@ -51,32 +59,90 @@ class NMTHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         if source_sentence is None:
             self.send_response(400)  # 400: ('Bad Request', 'Bad request syntax or unsupported method')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
             return
         source_sentence = urllib.unquote_plus(source_sentence)
         args_processing_end_time = time.time()
         logger.log(2, 'args_processing time: %.6f' % (args_processing_end_time - args_processing_start_time))
 
         generate_sample_start_time = time.time()
+        # With a scheduler, the model is only accessed from its worker thread
+        translator = getattr(self.server, 'scheduler', None) or self.server.sampler
         if learn and validated_prefix is not None and source_sentence is not None:
-            self.server.sampler.learn_from_sample(source_sentence, validated_prefix)
+            translator.learn_from_sample(source_sentence, validated_prefix)
             self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
 
         else:
-            hypothesis = self.server.sampler.generate_sample(source_sentence, validated_prefix=validated_prefix)
-            response = hypothesis + u'\n'
+            hypothesis = translator.generate_sample(source_sentence, validated_prefix=validated_prefix)
+            response = (hypothesis + u'\n').encode('utf-8')
             generate_sample_end_time = time.time()
             logger.log(2, 'args_processing time: %.6f' % (generate_sample_end_time - generate_sample_start_time))
             send_response_start_time = time.time()
             self.send_response(200)  # 200: ('OK', 'Request fulfilled, document follows')
             self.send_header("Content-type", "text/html")
+            self.send_header("Content-Length", str(len(response)))
             self.end_headers()
-            self.wfile.write(response.encode('utf-8'))
+            self.wfile.write(response)
             send_response_end_time = time.time()
             logger.log(2, 'send_response time: %.6f' % (send_response_end_time - send_response_start_time))
             do_GET_end_time = time.time()
             logger.log(2, 'do_GET time: %.6f' % (do_GET_end_time - do_GET_start_time))
 
 
+class KeepAliveNMTHandler(NMTHandler):
+    """
+    NMTHandler keeping HTTP/1.1 connections open between requests. Idle connections are closed after timeout seconds,
+    so they do not hold a worker of the pool forever.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = 10
+
+
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+    def __init__(self, server_address, RequestHandlerClass, n_workers=8, queue_size=32, retry_after=1):
+        """
+        HTTP server whose connections are handled by a fixed pool of worker threads. Connections arriving when
+        queue_size of them are already waiting for a worker are rejected with a 503 (Service Unavailable) response.
+        :param n_workers: Number of worker threads
+        :param queue_size: Maximum number of accepted connections waiting for a worker
+        :param retry_after: Seconds sent in the Retry-After header of the 503 responses
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.retry_after = retry_after
+        self.connections = Queue.Queue(maxsize=queue_size)
+        for n_worker in range(n_workers):
+            worker = threading.Thread(target=self._process_connections, name='HTTPWorker-%d' % n_worker)
+            worker.daemon = True
+            worker.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self.connections.put_nowait((request, client_address))
+        except Queue.Full:
+            logger.warning('Request queue full, rejecting connection from %s' % str(client_address))
+            try:
+                request.sendall('HTTP/1.1 503 Service Unavailable\r\n'
+                                'Retry-After: %d\r\n'
+                                'Content-Length: 0\r\n'
+                                'Connection: close\r\n\r\n' % self.retry_after)
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+
+    def _process_connections(self):
+        while True:
+            request, client_address = self.connections.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
 def parse_args():
     parser = argparse.ArgumentParser("Interactive neural machine translation server.")
     parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance")
@@ -96,6 +162,37 @@ def parse_args():
                                                       "\t 1: Debug messages."
                                                       "\t 2: Time monitoring messages.", type=int, default=0)
     parser.add_argument("-eos", "--eos-symbol", help="End-of-sentence symbol", type=str, default='/')
+    parser.add_argument("-bs", "--batch-size", help="Maximum number of concurrent requests translated together. "
+                                                    "If 1, requests are served one by one by the interactive sampler.",
+                        type=int, default=1)
+    parser.add_argument("-bw", "--batch-window", help="Time (in milliseconds) to wait for other requests to "
+                                                      "join a batch", type=float, default=10.)
+    parser.add_argument("-w", "--workers", help="Number of threads serving connections. If higher than 1 (or if "
+                                                "--batch-size is), connections are served concurrently and kept "
+                                                "alive.", type=int, default=1)
+    parser.add_argument("-q", "--queue-size", help="Maximum number of connections waiting for a worker. Further "
+                                                   "connections get a 503 response.", type=int, default=32)
+    parser.add_argument("--cache-size", help="Maximum number of translations kept in the cache (0 disables it)",
+                        type=int, default=1000)
+    parser.add_argument("--cache-memory", help="Maximum memory (in MB) used by the translation cache",
+                        type=float, default=64.)
+    parser.add_argument("--batched-search", help="Serve the single (isle-free) requests with the batched beam search, "
+                                                 "which reuses the encoder outputs and prefix states of the edited "
+                                                 "sentences, instead of the interactive sampler. It does not support "
+                                                 "max_N. Batches of requests (--batch-size) always use it.",
+                        action='store_true', default=False)
+    parser.add_argument("--encoder-cache-size", help="Maximum number of source sentences whose encoder outputs are "
+                                                     "kept in memory (0 disables the encoder cache)",
+                        type=int, default=100)
+    parser.add_argument("--encoder-cache-memory", help="Maximum memory (in MB) used by the encoder cache",
+                        type=float, default=256.)
+    parser.add_argument("--prefix-cache-size", help="Maximum number of decoder states of validated prefixes kept in "
+                                                    "memory (0 disables the prefix cache)",
+                        type=int, default=5000)
+    parser.add_argument("--prefix-cache-memory", help="Maximum memory (in MB) used by the prefix cache",
+                        type=float, default=256.)
+    parser.add_argument("--retry-after", help="Seconds that rejected clients are asked to wait (Retry-After header)",
+                        type=int, default=1)
 
     return parser.parse_args()
 
@@ -103,7 +200,9 @@ def parse_args():
 class NMTSampler:
     def __init__(self, models, dataset, params, params_prediction, params_training, model_tokenize_f, model_detokenize_f, general_tokenize_f,
                  general_detokenize_f, mapping=None, word2index_x=None, word2index_y=None, index2word_y=None,
-                 excluded_words=None, unk_id=1, eos_symbol='/', online=False, verbose=0):
+                 excluded_words=None, unk_id=1, eos_symbol='/', online=False, cache_size=1000,
+                 cache_memory=64 * 1024 ** 2, encoder_cache_size=100, encoder_cache_memory=256 * 1024 ** 2,
+                 prefix_cache_size=5000, prefix_cache_memory=256 * 1024 ** 2, batched_search=False, verbose=0):
         self.models = models
         self.dataset = dataset
         self.params = params
@@ -124,11 +223,28 @@ class NMTSampler:
         self.word2index_y = word2index_y if word2index_y is not None else \
             dataset.vocabulary[params_prediction['OUTPUTS_IDS_DATASET'][0]]['words2idx']
         self.unk_id = unk_id
+        # Whether generate_sample uses the batched beam search (and its caches) instead of the interactive sampler
+        self.batched_search = batched_search
+        # Target words sorted, for finding the completions of the last word of a prefix
+        self.word_prefix_index = PrefixIndex(self.word2index_y)
+        # Translations of the current models, keyed on (model_version, tokenized source, validated prefix)
+        self.model_version = 0
+        self.translation_cache = LRUCache(max_items=cache_size, max_bytes=cache_memory)
+        # Outputs of model_init (annotations and initial states) of the last sentences, reused while they are edited
+        self.encoder_cache = LRUCache(max_items=encoder_cache_size, max_bytes=encoder_cache_memory)
+        # Decoder states after each validated prefix, so a prefix extended by the user is not forced again
+        self.prefix_cache = LRUCache(max_items=prefix_cache_size, max_bytes=prefix_cache_memory)
         self.interactive_beam_searcher = InteractiveBeamSearchSampler(self.models,
                                                                       self.dataset,
                                                                       self.params_prediction,
                                                                       excluded_words=self.excluded_words,
                                                                       verbose=self.verbose)
+        self.batched_beam_searcher = BatchedBeamSearchEnsemble(self.models,
+                                                               self.dataset,
+                                                               self.params_prediction,
+                                                               init_cache=self.encoder_cache,
+                                                               prefix_cache=self.prefix_cache,
+                                                               verbose=self.verbose)
 
         # Compile Theano sampling function by generating a fake sample # TODO: Find a better way of doing this
         logger.info('Compiling sampler...')
@@ -153,16 +269,101 @@ class NMTSampler:
                         filtered_idx2word=None, unk_indices=None, unk_words=None):
 
         generate_sample_start_time = time.time()
-        if unk_indices is None:
-            unk_indices = []
-        if unk_words is None:
-            unk_words = []
+        request = self.prepare_sample(source_sentence, validated_prefix=validated_prefix,
+                                      filtered_idx2word=filtered_idx2word,
+                                      use_cache=isle_indices is None)
+        if request['hypothesis'] is not None:
+            return request['hypothesis']
+
+        if self.batched_search and isle_indices is None:
+            # Prefix-constrained search, reusing the encoder outputs of the sentence if it was already translated
+            self.search_samples([request])
+            trans_indices, alphas = request['trans_indices'], request['alphas']
+        else:
+            sample_beam_search_start_time = time.time()
+            trans_indices, costs, alphas = \
+                self.interactive_beam_searcher.sample_beam_search_interactive(request['src_seq'],
+                                                                              fixed_words=copy.copy(request['fixed_words']),
+                                                                              max_N=max_N,
+                                                                              isles=isle_indices,
+                                                                              valid_next_words=request['filtered_idx2word'],
+                                                                              idx2word=self.index2word_y)
+            sample_beam_search_end_time = time.time()
+            logger.log(2, 'sample_beam_search time: %.6f' % (sample_beam_search_end_time - sample_beam_search_start_time))
+
+        hypothesis = self.postprocess_sample(request, trans_indices, alphas)
+        generate_sample_end_time = time.time()
+        logger.log(2, 'generate_sample time: %.6f' % (generate_sample_end_time - generate_sample_start_time))
 
+        return hypothesis
+
+    def generate_samples(self, source_sentences, validated_prefixes=None):
+        """
+        Translates several requests at once.
+        :param source_sentences: List of source sentences
+        :param validated_prefixes: List of validated prefixes (or None) of each sentence
+        :return: List of hypotheses
+        """
+        generate_samples_start_time = time.time()
+        if validated_prefixes is None:
+            validated_prefixes = [None] * len(source_sentences)
+        requests = [self.prepare_sample(source_sentence, validated_prefix=validated_prefix)
+                    for source_sentence, validated_prefix in zip(source_sentences, validated_prefixes)]
+        self.search_samples([request for request in requests if request['hypothesis'] is None])
+        hypotheses = [request['hypothesis'] if request['hypothesis'] is not None else
+                      self.postprocess_sample(request, request['trans_indices'], request['alphas'])
+                      for request in requests]
+        generate_samples_end_time = time.time()
+        logger.log(2, 'generate_samples time (%d sentences): %.6f' %
+                   (len(requests), generate_samples_end_time - generate_samples_start_time))
+        return hypotheses
+
+    def search_samples(self, requests):
+        """
+        Runs the batched beam search for prepared requests, storing the best hypothesis of each one in its
+        'trans_indices' (and 'alphas'). Requests whose sources have the same length are decoded together, so the
+        batch padding never reaches the annotations seen by model_next.
+        :param requests: List of requests, as returned by prepare_sample
+        """
+        buckets = dict()
+        for request in requests:
+            buckets.setdefault(len(request['src_seq']), []).append(request)
+
+        for src_len, bucket in buckets.iteritems():
+            sample_beam_search_start_time = time.time()
+            X = {self.params_prediction['model_inputs'][0]: np.asarray([request['src_seq'] for request in bucket])}
+            fixed_words = [request['fixed_words'] for request in bucket]
+            valid_next_words = [request['filtered_idx2word'].keys() if request['filtered_idx2word'] else None
+                                for request in bucket]
+            trans_indices, alphas, _ = self.batched_beam_searcher.translate_batch(X,
+                                                                                  fixed_words=fixed_words,
+                                                                                  valid_next_words=valid_next_words)
+            sample_beam_search_end_time = time.time()
+            logger.log(2, 'batched_beam_search time (%d sentences): %.6f' %
+                       (len(bucket), sample_beam_search_end_time - sample_beam_search_start_time))
+            for request, request_trans_indices, request_alphas in zip(bucket, trans_indices, alphas):
+                request['trans_indices'] = request_trans_indices
+                request['alphas'] = request_alphas
+
+    def prepare_sample(self, source_sentence, validated_prefix=None, filtered_idx2word=None, use_cache=True):
+        """
+        Tokenizes a request and builds the constraints of the search from its validated prefix.
+        :return: Dictionary describing the request. Its 'hypothesis' is already set if no search is needed
+                 (e.g. if it was found in the translation cache).
+        """
         tokenization_start_time = time.time()
         tokenized_input = self.general_tokenize_f(source_sentence)
         tokenized_input = self.model_tokenize_f(tokenized_input)
         tokenization_end_time = time.time()
         logger.log(2, 'tokenization time: %.6f' % (tokenization_end_time - tokenization_start_time))
+
+        cache_key = None
+        if use_cache and filtered_idx2word is None:
+            cache_key = (self.model_version, tokenized_input, validated_prefix)
+            hypothesis = self.translation_cache.get(cache_key)
+            if hypothesis is not None:
+                logger.log(2, 'translation cache hit. %s' % str(self.translation_cache))
+                return {'hypothesis': hypothesis, 'cache_key': None}
         parse_input_start_time = time.time()
         src_seq, src_words = parse_input(tokenized_input, self.dataset, self.word2index_x)
         parse_input_end_time = time.time()
@@ -170,11 +371,19 @@ class NMTSampler:
 
         fixed_words_user = OrderedDict()
         unk_words_dict = OrderedDict()
+        request = {'tokenized_input': tokenized_input,
+                   'src_seq': src_seq,
+                   'fixed_words': fixed_words_user,
+                   'unk_words_dict': unk_words_dict,
+                   'filtered_idx2word': filtered_idx2word,
+                   'cache_key': cache_key,
+                   'hypothesis': None}
         # If the user provided some feedback...
         if validated_prefix is not None:
             next_correction = validated_prefix[-1]
             if next_correction == self.eos_symbol:
-                return validated_prefix[:-1].decode('utf-8')
+                request['hypothesis'] = validated_prefix[:-1].decode('utf-8')
+                return request
 
             # 2.2.4 Tokenize the prefix properly (possibly applying BPE)
             #  TODO: Here we are tokenizing the target language with the source language tokenizer
@@ -198,29 +407,24 @@ class NMTSampler:
             last_user_word_pos = fixed_words_user.keys()[-1]
             if next_correction != u' ':
                 last_user_word = tokenized_validated_prefix.split()[-1]
-                filtered_idx2word = dict((self.word2index_y[candidate_word], candidate_word)
-                                         for candidate_word in self.word2index_y
-                                         if candidate_word.decode('utf-8')[:len(last_user_word)] == last_user_word)
+                if isinstance(last_user_word, str):
+                    last_user_word = last_user_word.decode('utf-8')
+                filtered_idx2word = self.word_prefix_index.completions(last_user_word)
                 if filtered_idx2word != dict():
                     del fixed_words_user[last_user_word_pos]
                     if last_user_word_pos in unk_words_dict.keys():
                         del unk_words_dict[last_user_word_pos]
             else:
                 filtered_idx2word = dict()
+            request['filtered_idx2word'] = filtered_idx2word
             constrain_search_end_time = time.time()
             logger.log(2, 'constrain_search_end_time time: %.6f' % (constrain_search_end_time - constrain_search_start_time))
+        return request
 
-        sample_beam_search_start_time = time.time()
-        trans_indices, costs, alphas = \
-            self.interactive_beam_searcher.sample_beam_search_interactive(src_seq,
-                                                                          fixed_words=copy.copy(fixed_words_user),
-                                                                          max_N=max_N,
-                                                                          isles=isle_indices,
-                                                                          valid_next_words=filtered_idx2word,
-                                                                          idx2word=self.index2word_y)
-        sample_beam_search_end_time = time.time()
-        logger.log(2, 'sample_beam_search time: %.6f' % (sample_beam_search_end_time - sample_beam_search_start_time))
-
+    def postprocess_sample(self, request, trans_indices, alphas):
+        """
+        Decodes the hypothesis found for a request, restores the unknown words validated by the user and detokenizes it.
+        """
         # # Substitute possible unknown words in isles
         # unk_in_isles = []
         # for isle_idx, isle_sequence, isle_words in unks_in_isles:
@@ -229,7 +433,7 @@ class NMTSampler:
 
         if False and self.params_prediction['pos_unk']:
             alphas = [alphas]
-            sources = [tokenized_input]
+            sources = [request['tokenized_input']]
             heuristic = self.params_prediction['heuristic']
         else:
             alphas = None
@@ -255,8 +459,8 @@ class NMTSampler:
 
         # UNK words management
         unk_management_start_time = time.time()
-        unk_indices = unk_words_dict.keys()
-        unk_words = unk_words_dict.values()
+        unk_indices = request['unk_words_dict'].keys()
+        unk_words = request['unk_words_dict'].values()
         if len(unk_indices) > 0:  # If we added some UNK word
             hypothesis = hypothesis.split()
             if len(hypothesis) < len(unk_indices):  # The full hypothesis will be made up UNK words:
@@ -280,9 +484,8 @@ class NMTSampler:
         hypothesis_detokenization_end_time = time.time()
         logger.log(2, 'hypothesis_detokenization time: %.6f' % (hypothesis_detokenization_end_time - hypothesis_detokenization_start_time))
 
-        generate_sample_end_time = time.time()
-        logger.log(2, 'generate_sample time: %.6f' % (generate_sample_end_time - generate_sample_start_time))
-
+        if request['cache_key'] is not None:
+            self.translation_cache.put(request['cache_key'], hypothesis)
         return hypothesis
 
     def learn_from_sample(self, source_sentence, target_sentence):
@@ -320,12 +523,117 @@ class NMTSampler:
                                               loading_X=False)
         # 4.2 Train online!
         self.online_trainer.train_online([np.asarray([src_seq]), state_below], trg_seq, trg_words=[target_sentence])
+        # The weights changed: cached translations are outdated
+        self.model_version += 1
+        self.translation_cache.clear()
+        self.encoder_cache.clear()
+        self.prefix_cache.clear()
+
+
+class MicroBatchScheduler:
+    def __init__(self, sampler, max_batch_size=8, batch_window=0.01, batched_search=True):
+        """
+        Queue in front of a NMTSampler. Requests arriving within batch_window seconds of the first queued one (up to
+        max_batch_size of them) are decoded as a single batch by a worker thread, which is the only thread that
+        touches the models. Tokenization and postprocessing run in the threads of the callers. Online learning
+        requests are processed in arrival order between batches.
+        :param sampler: NMTSampler instance
+        :param max_batch_size: Maximum number of requests decoded together
+        :param batch_window: Maximum time (in seconds) that a request waits for others to join its batch
+        :param batched_search: Decode the requests with the batched beam search (sampler.search_samples). Otherwise,
+                               they are decoded one by one by the interactive sampler (sampler.generate_sample).
+        """
+        self.sampler = sampler
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.batched_search = batched_search
+        self.jobs = Queue.Queue()
+        self.worker = threading.Thread(target=self._serve, name='MicroBatchScheduler')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def generate_sample(self, source_sentence, validated_prefix=None):
+        if not self.batched_search:
+            return self._submit('sample', (source_sentence, validated_prefix))['result']
+        request = self.sampler.prepare_sample(source_sentence, validated_prefix=validated_prefix)
+        if request['hypothesis'] is not None:
+            return request['hypothesis']
+        self._submit('translate', request)
+        return self.sampler.postprocess_sample(request, request['trans_indices'], request['alphas'])
+
+    def learn_from_sample(self, source_sentence, target_sentence):
+        self._submit('learn', (source_sentence, target_sentence))
+
+    def _submit(self, kind, payload):
+        job = {'kind': kind,
+               'payload': payload,
+               'done': threading.Event(),
+               'result': None,
+               'error': None}
+        self.jobs.put(job)
+        job['done'].wait()
+        if job['error'] is not None:
+            raise job['error']
+        return job
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.jobs.get(timeout=remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            logger.log(2, 'micro-batch size: %d' % len(batch))
+            # Decode each run of consecutive translation requests together, so that learning requests keep their order
+            pending = []
+            for job in batch + [None]:
+                if job is not None and job['kind'] == 'translate':
+                    pending.append(job)
+                    continue
+                if pending:
+                    self._run(pending, self.sampler.search_samples, [pending_job['payload'] for pending_job in pending])
+                    pending = []
+                if job is None:
+                    continue
+                if job['kind'] == 'sample':
+                    self._run([job], self.sampler.generate_sample, *job['payload'])
+                else:
+                    self._run([job], self.sampler.learn_from_sample, *job['payload'])
+
+    @staticmethod
+    def _run(jobs, function, *args):
+        try:
+            result = function(*args)
+            for job in jobs:
+                job['result'] = result
+        except Exception as e:
+            logger.exception('Error while processing a batch of %d requests' % len(jobs))
+            for job in jobs:
+                job['error'] = e
+        for job in jobs:
+            job['done'].set()
 
 
 def main():
     args = parse_args()
     server_address = ('', args.port)
-    httpd = BaseHTTPServer.HTTPServer(server_address, NMTHandler)
+    concurrent = args.workers > 1 or args.batch_size > 1
+    if concurrent:
+        httpd = PooledHTTPServer(server_address, KeepAliveNMTHandler,
+                                 n_workers=max(args.workers, args.batch_size),
+                                 queue_size=args.queue_size,
+                                 retry_after=args.retry_after)
+    else:
+        httpd = BaseHTTPServer.HTTPServer(server_address, NMTHandler)
     logger.setLevel(args.logging_level)
     parameters = load_parameters()
     if args.config is not None:
@@ -389,7 +697,9 @@ def main():
     parameters_prediction['length_norm_factor'] = parameters.get('LENGTH_NORM_FACTOR', 0.0)
     parameters_prediction['coverage_norm_factor'] = parameters.get('COVERAGE_NORM_FACTOR', 0.0)
     parameters_prediction['pos_unk'] = parameters.get('POS_UNK', False)
+    parameters_prediction['beam_batch_size'] = parameters.get('BEAM_BATCH_SIZE', 0)
     parameters_prediction['heuristic'] = parameters.get('HEURISTIC', 0)
+    parameters_prediction['state_below_index'] = -1
 
     parameters_prediction['state_below_maxlen'] = -1 if parameters.get('PAD_ON_BATCH', True) \
         else parameters.get('MAX_OUTPUT_TEXT_LEN', 50)
@@ -443,7 +753,8 @@ def main():
                                             store_path=parameters['STORE_PATH'],
                                             set_optimizer=False)
                            for i in range(len(args.models))]
-        models = [updateModel(model, path, -1, full_path=True) for (model, path) in zip(model_instances, args.models)]
+        models = [updateTranslationModel(model, path, -1, full_path=True)
+                  for (model, path) in zip(model_instances, args.models)]
 
         # Set additional inputs to models if using a custom loss function
         parameters['USE_CUSTOM_LOSS'] = True if 'PAS' in parameters['OPTIMIZER'] else False
@@ -451,7 +762,12 @@ def main():
             logging.info('Using N-best optimizer')
         models = build_online_models(models, parameters)
     else:
-        models = [loadModel(m, -1, full_path=True) for m in args.models]
+        models = [loadModel(m, -1, full_path=True, custom_objects=CUSTOM_OBJECTS) for m in args.models]
+    parameters_prediction['attend_on_output'] = parameters.get('ATTEND_ON_OUTPUT',
+                                                               all(getattr(model, 'attend_on_output',
+                                                                           'transformer' in
+                                                                           parameters['MODEL_TYPE'].lower())
+                                                                   for model in models))
 
     parameters['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[parameters['INPUTS_IDS_DATASET'][0]]
     parameters['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[parameters['OUTPUTS_IDS_DATASET'][0]]
@@ -468,9 +784,22 @@ def main():
                                            tokenize_general, detokenize_general,
                                            mapping=mapping, word2index_x=word2index_x, word2index_y=word2index_y,
                                            index2word_y=index2word_y, eos_symbol=args.eos_symbol,
-                                           excluded_words=excluded_words, online=args.online, verbose=args.verbose)
+                                           excluded_words=excluded_words, online=args.online,
+                                           cache_size=args.cache_size,
+                                           cache_memory=int(args.cache_memory * 1024 ** 2),
+                                           encoder_cache_size=args.encoder_cache_size,
+                                           encoder_cache_memory=int(args.encoder_cache_memory * 1024 ** 2),
+                                           prefix_cache_size=args.prefix_cache_size,
+                                           prefix_cache_memory=int(args.prefix_cache_memory * 1024 ** 2),
+                                           batched_search=args.batched_search,
+                                           verbose=args.verbose)
 
     httpd.sampler = interactive_beam_searcher
+    if concurrent:
+        httpd.scheduler = MicroBatchScheduler(interactive_beam_searcher,
+                                              max_batch_size=args.batch_size,
+                                              batch_window=args.batch_window / 1000.,
+                                              batched_search=args.batch_size > 1 or args.batched_search)
 
     logger.info('Server starting at localhost: %s' % str(args.port))
     httpd.serve_forever()
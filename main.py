@@ -1,13 +1,16 @@
 import argparse
 import ast
+import os
 from timeit import default_timer as timer
 
 from config import load_parameters
 from data_engine.prepare_data import build_dataset, update_dataset_from_file
-from keras_wrapper.cnn_model import loadModel, updateModel
+from keras_wrapper.cnn_model import loadModel
 from keras_wrapper.dataset import loadDataset, saveDataset
 from keras_wrapper.extra.callbacks import *
-from model_zoo import TranslationModel
+from model_zoo import TranslationModel, CUSTOM_OBJECTS, updateTranslationModel
+from utils.async_evaluation import AsyncEvaluation
+from utils.mt_metrics import register_metrics
 from utils.utils import update_parameters
 
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
@@ -104,7 +107,8 @@ def train_model(params, load_dataset=None):
     nmt_model.setOutputsMapping(outputMapping)
 
     if params['RELOAD'] > 0:
-        nmt_model = updateModel(nmt_model, params['STORE_PATH'], params['RELOAD'], reload_epoch=params['RELOAD_EPOCH'])
+        nmt_model = updateTranslationModel(nmt_model, params['STORE_PATH'], params['RELOAD'],
+                                           reload_epoch=params['RELOAD_EPOCH'])
         nmt_model.setParams(params)
         nmt_model.setOptimizer()
         if params.get('EPOCH_OFFSET') is None:
@@ -126,6 +130,8 @@ def train_model(params, load_dataset=None):
                        'homogeneous_batches': params['HOMOGENEOUS_BATCHES'],
                        'maxlen': params['MAX_OUTPUT_TEXT_LEN'],
                        'joint_batches': params['JOINT_BATCHES'],
+                       'max_tokens': params.get('MAX_TOKENS', 0),  # token-based batching parameters
+                       'bucket_width': params.get('BUCKET_WIDTH', 1),
                        'lr_decay': params.get('LR_DECAY', None),  # LR decay parameters
                        'reduce_each_epochs': params.get('LR_REDUCE_EACH_EPOCHS', True),
                        'start_reduction_on_epoch': params.get('LR_START_REDUCTION_ON_EPOCH', 0),
@@ -142,7 +148,9 @@ def train_model(params, load_dataset=None):
                        'epoch_offset': params.get('EPOCH_OFFSET', 0),
                        'data_augmentation': params['DATA_AUGMENTATION'],
                        'patience': params.get('PATIENCE', 0),  # early stopping parameters
-                       'metric_check': params.get('STOP_METRIC', None) if params.get('EARLY_STOP', False) else None,
+                       # The asynchronous evaluation applies the early stopping when its results arrive
+                       'metric_check': params.get('STOP_METRIC', None) if params.get('EARLY_STOP', False) and
+                       not params.get('ASYNC_EVALUATION', False) else None,
                        'eval_on_epochs': params.get('EVAL_EACH_EPOCHS', True),
                        'each_n_epochs': params.get('EVAL_EACH', 1),
                        'start_eval_on_epoch': params.get('START_EVAL_ON_EPOCH', 0),
@@ -186,9 +194,11 @@ def apply_NMT_model(params, load_dataset=None):
     params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
 
     # Load model
-    nmt_model = loadModel(params['STORE_PATH'], params['RELOAD'], reload_epoch=params['RELOAD_EPOCH'])
+    nmt_model = loadModel(params['STORE_PATH'], params['RELOAD'], reload_epoch=params['RELOAD_EPOCH'],
+                          custom_objects=CUSTOM_OBJECTS)
 
     # Evaluate training
+    register_metrics()
     extra_vars = {'language': params.get('TRG_LAN', 'en'),
                   'n_parallel_loaders': params['PARALLEL_LOADERS'],
                   'tokenize_f': eval('dataset.' + params['TOKENIZATION_METHOD']),
@@ -224,7 +234,9 @@ def apply_NMT_model(params, load_dataset=None):
         extra_vars['output_max_length_depending_on_x_factor'] = params.get('MAXLEN_GIVEN_X_FACTOR', 3)
         extra_vars['output_min_length_depending_on_x'] = params.get('MINLEN_GIVEN_X', True)
         extra_vars['output_min_length_depending_on_x_factor'] = params.get('MINLEN_GIVEN_X_FACTOR', 2)
-        extra_vars['attend_on_output'] = params.get('ATTEND_ON_OUTPUT', 'transformer' in params['MODEL_TYPE'].lower())
+        extra_vars['attend_on_output'] = params.get('ATTEND_ON_OUTPUT',
+                                                    getattr(nmt_model, 'attend_on_output',
+                                                            'transformer' in params['MODEL_TYPE'].lower()))
 
         if params['POS_UNK']:
             extra_vars['heuristic'] = params['HEURISTIC']
@@ -274,6 +286,7 @@ def buildCallbacks(params, model, dataset):
 
     if params['METRICS'] or params['SAMPLE_ON_SETS']:
         # Evaluate training
+        register_metrics()
         extra_vars = {'language': params.get('TRG_LAN', 'en'),
                       'n_parallel_loaders': params['PARALLEL_LOADERS'],
                       'tokenize_f': eval('dataset.' + params.get('TOKENIZATION_METHOD', 'tokenize_none')),
@@ -309,7 +322,9 @@ def buildCallbacks(params, model, dataset):
             extra_vars['output_max_length_depending_on_x_factor'] = params.get('MAXLEN_GIVEN_X_FACTOR', 3)
             extra_vars['output_min_length_depending_on_x'] = params.get('MINLEN_GIVEN_X', True)
             extra_vars['output_min_length_depending_on_x_factor'] = params.get('MINLEN_GIVEN_X_FACTOR', 2)
-            extra_vars['attend_on_output'] = params.get('ATTEND_ON_OUTPUT', 'transformer' in params['MODEL_TYPE'].lower())
+            extra_vars['attend_on_output'] = params.get('ATTEND_ON_OUTPUT',
+                                                        getattr(model, 'attend_on_output',
+                                                                'transformer' in params['MODEL_TYPE'].lower()))
 
             if params['POS_UNK']:
                 extra_vars['heuristic'] = params['HEURISTIC']
@@ -344,6 +359,25 @@ def buildCallbacks(params, model, dataset):
                                                                              save_each_evaluation=params[
                                                                                  'SAVE_EACH_EVALUATION'],
                                                                              verbose=params['VERBOSE'])
+            if params.get('ASYNC_EVALUATION', False):
+                # Evaluate in a background process, which applies the callback above to the stored models
+                dataset_filename = params['DATASET_STORE_PATH'] + '/Dataset_' + dataset.name + '.pkl'
+                if not os.path.isfile(dataset_filename):
+                    saveDataset(dataset, model.model_path)
+                    dataset_filename = model.model_path + '/Dataset_' + dataset.name + '.pkl'
+                callback_metric = AsyncEvaluation(model,
+                                                  params['STORE_PATH'] + '/config.pkl',
+                                                  dataset_filename,
+                                                  each_n_epochs=params['EVAL_EACH'],
+                                                  eval_on_epochs=params['EVAL_EACH_EPOCHS'],
+                                                  start_eval_on_epoch=params['START_EVAL_ON_EPOCH'],
+                                                  reload_epoch=params['RELOAD'],
+                                                  metric_check=params.get('STOP_METRIC', None) if params.get(
+                                                      'EARLY_STOP', False) else None,
+                                                  patience=params.get('PATIENCE', 0),
+                                                  epochs_for_save=params['EPOCHS_FOR_SAVE'],
+                                                  devices=params.get('ASYNC_EVALUATION_DEVICES', None),
+                                                  verbose=params['VERBOSE'])
 
             callbacks.append(callback_metric)
 
@@ -1,12 +1,21 @@
+import copy
 import logging
 import os
 
+from keras import backend as K
+from keras.callbacks import TensorBoard
 from keras.layers import *
-from keras.models import model_from_json, Model
+from keras.models import model_from_json, load_model, Model
 from keras.optimizers import Adam, RMSprop, Nadam, Adadelta, SGD, Adagrad, Adamax
 from keras.regularizers import l2, AlphaRegularizer
-from keras_wrapper.cnn_model import Model_Wrapper
+from keras.utils.generic_utils import get_custom_objects
+from keras_wrapper.cnn_model import Model_Wrapper, saveModel
+from keras_wrapper.extra.callbacks import EarlyStopping, LearningRateReducer, StoreModelWeightsOnEpochEnd
 from keras_wrapper.extra.regularize import Regularize
+from keras_wrapper.utils import checkParameters
+
+from data_engine.token_batching import TokenBatchGenerator
+from utils.word_vectors import pretrained_embedding_weights
 
 
 def getPositionalEncodingWeights(input_dim, output_dim, name='', verbose=True):
@@ -27,6 +36,244 @@ def getPositionalEncodingWeights(input_dim, output_dim, name='', verbose=True):
     return [position_enc]
 
 
+def getDecodedWords(inputs):
+    """
+    Words of the sequence decoded by an incremental decoder, with ones in place of the cached positions: the positions
+    of the sequence (see PositionLayer) are the ones of the full sequence.
+    :param inputs: [Words being decoded (batch_size, 1), cached states (batch_size, n_positions, dim)]
+    :return: Sequence (batch_size, n_positions + 1)
+    """
+    from keras import backend as K
+    cached_words = K.cast(K.ones_like(inputs[1][:, :, 0]), K.dtype(inputs[0]))
+    return K.concatenate([cached_words, inputs[0]], axis=1)
+
+
+def getDecodedWordsShape(input_shapes):
+    n_positions = input_shapes[1][1] + 1 if input_shapes[1][1] is not None else None
+    return input_shapes[0][0], n_positions
+
+
+def getLastTimestep(x):
+    """
+    Last timestep of a sequence.
+    :param x: Sequence (batch_size, n_timesteps, ...)
+    :return: Last timestep (batch_size, 1, ...)
+    """
+    return x[:, -1:]
+
+
+def getLastTimestepShape(input_shape):
+    return (input_shape[0], 1) + tuple(input_shape[2:])
+
+
+def getLastTimestepMask(x, mask=None):
+    return mask[:, -1:] if mask is not None else None
+
+
+class ProjectedContextMixin(object):
+    """
+    Attentional RNN decoder (Att*Cond layer) whose attention projection of the context (context * Ua + ba) can be
+    computed once per sentence. The sampling models call the decoder of the training model (sharing its weights) with
+    other inputs:
+        * context (batch_size, n_timesteps, context_dim): Its projection (batch_size, n_timesteps, att_units), computed
+          by model_init.
+        * Inputs of the decoder + [projected context]: Decoder using the given projection instead of computing it
+          (model_next).
+    """
+
+    def projected_call(self, inputs):
+        # Whether the projected context is given as an additional input
+        return isinstance(inputs, list) and len(inputs) > self.num_inputs
+
+    def build(self, input_shape):
+        if not isinstance(input_shape, list):
+            raise ValueError('The layer %s must be called on its inputs before projecting a context.' % self.name)
+        super(ProjectedContextMixin, self).build(input_shape[:self.num_inputs])
+
+    def assert_input_compatibility(self, inputs):
+        if isinstance(inputs, list):
+            super(ProjectedContextMixin, self).assert_input_compatibility(inputs[:self.num_inputs])
+
+    def project_context(self, context):
+        projected_context = K.dot(context, self.attention_context_kernel)
+        if self.use_bias:
+            projected_context = K.bias_add(projected_context, self.bias_ba)
+        return projected_context
+
+    def call(self, inputs, mask=None, **kwargs):
+        if not isinstance(inputs, list):
+            return self.project_context(inputs)
+        self.projected_context = inputs[self.num_inputs] if self.projected_call(inputs) else None
+        mask = mask[:self.num_inputs] if isinstance(mask, list) else mask
+        return super(ProjectedContextMixin, self).call(inputs[:self.num_inputs], mask=mask, **kwargs)
+
+    def get_constants(self, *args, **kwargs):
+        output = super(ProjectedContextMixin, self).get_constants(*args, **kwargs)
+        if getattr(self, 'projected_context', None) is not None:
+            constants = output[0] if isinstance(output, tuple) else output
+            constants[self.projected_context_index(constants)] = self.projected_context
+        return output
+
+    def projected_context_index(self, constants):
+        """
+        Position of the projection of the context among the constants of the step function: the only tensor with its
+        shape (batch_size, n_timesteps, att_units), besides the context itself.
+        """
+        shape = K.int_shape(self.projected_context)[2:]
+        tensors = [(i, constant) for i, constant in enumerate(constants)
+                   if constant is not self.context and not isinstance(constant, (list, tuple)) and not np.isscalar(constant)]
+        positions = [i for i, tensor in tensors if K.ndim(tensor) == 3 and K.int_shape(tensor)[2:] == shape]
+        if len(positions) != 1:
+            raise NotImplementedError('The projected context of the layer %s cannot be identified among its %d '
+                                      'constants.' % (self.name, len(constants)))
+        return positions[0]
+
+    def compute_output_shape(self, input_shape):
+        if not isinstance(input_shape, list):
+            return input_shape[:2] + (K.int_shape(self.attention_context_kernel)[1],)
+        return super(ProjectedContextMixin, self).compute_output_shape(input_shape[:self.num_inputs])
+
+    def compute_mask(self, inputs, mask=None):
+        if not isinstance(inputs, list):
+            return mask
+        mask = mask[:self.num_inputs] if isinstance(mask, list) else mask
+        return super(ProjectedContextMixin, self).compute_mask(inputs[:self.num_inputs], mask)
+
+
+class ProjectedContextAttLSTMCond(ProjectedContextMixin, AttLSTMCond):
+    pass
+
+
+class ProjectedContextAttGRUCond(ProjectedContextMixin, AttGRUCond):
+    pass
+
+
+class ProjectedContextAttConditionalLSTMCond(ProjectedContextMixin, AttConditionalLSTMCond):
+    pass
+
+
+class ProjectedContextAttConditionalGRUCond(ProjectedContextMixin, AttConditionalGRUCond):
+    pass
+
+
+class IncrementalMultiHeadAttention(MultiHeadAttention):
+    """
+    MultiHeadAttention that can also decode incrementally, used for the masked self-attention of the Transformer decoder.
+    The sampling models call the layer of the training model (sharing its weights) with other inputs:
+        * [queries, keys]: Multi-head attention (training model).
+        * sequence (batch_size, n_positions, dim): Its keys and values (batch_size, n_positions, dmodel), as cached by
+          model_init.
+        * [current position (batch_size, 1, dim), keys, values]: Attention of a single position on the cached keys and
+          values of the previous positions plus its own ones, so no mask of the future positions is needed (model_next).
+          Outputs [attention (batch_size, 1, dmodel), keys, values], with the current position appended to the keys and
+          values. The dropout of the attention is not applied.
+    """
+
+    def build(self, input_shape):
+        # The weights are the ones of the self-attention of the (first) input
+        shape = input_shape[0] if isinstance(input_shape, list) else input_shape
+        super(IncrementalMultiHeadAttention, self).build([shape, shape])
+
+    def assert_input_compatibility(self, inputs):
+        # Only the inputs of the multi-head attention are checked, the other calls depend on their number
+        if isinstance(inputs, list) and len(inputs) == 2:
+            super(IncrementalMultiHeadAttention, self).assert_input_compatibility(inputs)
+
+    def project(self, x, name):
+        # Input projection of the queries ('q'), keys ('k') or values ('v')
+        x = K.dot(x, getattr(self, 'w' + name))
+        if self.use_bias:
+            x = K.bias_add(x, getattr(self, 'b' + name))
+        return self.activation(x)
+
+    def split_heads(self, x):
+        # (batch_size, n_positions, dmodel) -> (batch_size * n_heads, n_positions, dmodel / n_heads)
+        dk = K.int_shape(self.wq)[1] // self.n_heads
+        x = K.reshape(x, (K.shape(x)[0], K.shape(x)[1], self.n_heads, dk))
+        x = K.permute_dimensions(x, (0, 2, 1, 3))
+        return K.reshape(x, (-1, K.shape(x)[2], dk))
+
+    def call(self, inputs, mask=None):
+        if not isinstance(inputs, list):
+            return [self.project(inputs, 'k'), self.project(inputs, 'v')]
+        if len(inputs) == 2:
+            return super(IncrementalMultiHeadAttention, self).call(inputs, mask=mask)
+
+        query, prev_keys, prev_values = inputs
+        keys = K.concatenate([prev_keys, self.project(query, 'k')], axis=1)
+        values = K.concatenate([prev_values, self.project(query, 'v')], axis=1)
+        queries_ = self.split_heads(self.project(query, 'q'))
+        keys_ = self.split_heads(keys)
+        values_ = self.split_heads(values)
+
+        # Attention of the current position on all of them: (batch_size * n_heads, 1, n_positions)
+        scores = K.batch_dot(queries_, keys_, axes=[2, 2]) / np.sqrt(K.int_shape(queries_)[2])
+        scores = K.exp(scores - K.max(scores, axis=-1, keepdims=True))
+        scores /= K.sum(scores, axis=-1, keepdims=True)
+        attended = K.batch_dot(scores, values_, axes=[2, 1])
+
+        # Concatenate the heads: (batch_size, 1, dmodel)
+        dmodel = K.int_shape(self.wq)[1]
+        attended = K.reshape(attended, (-1, self.n_heads, 1, dmodel // self.n_heads))
+        attended = K.reshape(K.permute_dimensions(attended, (0, 2, 1, 3)), (-1, 1, dmodel))
+        output = K.dot(attended, self.wo)
+        if self.use_bias:
+            output = K.bias_add(output, self.bo)
+        return [output, keys, values]
+
+    def compute_output_shape(self, input_shape):
+        dmodel = K.int_shape(self.wq)[1]
+        if not isinstance(input_shape, list):
+            return [(input_shape[0], input_shape[1], dmodel)] * 2
+        if len(input_shape) == 2:
+            return super(IncrementalMultiHeadAttention, self).compute_output_shape(input_shape)
+        n_positions = input_shape[1][1] + 1 if input_shape[1][1] is not None else None
+        return [(input_shape[0][0], 1, dmodel),
+                (input_shape[1][0], n_positions, dmodel),
+                (input_shape[2][0], n_positions, dmodel)]
+
+    def compute_mask(self, inputs, mask=None):
+        if not isinstance(inputs, list):
+            return [mask, mask]
+        if len(inputs) == 2:
+            return super(IncrementalMultiHeadAttention, self).compute_mask(inputs, mask)
+        return [mask[0] if isinstance(mask, list) else mask, None, None]
+
+
+def updateTranslationModel(model, model_path, update_num, reload_epoch=True, full_path=False):
+    """
+    Loads the weights of a stored model into a TranslationModel (see keras_wrapper.cnn_model.updateModel). Only the
+    weights of the training model are loaded: the sampling models (model_init and model_next) share all their layers
+    with it, so the stored ones are not needed, and may have another structure (e.g. stored by previous versions).
+    :param model: TranslationModel to update
+    :param model_path: Path to the stored models
+    :param update_num: Identifier of the number of epochs/updates elapsed
+    :param reload_epoch: Whether update_num is an epoch or an update
+    :param full_path: Whether model_path is the full path of the model (instead of its folder)
+    :return: Updated TranslationModel
+    """
+    if not full_path:
+        model_path = model_path + ('/epoch_' if reload_epoch else '/update_') + str(update_num)
+    logging.info("<<< Updating model " + model.name + " from " + model_path + " ... >>>")
+    try:
+        model.model.set_weights(load_model(model_path + '.h5', compile=False).get_weights())
+    except Exception as e:
+        logging.info(str(e))
+        logging.info("<<< Failed -> Loading model weights from " + model_path + "_weights.h5 ... >>>")
+        model.model.load_weights(model_path + '_weights.h5')
+    return model
+
+
+# Layers of the sampling models that are not part of Keras. They are registered as custom objects, for loading the
+# stored models (see keras_wrapper.cnn_model.loadModel).
+CUSTOM_OBJECTS = dict((layer.__name__, layer) for layer in [ProjectedContextAttLSTMCond,
+                                                            ProjectedContextAttGRUCond,
+                                                            ProjectedContextAttConditionalLSTMCond,
+                                                            ProjectedContextAttConditionalGRUCond,
+                                                            IncrementalMultiHeadAttention])
+get_custom_objects().update(CUSTOM_OBJECTS)
+
+
 class TranslationModel(Model_Wrapper):
     """
     Translation model class. Instance of the Model_Wrapper class (see staged_keras_wrapper).
@@ -85,15 +332,11 @@ class TranslationModel(Model_Wrapper):
         if params['SRC_PRETRAINED_VECTORS'] is not None:
             if self.verbose > 0:
                 logging.info("<<< Loading pretrained word vectors from:  " + params['SRC_PRETRAINED_VECTORS'] + " >>>")
-            src_word_vectors = np.load(os.path.join(params['SRC_PRETRAINED_VECTORS'])).item()
-            self.src_embedding_weights = np.random.rand(params['INPUT_VOCABULARY_SIZE'],
-                                                        params['SOURCE_TEXT_EMBEDDING_SIZE'])
-            for word, index in self.vocabularies[self.ids_inputs[0]]['words2idx'].iteritems():
-                if src_word_vectors.get(word) is not None:
-                    self.src_embedding_weights[index, :] = src_word_vectors[word]
-            self.src_embedding_weights = [self.src_embedding_weights]
+            self.src_embedding_weights = [pretrained_embedding_weights(params['SRC_PRETRAINED_VECTORS'],
+                                                                       self.vocabularies[self.ids_inputs[0]]['words2idx'],
+                                                                       params['INPUT_VOCABULARY_SIZE'],
+                                                                       params['SOURCE_TEXT_EMBEDDING_SIZE'])]
             self.src_embedding_weights_trainable = params['SRC_PRETRAINED_VECTORS_TRAINABLE'] and params.get('TRAINABLE_ENCODER', True)
-            del src_word_vectors
 
         else:
             self.src_embedding_weights = None
@@ -103,15 +346,11 @@ class TranslationModel(Model_Wrapper):
         if params['TRG_PRETRAINED_VECTORS'] is not None:
             if self.verbose > 0:
                 logging.info("<<< Loading pretrained word vectors from: " + params['TRG_PRETRAINED_VECTORS'] + " >>>")
-            trg_word_vectors = np.load(os.path.join(params['TRG_PRETRAINED_VECTORS'])).item()
-            self.trg_embedding_weights = np.random.rand(params['OUTPUT_VOCABULARY_SIZE'],
-                                                        params['TARGET_TEXT_EMBEDDING_SIZE'])
-            for word, index in self.vocabularies[self.ids_outputs[0]]['words2idx'].iteritems():
-                if trg_word_vectors.get(word) is not None:
-                    self.trg_embedding_weights[index, :] = trg_word_vectors[word]
-            self.trg_embedding_weights = [self.trg_embedding_weights]
+            self.trg_embedding_weights = [pretrained_embedding_weights(params['TRG_PRETRAINED_VECTORS'],
+                                                                       self.vocabularies[self.ids_outputs[0]]['words2idx'],
+                                                                       params['OUTPUT_VOCABULARY_SIZE'],
+                                                                       params['TARGET_TEXT_EMBEDDING_SIZE'])]
             self.trg_embedding_weights_trainable = params['TRG_PRETRAINED_VECTORS_TRAINABLE'] and params.get('TRAINABLE_DECODER', True)
-            del trg_word_vectors
         else:
             self.trg_embedding_weights = None
             self.trg_embedding_weights_trainable = params.get('TRAINABLE_DECODER', True)
@@ -147,6 +386,113 @@ class TranslationModel(Model_Wrapper):
     def setParams(self, params):
         self.params = params
 
+    def set_default_params(self):
+        """
+        Sets the default params of the Model_Wrapper, plus the parameters of the token-based batching of trainNet.
+        :return:
+        """
+        super(TranslationModel, self).set_default_params()
+        self.default_training_params['max_tokens'] = 0
+        self.default_training_params['bucket_width'] = 1
+        self.default_training_params['max_batch_size'] = 0
+
+    def trainNet(self, ds, parameters=None, out_name=None):
+        """
+        Trains the network on the given dataset (see Model_Wrapper.trainNet).
+        If parameters['max_tokens'] > 0, the training batches hold up to max_tokens source plus target tokens (including
+        the padding), built from length buckets of parameters['bucket_width'] words (see
+        data_engine.token_batching.token_batches), instead of parameters['batch_size'] sentences.
+        :param ds: Dataset with the training data
+        :param parameters: dict() with the training parameters
+        :param out_name: name of the output node that will be used to evaluate the network accuracy.
+        :return:
+        """
+        if parameters is None:
+            parameters = dict()
+        if parameters.get('max_tokens', 0) <= 0:
+            return super(TranslationModel, self).trainNet(ds, parameters, out_name=out_name)
+
+        params = checkParameters(parameters, self.default_training_params, hard_check=True)
+        if params['lr_decay'] is not None and 'start_reduction_on_epoch' not in list(parameters):
+            params['start_reduction_on_epoch'] = params['lr_decay']
+        if params['homogeneous_batches']:
+            logging.warning('The homogeneous batches are ignored when batching by number of tokens.')
+        save_params = copy.copy(params)
+        del save_params['extra_callbacks']
+        self.training_parameters.append(save_params)
+        if params['verbose'] > 0:
+            logging.info("<<< Training model >>>")
+        self.__train_token_batches(ds, params)
+        logging.info("<<< Finished training model >>>")
+
+    def __train_token_batches(self, ds, params):
+        """
+        Trains the model with a TokenBatchGenerator. The callbacks are the ones of Model_Wrapper.trainNet.
+        :param ds: Dataset with the training data
+        :param params: Training parameters (checked)
+        :return:
+        """
+        train_gen = TokenBatchGenerator('train',
+                                        self,
+                                        ds,
+                                        self.params['INPUTS_IDS_DATASET'][0],
+                                        self.params['OUTPUTS_IDS_DATASET'][0],
+                                        params['max_tokens'],
+                                        bucket_width=params['bucket_width'],
+                                        max_batch_size=params['max_batch_size'],
+                                        shuffle=params['shuffle'])
+
+        callbacks = list(params['extra_callbacks'])
+        if params.get('lr_decay') is not None:
+            callbacks.append(LearningRateReducer(initial_lr=params['initial_lr'],
+                                                 reduce_rate=params['lr_gamma'],
+                                                 reduce_frequency=params['lr_decay'],
+                                                 reduce_each_epochs=params['reduce_each_epochs'],
+                                                 start_reduction_on_epoch=params['start_reduction_on_epoch'],
+                                                 exp_base=params['lr_reducer_exp_base'],
+                                                 half_life=params['lr_half_life'],
+                                                 warmup_exp=params['lr_warmup_exp'],
+                                                 reduction_function=params['lr_reducer_type'],
+                                                 min_lr=params['min_lr'],
+                                                 verbose=params['verbose']))
+        if params.get('metric_check') is not None:
+            callbacks.append(EarlyStopping(self,
+                                           patience=params['patience'],
+                                           metric_check=params['metric_check'],
+                                           want_to_minimize=True if 'TER' in params['metric_check'] else False,
+                                           min_delta=params['min_delta'],
+                                           check_split=params['patience_check_split'],
+                                           eval_on_epochs=params['eval_on_epochs'],
+                                           each_n_epochs=params['each_n_epochs'],
+                                           start_eval_on_epoch=params['start_eval_on_epoch']))
+        if params['epochs_for_save'] >= 0:
+            callbacks.insert(0, StoreModelWeightsOnEpochEnd(self, saveModel, params['epochs_for_save']))
+        if params['tensorboard'] and K.backend() == 'tensorflow':
+            log_dir = self.model_path + '/' + params['tensorboard_params']['log_dir']
+            if not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+            callback_tensorboard = TensorBoard(log_dir=log_dir,
+                                               histogram_freq=params['tensorboard_params']['histogram_freq'],
+                                               batch_size=params['tensorboard_params']['batch_size'],
+                                               write_graph=params['tensorboard_params']['write_graph'],
+                                               write_grads=params['tensorboard_params']['write_grads'],
+                                               write_images=params['tensorboard_params']['write_images'])
+            callback_tensorboard.set_model(self.model)
+            callbacks.append(callback_tensorboard)
+
+        if params.get('n_gpus', 1) > 1 and getattr(self, 'multi_gpu_model', None) is not None:
+            model_to_train = self.multi_gpu_model
+        else:
+            model_to_train = self.model
+        model_to_train.fit_generator(train_gen.generator(),
+                                     steps_per_epoch=len(train_gen),
+                                     epochs=params['n_epochs'],
+                                     verbose=params['verbose'],
+                                     callbacks=callbacks,
+                                     max_queue_size=params['n_parallel_loaders'],
+                                     workers=1,
+                                     initial_epoch=params['epoch_offset'])
+
     def setOptimizer(self, **kwargs):
         """
         Sets and compiles a new optimizer for the Translation_Model.
@@ -409,31 +755,31 @@ class TranslationModel(Model_Wrapper):
             if 'LSTM' in params['DECODER_RNN_TYPE']:
                 input_attentional_decoder.append(initial_state)
 
-        # 3.3. Attentional decoder
-        sharedAttRNNCond = eval('Att' + params['DECODER_RNN_TYPE'] + 'Cond')(params['DECODER_HIDDEN_SIZE'],
-                                                                             attention_mode=params.get('ATTENTION_MODE', 'add'),
-                                                                             att_units=params.get('ATTENTION_SIZE', 0),
-                                                                             kernel_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
-                                                                             recurrent_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
-                                                                             conditional_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
-                                                                             bias_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
-                                                                             attention_context_wa_regularizer=l2(params['WEIGHT_DECAY']),
-                                                                             attention_recurrent_regularizer=l2(params['WEIGHT_DECAY']),
-                                                                             attention_context_regularizer=l2(params['WEIGHT_DECAY']),
-                                                                             bias_ba_regularizer=l2(params['WEIGHT_DECAY']),
-                                                                             dropout=params['RECURRENT_INPUT_DROPOUT_P'],
-                                                                             recurrent_dropout=params['RECURRENT_DROPOUT_P'],
-                                                                             conditional_dropout=params['RECURRENT_INPUT_DROPOUT_P'],
-                                                                             attention_dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                                             kernel_initializer=params['INIT_FUNCTION'],
-                                                                             recurrent_initializer=params['INNER_INIT'],
-                                                                             attention_context_initializer=params['INIT_ATT'],
-                                                                             trainable=params.get('TRAINABLE_DECODER', True),
-                                                                             return_sequences=True,
-                                                                             return_extra_variables=True,
-                                                                             return_states=True,
-                                                                             num_inputs=len(input_attentional_decoder),
-                                                                             name='decoder_Att' + params['DECODER_RNN_TYPE'] + 'Cond')
+        # 3.3. Attentional decoder (the sampling models precompute the projection of its context)
+        sharedAttRNNCond = eval('ProjectedContextAtt' + params['DECODER_RNN_TYPE'] + 'Cond')(params['DECODER_HIDDEN_SIZE'],
+                                                                                             attention_mode=params.get('ATTENTION_MODE', 'add'),
+                                                                                             att_units=params.get('ATTENTION_SIZE', 0),
+                                                                                             kernel_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
+                                                                                             recurrent_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
+                                                                                             conditional_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
+                                                                                             bias_regularizer=l2(params['RECURRENT_WEIGHT_DECAY']),
+                                                                                             attention_context_wa_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                                             attention_recurrent_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                                             attention_context_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                                             bias_ba_regularizer=l2(params['WEIGHT_DECAY']),
+                                                                                             dropout=params['RECURRENT_INPUT_DROPOUT_P'],
+                                                                                             recurrent_dropout=params['RECURRENT_DROPOUT_P'],
+                                                                                             conditional_dropout=params['RECURRENT_INPUT_DROPOUT_P'],
+                                                                                             attention_dropout=params.get('ATTENTION_DROPOUT_P', 0.),
+                                                                                             kernel_initializer=params['INIT_FUNCTION'],
+                                                                                             recurrent_initializer=params['INNER_INIT'],
+                                                                                             attention_context_initializer=params['INIT_ATT'],
+                                                                                             trainable=params.get('TRAINABLE_DECODER', True),
+                                                                                             return_sequences=True,
+                                                                                             return_extra_variables=True,
+                                                                                             return_states=True,
+                                                                                             num_inputs=len(input_attentional_decoder),
+                                                                                             name='decoder_Att' + params['DECODER_RNN_TYPE'] + 'Cond')
 
         rnn_output = sharedAttRNNCond(input_attentional_decoder)
         proj_h = rnn_output[0]
@@ -574,8 +920,15 @@ class TranslationModel(Model_Wrapper):
         # possibility to generate the next state in the sequence given a pre-processed input (encoder stage)
         # First, we need a model that outputs the preprocessed input + initial h state
         # for applying the initial forward pass
+        # With the additive attention, the projection of the annotations (context * Ua + ba) is the same at every
+        # decoding step: model_init computes it (with the decoder) and model_next receives it.
+        project_context = params.get('ATTENTION_MODE', 'add') == 'add'
         model_init_input = [src_text, next_words]
-        model_init_output = [softout, annotations] + h_states_list
+        model_init_output = [softout, annotations]
+        if project_context:
+            projected_annotations = sharedAttRNNCond(annotations)
+            model_init_output.append(projected_annotations)
+        model_init_output += h_states_list
         if 'LSTM' in params['DECODER_RNN_TYPE']:
             model_init_output += h_memories_list
         if self.return_alphas:
@@ -587,12 +940,16 @@ class TranslationModel(Model_Wrapper):
         ids_states_names = ['next_state_' + str(i) for i in range(len(h_states_list))]
 
         # first output must be the output probs.
-        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input'] + ids_states_names
+        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input']
+        if project_context:
+            self.ids_outputs_init.append('projected_ctx')
+        self.ids_outputs_init += ids_states_names
         if 'LSTM' in params['DECODER_RNN_TYPE']:
             ids_memories_names = ['next_memory_' + str(i) for i in range(len(h_memories_list))]
             self.ids_outputs_init += ids_memories_names
         # Second, we need to build an additional model with the capability to have the following inputs:
         #   - preprocessed_input
+        #   - prev_projected_ctx (additive attention)
         #   - prev_word
         #   - prev_state
         # and the following outputs:
@@ -618,7 +975,13 @@ class TranslationModel(Model_Wrapper):
 
             input_attentional_decoder.append(prev_h_memories_list[n_deep_decoder_layer_idx])
         # Apply decoder
-        rnn_output = sharedAttRNNCond(input_attentional_decoder)
+        if project_context:
+            # The decoder receives the projected annotations from model_init
+            prev_projected_annotations = Input(name='prev_projected_ctx',
+                                               shape=tuple([None, K.int_shape(projected_annotations)[2]]))
+            rnn_output = sharedAttRNNCond(input_attentional_decoder + [prev_projected_annotations])
+        else:
+            rnn_output = sharedAttRNNCond(input_attentional_decoder)
         proj_h = rnn_output[0]
         x_att = rnn_output[1]
         alphas = rnn_output[2]
@@ -665,8 +1028,13 @@ class TranslationModel(Model_Wrapper):
 
         # Softmax
         softout = shared_FC_soft(out_layer)
-        model_next_inputs = [next_words, preprocessed_annotations] + prev_h_states_list
-        model_next_outputs = [softout, preprocessed_annotations] + h_states_list
+        model_next_inputs = [next_words, preprocessed_annotations]
+        model_next_outputs = [softout, preprocessed_annotations]
+        if project_context:
+            model_next_inputs.append(prev_projected_annotations)
+            model_next_outputs.append(prev_projected_annotations)
+        model_next_inputs += prev_h_states_list
+        model_next_outputs += h_states_list
         if 'LSTM' in params['DECODER_RNN_TYPE']:
             model_next_inputs += prev_h_memories_list
             model_next_outputs += h_memories_list
@@ -684,6 +1052,11 @@ class TranslationModel(Model_Wrapper):
         # Input -> Output matchings from model_init to model_next and from model_next to model_next
         self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input'}
         self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input'}
+        if project_context:
+            self.ids_inputs_next.append('prev_projected_ctx')
+            self.ids_outputs_next.append('prev_projected_ctx')
+            self.matchings_init_to_next['projected_ctx'] = 'prev_projected_ctx'
+            self.matchings_next_to_next['prev_projected_ctx'] = 'prev_projected_ctx'
         # append all next states and matchings
 
         for n_state in range(len(prev_h_states_list)):
@@ -781,17 +1154,19 @@ class TranslationModel(Model_Wrapper):
 
         # 3.1.1. Previously generated words as inputs for training -> Teacher forcing
         next_words = Input(name=self.ids_inputs[1], batch_shape=tuple([None, None]), dtype='int32')
-        next_words_positions = PositionLayer(name='position_layer_next_words')(next_words)
+        shared_trg_position_layer = PositionLayer(name='position_layer_next_words')
+        next_words_positions = shared_trg_position_layer(next_words)
 
         # 3.1.2. Target word embedding
-        state_below = Embedding(params['OUTPUT_VOCABULARY_SIZE'],
-                                params['TARGET_TEXT_EMBEDDING_SIZE'],
-                                name='target_word_embedding',
-                                embeddings_regularizer=l2(params['WEIGHT_DECAY']),
-                                embeddings_initializer=params['INIT_FUNCTION'],
-                                trainable=self.trg_embedding_weights_trainable,
-                                weights=self.trg_embedding_weights,
-                                mask_zero=True)(next_words)
+        shared_trg_embedding = Embedding(params['OUTPUT_VOCABULARY_SIZE'],
+                                         params['TARGET_TEXT_EMBEDDING_SIZE'],
+                                         name='target_word_embedding',
+                                         embeddings_regularizer=l2(params['WEIGHT_DECAY']),
+                                         embeddings_initializer=params['INIT_FUNCTION'],
+                                         trainable=self.trg_embedding_weights_trainable,
+                                         weights=self.trg_embedding_weights,
+                                         mask_zero=True)
+        state_below = shared_trg_embedding(next_words)
 
         if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
             state_below = SqrtScaling(params['MODEL_SIZE'])(state_below)
@@ -833,14 +1208,19 @@ class TranslationModel(Model_Wrapper):
         shared_add_ff_list = []
         shared_norm_ff_list = []
 
+        # Inputs of each decoder block: their keys and values are cached by the sampling models
+        trg_block_inputs = []
+
         # Right tranformer block (decoder)
         for n_block in range(params['N_LAYERS_DECODER']):
+            trg_block_inputs.append(prev_state_below)
             # Masked Multi-Head Attention block
-            shared_trg_multihead = MultiHeadAttention(params['N_HEADS'],
-                                                      params['MODEL_SIZE'],
-                                                      dropout=params.get('ATTENTION_DROPOUT_P', 0.),
-                                                      mask_future=True,  # Avoid attending on future sequences
-                                                      name='trg_MultiHeadAttention_' + str(n_block))
+            # (shared with the sampling models, which decode incrementally)
+            shared_trg_multihead = IncrementalMultiHeadAttention(params['N_HEADS'],
+                                                                 params['MODEL_SIZE'],
+                                                                 dropout=params.get('ATTENTION_DROPOUT_P', 0.),
+                                                                 mask_future=True,  # Avoid attending on future sequences
+                                                                 name='trg_MultiHeadAttention_' + str(n_block))
             trg_multihead = shared_trg_multihead([prev_state_below, prev_state_below])
             shared_trg_multihead_list.append(shared_trg_multihead)
 
@@ -944,8 +1324,13 @@ class TranslationModel(Model_Wrapper):
         # First, we need a model that outputs the preprocessed input
         # for applying the initial forward pass
 
+        # The decoder states are the keys and values of the masked self-attention of each decoder block. They are
+        # cached for the previous positions, so that model_next only decodes the last word.
+        trg_block_keys_values = []
+        for n_block in range(params['N_LAYERS_DECODER']):
+            trg_block_keys_values += shared_trg_multihead_list[n_block](trg_block_inputs[n_block])
         model_init_input = [src_text, next_words]
-        model_init_output = [softout, masked_src_multihead]
+        model_init_output = [softout, masked_src_multihead] + trg_block_keys_values
 
         # if self.return_alphas:
         #    model_init_output.append(alphas)
@@ -953,29 +1338,50 @@ class TranslationModel(Model_Wrapper):
 
         # Store inputs and outputs names for model_init
         self.ids_inputs_init = self.ids_inputs
+        ids_states_names = ['next_state_' + str(i) for i in range(len(trg_block_keys_values))]
 
         # first output must be the output probs.
-        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input']
+        self.ids_outputs_init = self.ids_outputs + ['preprocessed_input'] + ids_states_names
 
         # Second, we need to build an additional model with the capability to have the following inputs:
         #   - preprocessed_input
         #   - prev_word
+        #   - prev_state (keys and values of each decoder block at the previous positions)
         # and the following outputs:
         #   - softmax probabilities
+        #   - next_state (prev_state + keys and values of each decoder block at the current position)
 
         preprocessed_size = params['MODEL_SIZE']
 
         # Define inputs
         preprocessed_annotations = Input(name='preprocessed_input', shape=tuple([None, preprocessed_size]),
                                          dtype='float32')
+        prev_trg_block_keys_values = [Input(name='prev_state_' + str(i), shape=tuple([None, params['MODEL_SIZE']]),
+                                            dtype='float32')
+                                      for i in range(len(trg_block_keys_values))]
+
+        # Only the last word is fed: its position is the last one of the decoded sequence
+        decoded_words = Lambda(getDecodedWords, output_shape=getDecodedWordsShape,
+                               name='decoded_words')([next_words, prev_trg_block_keys_values[0]])
+        next_word_position = Lambda(getLastTimestep, output_shape=getLastTimestepShape,
+                                    name='position_layer_next_word')(shared_trg_position_layer(decoded_words))
+        state_below = shared_trg_embedding(next_words)
+        if params.get('SCALE_TARGET_WORD_EMBEDDINGS', False):
+            state_below = SqrtScaling(params['MODEL_SIZE'])(state_below)
+        state_below = Add()([state_below, positional_embedding_trg(next_word_position)])
+        state_below = Dropout(params['DROPOUT_P'])(state_below)
 
         # Apply decoder
         prev_state_below = state_below
+        next_trg_block_keys_values = []
 
         # RIGHT TRANSFORMER BLOCK
         for n_block in range(params['N_LAYERS_DECODER']):
-            # Masked Multi-Head Attention block
-            trg_multihead = shared_trg_multihead_list[n_block]([prev_state_below, prev_state_below])
+            # Masked Multi-Head Attention block: the current position attends on the cached keys and values
+            trg_multihead, trg_keys, trg_values = shared_trg_multihead_list[n_block]([prev_state_below,
+                                                                                     prev_trg_block_keys_values[2 * n_block],
+                                                                                     prev_trg_block_keys_values[2 * n_block + 1]])
+            next_trg_block_keys_values += [trg_keys, trg_values]
 
             # Regularize
             trg_multihead_dropout = shared_trg_dropout_multihead_list[n_block](trg_multihead)
@@ -999,8 +1405,8 @@ class TranslationModel(Model_Wrapper):
             # And norm
             src_trg_multihead_norm = shared_src_trg_norm_multihead_list[n_block](src_trg_multihead_add)
 
-            # FF
-            ff_src_trg_multihead = shared_ff_list[n_block](src_trg_multihead_norm)
+            # FF (as in the training model)
+            ff_src_trg_multihead = shared_ff_list[n_block](src_trg_multihead)
 
             # Regularize
             ff_src_trg_multihead_dropout = shared_dropout_ff_list[n_block](ff_src_trg_multihead)
@@ -1023,8 +1429,8 @@ class TranslationModel(Model_Wrapper):
         # Softmax
         softout = shared_FC_soft(out_layer)
 
-        model_next_inputs = [next_words, preprocessed_annotations]
-        model_next_outputs = [softout, preprocessed_annotations]
+        model_next_inputs = [next_words, preprocessed_annotations] + prev_trg_block_keys_values
+        model_next_outputs = [softout, preprocessed_annotations] + next_trg_block_keys_values
 
         # if self.return_alphas:
         #     model_next_outputs.append(alphas)
@@ -1040,6 +1446,16 @@ class TranslationModel(Model_Wrapper):
         # Input -> Output matchings from model_init to model_next and from model_next to model_next
         self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input'}
         self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input'}
+        # append all next states and matchings
+        for n_state in range(len(prev_trg_block_keys_values)):
+            self.ids_inputs_next.append('prev_state_' + str(n_state))
+            self.ids_outputs_next.append('next_state_' + str(n_state))
+            self.matchings_init_to_next['next_state_' + str(n_state)] = 'prev_state_' + str(n_state)
+            self.matchings_next_to_next['next_state_' + str(n_state)] = 'prev_state_' + str(n_state)
+        # model_next only receives the last word (its previous words are in the states)
+        self.attend_on_output = False
+        # The states grow with the hypotheses: only hypotheses of the same length can be decoded together
+        self.growing_states = True
 
     # Backwards compatibility.
     GroundHogModel = AttentionRNNEncoderDecoder
@@ -1,6 +1,13 @@
 import argparse
 import logging
 import ast
+import codecs
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from multiprocessing import cpu_count
 from keras_wrapper.extra.read_write import pkl2dict, list2file, nbest2file, list2stdout
 
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
@@ -26,9 +33,42 @@ def parse_args():
     parser.add_argument("-m", "--models", nargs="+", required=True, help="Path to the models")
     parser.add_argument("-ch", "--changes", nargs="*", help="Changes to the config. Following the syntax Key=Value",
                         default="")
+    parser.add_argument("--stream", action="store_true", default=False,
+                        help="Read the source sentences in chunks (from STDIN if --text is '-') and write "
+                             "their translations as soon as each chunk is translated.")
+    parser.add_argument("--chunk-size", required=False, default=1000, type=int,
+                        help="Number of sentences of each chunk in --stream mode.")
+    parser.add_argument("--workers", required=False, default=1, type=int,
+                        help="Number of worker processes. The text file is split into contiguous shards, "
+                             "each one translated by a worker (loading its own copy of the models).")
+    parser.add_argument("--threads-per-worker", required=False, default=None, type=int,
+                        help="Number of BLAS/OpenMP threads of each worker. By default, CPU count / workers.")
     return parser.parse_args()
 
 
+def read_chunks(filepath, chunk_size):
+    """
+    Reads a text file in chunks of lines.
+    :param filepath: Path to the file. If '-', lines are read from STDIN.
+    :param chunk_size: Number of lines of each chunk
+    :return: Generator of lists of (unicode) lines, without the line breaks
+    """
+    f = codecs.getreader('utf-8')(sys.stdin) if filepath == '-' else codecs.open(filepath, 'r', encoding='utf-8')
+    try:
+        chunk = []
+        # readline does not buffer ahead: chunks from pipes are translated as soon as they are complete
+        for line in iter(f.readline, u''):
+            chunk.append(line.rstrip(u'\r\n'))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        if filepath != '-':
+            f.close()
+
+
 def sample_ensemble(args, params):
 
     from data_engine.prepare_data import update_dataset_from_file
@@ -36,11 +76,17 @@ def sample_ensemble(args, params):
     from keras_wrapper.cnn_model import loadModel
     from keras_wrapper.dataset import loadDataset
     from keras_wrapper.utils import decode_predictions_beam_search
+    from utils.batched_search import BatchedBeamSearchEnsemble
+    from utils.shortlist import build_shortlist
+    from model_zoo import CUSTOM_OBJECTS
 
     logging.info("Using an ensemble of %d models" % len(args.models))
-    models = [loadModel(m, -1, full_path=True) for m in args.models]
+    models = [loadModel(m, -1, full_path=True, custom_objects=CUSTOM_OBJECTS) for m in args.models]
     dataset = loadDataset(args.dataset)
-    dataset = update_dataset_from_file(dataset, args.text, params, splits=args.splits, remove_outputs=True)
+    stream = getattr(args, 'stream', False)
+    chunk_size = getattr(args, 'chunk_size', 1000)
+    if not stream:
+        dataset = update_dataset_from_file(dataset, args.text, params, splits=args.splits, remove_outputs=True)
 
     params['INPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['INPUTS_IDS_DATASET'][0]]
     params['OUTPUT_VOCABULARY_SIZE'] = dataset.vocabulary_len[params['OUTPUTS_IDS_DATASET'][0]]
@@ -74,7 +120,33 @@ def sample_ensemble(args, params):
     params_prediction['output_max_length_depending_on_x_factor'] = params.get('MAXLEN_GIVEN_X_FACTOR', 3)
     params_prediction['output_min_length_depending_on_x'] = params.get('MINLEN_GIVEN_X', True)
     params_prediction['output_min_length_depending_on_x_factor'] = params.get('MINLEN_GIVEN_X_FACTOR', 2)
-    params_prediction['attend_on_output'] = params.get('ATTEND_ON_OUTPUT', 'transformer' in params['MODEL_TYPE'].lower())
+    # Transformers built before caching the decoder states (without the attribute) receive the whole prefix
+    params_prediction['attend_on_output'] = params.get('ATTEND_ON_OUTPUT',
+                                                       all(getattr(model, 'attend_on_output',
+                                                                   'transformer' in params['MODEL_TYPE'].lower())
+                                                           for model in models))
+    params_prediction['search_batch_size'] = params.get('SEARCH_BATCH_SIZE', 1)
+    params_prediction['beam_batch_size'] = params.get('BEAM_BATCH_SIZE', 0)
+    params_prediction['search_bucket_width'] = params.get('SEARCH_BUCKET_WIDTH', 1)
+    params_prediction['pad_on_batch'] = dataset.pad_on_batch[params_prediction['dataset_inputs'][-1]]
+    batched_search = params_prediction['search_batch_size'] > 1 or params.get('SHORTLIST', False)
+    if batched_search and not (params_prediction['optimized_search'] and params_prediction['pad_on_batch']):
+        logger.warning('Batched beam search (and SHORTLIST) requires OPTIMIZED_SEARCH and PAD_ON_BATCH. '
+                       'Decoding sentence by sentence.')
+        batched_search = False
+    shortlist = None
+    if batched_search and params.get('SHORTLIST', False):
+        if params.get('SHORTLIST_MAPPING') is not None:
+            shortlist_mapping = pkl2dict(params['SHORTLIST_MAPPING'])
+        else:
+            if dataset.mapping == dict():
+                dataset.loadMapping(params['MAPPING'])
+            shortlist_mapping = dataset.mapping
+        shortlist = build_shortlist(shortlist_mapping,
+                                    dataset.vocabulary[params['INPUTS_IDS_DATASET'][0]]['words2idx'],
+                                    dataset.vocabulary[params['OUTPUTS_IDS_DATASET'][0]]['words2idx'],
+                                    n_frequent=params.get('SHORTLIST_FREQUENT_WORDS', 1000),
+                                    n_candidates=params.get('SHORTLIST_CANDIDATES', 10))
 
     heuristic = params.get('HEURISTIC', 0)
     mapping = None if dataset.mapping == dict() else dataset.mapping
@@ -85,11 +157,24 @@ def sample_ensemble(args, params):
         model_weights = map(lambda x: float(x), model_weights)
         if len(model_weights) > 1:
             logger.info('Giving the following weights to each model: %s' % str(model_weights))
-    for s in args.splits:
+
+    def translate_split(s, sources=None, index_offset=0):
+        """
+        Translates the sentences of the split s of the dataset.
+        :param s: Split to translate
+        :param sources: Source sentences (for pos_unk). If None, they are read from args.text
+        :param index_offset: Index of the first sentence of the split (for the n-best list)
+        :return: Translations and n-best list (None if args.n_best is not set)
+        """
         # Apply model predictions
         params_prediction['predict_on_sets'] = [s]
-        beam_searcher = BeamSearchEnsemble(models, dataset, params_prediction,
-                                           model_weights=model_weights, n_best=args.n_best, verbose=args.verbose)
+        if batched_search:
+            beam_searcher = BatchedBeamSearchEnsemble(models, dataset, params_prediction,
+                                                      model_weights=model_weights, n_best=args.n_best,
+                                                      shortlist=shortlist, verbose=args.verbose)
+        else:
+            beam_searcher = BeamSearchEnsemble(models, dataset, params_prediction,
+                                               model_weights=model_weights, n_best=args.n_best, verbose=args.verbose)
         if args.n_best:
             predictions, n_best = beam_searcher.predictBeamSearchNet()[s]
         else:
@@ -98,25 +183,27 @@ def sample_ensemble(args, params):
         if params_prediction['pos_unk']:
             samples = predictions[0]
             alphas = predictions[1]
-            sources = [x.strip() for x in open(args.text, 'r').read().split('\n')]
-            sources = sources[:-1] if len(sources[-1]) == 0 else sources
+            if sources is None:
+                sources = [x.strip() for x in open(args.text, 'r').read().split('\n')]
+                sources = sources[:-1] if len(sources[-1]) == 0 else sources
         else:
             samples = predictions
             alphas = None
-            heuristic = None
             sources = None
+        split_heuristic = heuristic if params_prediction['pos_unk'] else None
 
         predictions = decode_predictions_beam_search(samples,
                                                      index2word_y,
                                                      alphas=alphas,
                                                      x_text=sources,
-                                                     heuristic=heuristic,
+                                                     heuristic=split_heuristic,
                                                      mapping=mapping,
                                                      verbose=args.verbose)
         # Apply detokenization function if needed
         if params.get('APPLY_DETOKENIZATION', False):
             predictions = map(detokenize_function, predictions)
 
+        n_best_predictions = None
         if args.n_best:
             n_best_predictions = []
             for i, (n_best_preds, n_best_scores, n_best_alphas) in enumerate(n_best):
@@ -126,15 +213,44 @@ def sample_ensemble(args, params):
                                                           index2word_y,
                                                           alphas=[n_best_alpha],
                                                           x_text=[sources[i]],
-                                                          heuristic=heuristic,
+                                                          heuristic=split_heuristic,
                                                           mapping=mapping,
                                                           verbose=args.verbose)
                     # Apply detokenization function if needed
                     if params.get('APPLY_DETOKENIZATION', False):
                         pred = map(detokenize_function, pred)
 
-                    n_best_sample_score.append([i, pred, n_best_score])
+                    n_best_sample_score.append([i + index_offset, pred, n_best_score])
                 n_best_predictions.append(n_best_sample_score)
+        return predictions, n_best_predictions
+
+    if stream:
+        # Translate chunks of sentences as they are read, storing the translations as soon as they are ready
+        s = args.splits[0]
+        nbest_filepath = args.dest + '.nbest' if args.dest is not None else './' + s + '.nbest'
+        if args.dest is not None:
+            open(args.dest, 'w').close()
+        if args.n_best:
+            logging.info('Storing n-best sentences in ' + nbest_filepath)
+            open(nbest_filepath, 'w').close()
+        n_sentences = 0
+        for chunk in read_chunks(args.text, chunk_size):
+            dataset = update_dataset_from_file(dataset, chunk, params, splits=[s], remove_outputs=n_sentences == 0)
+            predictions, n_best_predictions = translate_split(s, sources=chunk, index_offset=n_sentences)
+            if args.dest is not None:
+                list2file(args.dest, predictions, permission='a')
+            else:
+                list2stdout(predictions)
+                sys.stdout.flush()
+            if args.n_best:
+                nbest2file(nbest_filepath, n_best_predictions, permission='a')
+            n_sentences += len(chunk)
+            logging.info('Translated %d sentences' % n_sentences)
+        logging.info('Sampling finished')
+        return
+
+    for s in args.splits:
+        predictions, n_best_predictions = translate_split(s)
         # Store result
         if args.dest is not None:
             filepath = args.dest  # results file
@@ -152,9 +268,66 @@ def sample_ensemble(args, params):
         logging.info('Sampling finished')
 
 
+def sample_ensemble_sharded(args):
+    """
+    Splits args.text into args.workers contiguous shards and translates them with independent processes running this
+    script. Translations (and n-best lists) are merged back in the original order.
+    Each worker pins the number of threads of the numerical libraries, so that they do not oversubscribe the CPU.
+    """
+    from utils.sharding import split_file, merge_files, merge_nbest_files
+
+    threads_per_worker = args.threads_per_worker or max(1, cpu_count() // args.workers)
+    env = os.environ.copy()
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        env[var] = str(threads_per_worker)
+
+    tmp_dir = tempfile.mkdtemp(prefix='sample_ensemble_')
+    try:
+        shards = split_file(args.text, args.workers, tmp_dir)
+        logging.info("Translating %s with %d workers (%d threads each)" %
+                     (args.text, len(shards), threads_per_worker))
+        workers = []
+        for shard, _ in shards:
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--dataset', args.dataset,
+                       '--text', shard,
+                       '--dest', shard + '.trans',
+                       '--verbose', str(args.verbose),
+                       '--splits'] + args.splits + ['--models'] + args.models
+            if args.config is not None:
+                command += ['--config', args.config]
+            if args.n_best:
+                command.append('--n-best')
+            if args.weights:
+                command += ['--weights'] + args.weights
+            if args.changes:
+                command += ['--changes'] + args.changes
+            # Workers log to stdout: keep it clean for the translations
+            workers.append(subprocess.Popen(command, env=env, stdout=sys.stderr))
+        failed = [shard for (shard, _), worker in zip(shards, workers) if worker.wait() != 0]
+        if failed:
+            raise Exception('Workers processing %s failed' % str(failed))
+
+        merge_files([shard + '.trans' for shard, _ in shards], args.dest if args.dest is not None else sys.stdout)
+        if args.n_best:
+            nbest_filepath = args.dest + '.nbest' if args.dest is not None else './' + args.splits[-1] + '.nbest'
+            logging.info('Storing n-best sentences in ' + nbest_filepath)
+            merge_nbest_files([shard + '.trans.nbest' for shard, _ in shards], [offset for _, offset in shards],
+                              nbest_filepath)
+    finally:
+        shutil.rmtree(tmp_dir)
+    logging.info('Sampling finished')
+
+
 if __name__ == "__main__":
 
     args = parse_args()
+    if args.workers > 1:
+        if args.stream or args.text == '-':
+            print ('--workers cannot be combined with --stream or with reading from STDIN.')
+            exit(1)
+        sample_ensemble_sharded(args)
+        exit(0)
     if args.config is None:
         logging.info("Reading parameters from config.py")
         from config import load_parameters
@@ -1,5 +1,7 @@
 import logging
 import argparse
+import sys
+from itertools import islice
 from config import load_parameters
 from keras_wrapper.extra.read_write import pkl2dict, list2file, numpy2file
 
@@ -24,18 +26,100 @@ def parse_args():
                                                                "If not specified, hyperparameters "
                                                                "are read from config.py")
     parser.add_argument("--models", nargs='+', required=True, help="path to the models")
+    parser.add_argument("--scorer", required=False, default='forced', choices=['forced', 'beam'],
+                        help="'forced': Score the targets by forced decoding, with a teacher-forced forward pass of "
+                             "the ensemble per batch. 'beam': Score them word by word with BeamSearchEnsemble. "
+                             "If COVERAGE_PENALTY is set and the models are not attentional RNNs, 'beam' is used.")
+    parser.add_argument("-b", "--batch-size", type=int, required=False, default=None,
+                        help="Number of sentences per forced decoding batch. By default, BATCH_SIZE.")
+    parser.add_argument("--per-token", required=False, action='store_true', default=False,
+                        help="Also store per-token values (forced decoding only).")
+    parser.add_argument("--per-token-format", required=False, default='text', choices=['text', 'ragged'],
+                        help="'text': Store the log-probability of each target word in <dest>.tokens, one sentence "
+                             "per line. 'ragged': Store the log-probabilities (<dest>.log_probs) and entropies "
+                             "(<dest>.entropies) of the target words, as float32, and their alignments "
+                             "(<dest>.alignments, see --alignments), as int32, in a memory-mappable format: the "
+                             "concatenated values of all the sentences plus a <file>.offsets int64 array with the "
+                             "position of the first value of each sentence (see utils/ragged.py).")
+    parser.add_argument("--alignments", required=False, action='store_true', default=False,
+                        help="In the ragged format, also store the most attended source position of each target "
+                             "word. Requires attentional RNN models.")
     return parser.parse_args()
 
 
+def store_scores(results, dest, save_mode, per_token=False, per_token_format='text', chunk_size=1000):
+    """
+    Stores the results of the forced decoding scorer as they are computed.
+    :param results: Iterable of (sentence score, dictionary of per-token arrays) tuples, as yielded by
+                    ForcedDecodingScorer.score
+    :param dest: Destination file. If None, the scores are printed
+    :param save_mode: SAMPLING_SAVE_MODE. 'numpy' files are written once all the sentences are scored.
+    :param per_token: Whether to store the per-token values of each sentence
+    :param per_token_format: 'text': Store the log-probabilities of the target words in dest + '.tokens', one
+                             sentence per line.
+                             'ragged': Store each per-token value (log_probs, entropies, alignments) in a
+                             memory-mappable utils.ragged file (dest + '.' + name).
+    :param chunk_size: Number of sentences written together
+    """
+    from utils.ragged import RaggedWriter
+
+    if per_token and per_token_format == 'ragged' and dest is None:
+        raise AssertionError('The ragged per-token format requires a destination file.')
+    if dest is not None and save_mode == 'numpy':
+        results = list(results)
+        numpy2file(dest, [score for score, _ in results])
+        if not per_token or per_token_format == 'text':
+            if per_token:
+                numpy2file(dest + '.tokens', [tokens['log_probs'] for _, tokens in results])
+            return
+    elif dest is not None and save_mode != 'list':
+        raise Exception('The sampling mode ' + save_mode + ' is not currently supported.')
+    elif dest is not None:
+        open(dest, 'w').close()
+        if per_token and per_token_format == 'text':
+            open(dest + '.tokens', 'w').close()
+    writers = dict()
+    results = iter(results)
+    chunk = list(islice(results, chunk_size))
+    try:
+        while chunk:
+            scores = [score for score, _ in chunk]
+            if per_token and per_token_format == 'ragged':
+                for name in chunk[0][1]:
+                    if name not in writers:
+                        writers[name] = RaggedWriter(dest + '.' + name,
+                                                     dtype='int32' if name == 'alignments' else 'float32')
+                    writers[name].extend([tokens[name] for _, tokens in chunk])
+                text_tokens = None
+            else:
+                text_tokens = [u' '.join(u'%.6f' % log_prob for log_prob in tokens['log_probs'])
+                               for _, tokens in chunk]
+            if dest is not None:
+                if save_mode == 'list':
+                    list2file(dest, scores, permission='a')
+                if per_token and text_tokens is not None:
+                    list2file(dest + '.tokens', text_tokens, permission='a')
+            else:
+                for score, sentence_tokens in zip(scores, text_tokens):
+                    print (score if not per_token else u'%f ||| %s' % (score, sentence_tokens))
+                sys.stdout.flush()
+            chunk = list(islice(results, chunk_size))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
 def score_corpus(args, params):
 
     from data_engine.prepare_data import update_dataset_from_file
     from keras_wrapper.dataset import loadDataset
     from keras_wrapper.cnn_model import loadModel
     from keras_wrapper.model_ensemble import BeamSearchEnsemble
+    from utils.scoring import ForcedDecodingScorer, attention_decoders, dataset_batches
+    from model_zoo import CUSTOM_OBJECTS
 
     logging.info("Using an ensemble of %d models" % len(args.models))
-    models = [loadModel(m, -1, full_path=True) for m in args.models]
+    models = [loadModel(m, -1, full_path=True, custom_objects=CUSTOM_OBJECTS) for m in args.models]
     dataset = loadDataset(args.dataset)
     if args.source is not None:
         dataset = update_dataset_from_file(dataset, args.source, params, splits=args.splits,
@@ -54,7 +138,36 @@ def score_corpus(args, params):
         if len(model_weights) > 1:
             logger.info('Giving the following weights to each model: %s' % str(model_weights))
 
+    scorer = getattr(args, 'scorer', 'forced')
+    if scorer == 'forced' and params.get('COVERAGE_PENALTY', False) and \
+            not all(attention_decoders(model) for model in models):
+        logger.info('The forced decoding scorer computes the coverage penalty from the attention weights of '
+                    'attentional RNN models. Scoring with the beam search scorer.')
+        scorer = 'beam'
     for s in args.splits:
+        if scorer == 'forced':
+            # Teacher-forced forward passes of the training models, streaming the scores to disk
+            batch_size = getattr(args, 'batch_size', None) or params['BATCH_SIZE']
+            params_scoring = {'normalize_probs': params.get('NORMALIZE_SAMPLING', False),
+                              'alpha_factor': params.get('ALPHA_FACTOR', 1.0),
+                              'coverage_penalty': params.get('COVERAGE_PENALTY', False),
+                              'length_penalty': params.get('LENGTH_PENALTY', False),
+                              'length_norm_factor': params.get('LENGTH_NORM_FACTOR', 0.0),
+                              'coverage_norm_factor': params.get('COVERAGE_NORM_FACTOR', 0.0),
+                              'model_inputs': params['INPUTS_IDS_MODEL']}
+            per_token = getattr(args, 'per_token', False)
+            ragged = per_token and getattr(args, 'per_token_format', 'text') == 'ragged'
+            forced_scorer = ForcedDecodingScorer(models, params_scoring, model_weights=model_weights,
+                                                 entropies=ragged,
+                                                 alignments=ragged and getattr(args, 'alignments', False),
+                                                 verbose=args.verbose)
+            batches = dataset_batches(dataset, s, batch_size, params['INPUTS_IDS_MODEL'],
+                                      params['INPUTS_IDS_DATASET'], params['OUTPUTS_IDS_DATASET'][0])
+            store_scores(forced_scorer.score(batches, n_samples=getattr(dataset, 'len_' + s)), args.dest,
+                         params['SAMPLING_SAVE_MODE'], per_token=per_token,
+                         per_token_format=getattr(args, 'per_token_format', 'text'), chunk_size=batch_size)
+            continue
+
         # Apply model predictions
         params_prediction = {'max_batch_size': params['BATCH_SIZE'],
                              'n_parallel_loaders': params['PARALLEL_LOADERS'],
@@ -81,7 +194,10 @@ def score_corpus(args, params):
             params_prediction['output_max_length_depending_on_x_factor'] = params.get('MAXLEN_GIVEN_X_FACTOR', 3)
             params_prediction['output_min_length_depending_on_x'] = params.get('MINLEN_GIVEN_X', True)
             params_prediction['output_min_length_depending_on_x_factor'] = params.get('MINLEN_GIVEN_X_FACTOR', 2)
-            params_prediction['attend_on_output'] = params.get('ATTEND_ON_OUTPUT', 'transformer' in params['MODEL_TYPE'].lower())
+            params_prediction['attend_on_output'] = params.get('ATTEND_ON_OUTPUT',
+                                                               all(getattr(model, 'attend_on_output',
+                                                                           'transformer' in params['MODEL_TYPE'].lower())
+                                                                   for model in models))
             beam_searcher = BeamSearchEnsemble(models, dataset, params_prediction, model_weights=model_weights, verbose=args.verbose)
             scores = beam_searcher.scoreNet()[s]
 
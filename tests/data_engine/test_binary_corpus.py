@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pytest
+from data_engine.binary_corpus import MemmapText, binarize_text_file
+
+WORDS2IDX = {u'<pad>': 0, u'<unk>': 1, u'<null>': 2, u'la': 3, u'casa': 4, u'verde': 5}
+
+
+@pytest.fixture
+def corpus():
+    path = tempfile.mkdtemp()
+    filepath = os.path.join(path, 'text')
+    with codecs.open(filepath, 'w', encoding='utf-8') as f:
+        f.write(u'la casa verde\ncasa\nla casa azul de ella\n')
+    dest = os.path.join(path, 'binary')
+    assert binarize_text_file(filepath, dest, WORDS2IDX, 1, tokenize_f=lambda line: line.lower(), chunk_size=2) == 3
+    yield dest
+    shutil.rmtree(path)
+
+
+def test_rows(corpus):
+    text = MemmapText(corpus, 5)
+    assert len(text) == 3
+    np.testing.assert_array_equal(text[0], [3, 4, 5, 0, 0])
+    np.testing.assert_array_equal(text[1], [4, 0, 0, 0, 0])
+    # Truncated, leaving space for the <eos> symbol
+    np.testing.assert_array_equal(text[2], [3, 4, 1, 1, 0])
+    np.testing.assert_array_equal(np.asarray(text[1:3]), [text[1], text[2]])
+    np.testing.assert_array_equal(text.lengths(), [4, 2, 5])
+    np.testing.assert_array_equal(text.take([2, 1]).lengths(), [5, 2])
+    state_below = MemmapText(corpus, 5, offset=1)
+    np.testing.assert_array_equal(state_below[0], [2, 3, 4, 5, 0])
+    np.testing.assert_array_equal(MemmapText(corpus, 5, fill='start')[1], [0, 0, 4, 0, 0])
+
+
+def test_take_and_pickle(corpus):
+    text = MemmapText(corpus, 5).take([2, 0, 1])
+    shuffled = text.take([1, 2, 0])
+    np.testing.assert_array_equal(np.asarray(list(shuffled)), np.asarray([text[1], text[2], text[0]]))
+    unpickled = pickle.loads(pickle.dumps(shuffled))
+    assert 'sentences' not in shuffled.__getstate__()
+    np.testing.assert_array_equal(np.asarray(list(unpickled)), np.asarray(list(shuffled)))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
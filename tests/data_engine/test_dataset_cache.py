@@ -0,0 +1,59 @@
+import os
+import pytest
+from data_engine.dataset_cache import dataset_fingerprint, load_fingerprint, outdated_splits, save_fingerprint
+from config import load_parameters
+
+
+def write(filepath, text):
+    with open(filepath, 'w') as f:
+        f.write(text)
+
+
+def corpus(tmpdir):
+    text_files = dict()
+    for split in ['train', 'val', 'test']:
+        for lan in ['en', 'es']:
+            text_files[split, lan] = str(tmpdir.join(split + '.' + lan))
+            write(text_files[split, lan], 'a sentence of %s.%s\n' % (split, lan))
+    return text_files
+
+
+def test_unchanged_dataset(tmpdir):
+    params = load_parameters()
+    text_files = corpus(tmpdir)
+    fingerprint = dataset_fingerprint(params, text_files)
+    save_fingerprint(fingerprint, str(tmpdir.join('Dataset.fingerprint')))
+    previous = load_fingerprint(str(tmpdir.join('Dataset.fingerprint')))
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == []
+    # Modification times change, but not the content of the files
+    os.utime(text_files['train', 'en'], (0, 0))
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == []
+    assert load_fingerprint(str(tmpdir.join('missing.fingerprint'))) is None
+
+
+def test_outdated_splits(tmpdir):
+    params = load_parameters()
+    text_files = corpus(tmpdir)
+    previous = dataset_fingerprint(params, text_files)
+    write(text_files['val', 'es'], 'another sentence\n')
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == ['val']
+    del text_files['test', 'en'], text_files['test', 'es']
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == ['test', 'val']
+    # The parameters that determine the content of the dataset invalidate all the splits
+    params['MAX_INPUT_TEXT_LEN'] += 1
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == ['test', 'train', 'val']
+
+
+def test_bpe_codes(tmpdir):
+    params = load_parameters()
+    text_files = corpus(tmpdir)
+    params['TOKENIZATION_METHOD'] = 'tokenize_bpe'
+    params['BPE_CODES_PATH'] = str(tmpdir.join('codes'))
+    write(params['BPE_CODES_PATH'], 'a b\n')
+    previous = dataset_fingerprint(params, text_files)
+    write(params['BPE_CODES_PATH'], 'a b\nab c\n')
+    assert outdated_splits(previous, dataset_fingerprint(params, text_files, previous)) == ['test', 'train', 'val']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
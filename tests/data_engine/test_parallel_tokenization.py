@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+import pytest
+from data_engine.parallel_tokenization import tokenize_files
+
+
+def upper_tokenizer(tokenization, bpe_codes=None):
+    return lambda line: line.upper().strip()
+
+
+def test_tokenize_files(tmpdir):
+    lines = [u'línea %d ' % i for i in range(25)]
+    filepath = str(tmpdir.join('train.es'))
+    with codecs.open(filepath, 'w', encoding='utf-8') as f:
+        f.write(u'\n'.join(lines) + u'\n')
+    dest_dir = str(tmpdir.join('tokenized'))
+    tokenized = tokenize_files({'train': filepath}, 'tokenize_upper', dest_dir, n_jobs=2, chunk_size=4,
+                               build_tokenizer=upper_tokenizer)
+    with codecs.open(tokenized['train'], 'r', encoding='utf-8') as f:
+        assert f.read().split(u'\n')[:-1] == [line.upper().strip() for line in lines]
+
+    # The stored tokenization is reused...
+    mtime = os.path.getmtime(tokenized['train'])
+    assert tokenize_files({'train': filepath}, 'tokenize_upper', dest_dir, n_jobs=2,
+                          build_tokenizer=upper_tokenizer) == tokenized
+    assert os.path.getmtime(tokenized['train']) == mtime
+    # ... unless the tokenization or the content of the file change
+    assert tokenize_files({'train': filepath}, 'tokenize_other', dest_dir, n_jobs=2,
+                          build_tokenizer=upper_tokenizer) != tokenized
+    with codecs.open(filepath, 'a', encoding='utf-8') as f:
+        f.write(u'nueva línea\n')
+    retokenized = tokenize_files({'train': filepath}, 'tokenize_upper', dest_dir, n_jobs=2,
+                                 build_tokenizer=upper_tokenizer)
+    assert retokenized != tokenized
+    with codecs.open(retokenized['train'], 'r', encoding='utf-8') as f:
+        assert f.read().split(u'\n')[-2] == u'NUEVA LÍNEA'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
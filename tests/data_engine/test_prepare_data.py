@@ -21,6 +21,28 @@ def test_build_datset():
             assert len(eval('ds.Y_' + split + str([params['OUTPUTS_IDS_DATASET'][0]]))) == len_split
 
 
+def test_build_dataset_binary_corpus():
+    params = load_parameters()
+    params['REBUILD_DATASET'] = True
+    params['BINARY_CORPUS'] = True
+    params['DATASET_STORE_PATH'] = './'
+    ds = build_dataset(params)
+    text_params = copy.deepcopy(params)
+    text_params['BINARY_CORPUS'] = False
+    text_params['DATASET_STORE_PATH'] = './text_dataset/'
+    text_ds = build_dataset(text_params)
+    assert ds.len_train == text_ds.len_train == 9900
+    assert ds.vocabulary_len == text_ds.vocabulary_len
+    indices = [0, 17, 9899]
+    X, Y = ds.getXY_FromIndices('train', indices)
+    text_X, text_Y = text_ds.getXY_FromIndices('train', indices)
+    for x, text_x in zip(X, text_X):
+        assert (x == text_x).all()
+    assert (Y[0][0] == text_Y[0][0]).all()
+    ds.shuffleTraining()
+    assert len(ds.X_train[params['INPUTS_IDS_DATASET'][0]]) == 9900
+
+
 def test_load_dataset():
     params = load_parameters()
     ds = loadDataset('./Dataset_' + params['DATASET_NAME'] + '_' + params['SRC_LAN'] + params['TRG_LAN'] + '.pkl')
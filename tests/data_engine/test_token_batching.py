@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from data_engine.token_batching import text_lengths, token_batches
+
+
+class ToyDataset:
+    def __init__(self, sources, targets, max_text_len):
+        self.X_train = {'source_text': sources}
+        self.Y_train = {'target_text': targets}
+        self.max_text_len = {'source_text': {'train': max_text_len}, 'target_text': {'train': max_text_len}}
+
+
+def test_text_lengths():
+    ds = ToyDataset(['a b c', 'a', 'a b c d e f'], ['x y', 'x y z', 'x'], 5)
+    np.testing.assert_array_equal(text_lengths(ds, 'train', 'source_text'), [4, 2, 5])
+    np.testing.assert_array_equal(text_lengths(ds, 'train', 'target_text', output=True), [3, 4, 2])
+
+
+def test_token_batches():
+    rng = np.random.RandomState(1)
+    src_lengths = rng.randint(1, 30, 500)
+    trg_lengths = rng.randint(1, 30, 500)
+    max_tokens = 200
+    batches = token_batches(src_lengths, trg_lengths, max_tokens, bucket_width=4, rng=np.random.RandomState(2))
+    # Every sentence in exactly one batch
+    np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(500))
+    for batch in batches:
+        assert len(batch) * (src_lengths[batch].max() + trg_lengths[batch].max()) <= max_tokens
+    # Shuffling does not change the number of batches
+    for seed in range(3, 6):
+        assert len(token_batches(src_lengths, trg_lengths, max_tokens, bucket_width=4,
+                                 rng=np.random.RandomState(seed))) == len(batches)
+    sorted_batches = token_batches(src_lengths, trg_lengths, max_tokens, bucket_width=4)
+    # Without shuffling, the sentences follow the (target, source) bucket order
+    order = np.concatenate(sorted_batches)
+    buckets = list(zip((trg_lengths[order] + 3) // 4, (src_lengths[order] + 3) // 4))
+    assert buckets == sorted(buckets)
+    # and the batches have the same sizes as the shuffled ones
+    assert sorted(len(b) for b in sorted_batches) == sorted(len(b) for b in batches)
+
+
+def test_token_batches_limits():
+    # Sentences longer than max_tokens are batches on their own
+    batches = token_batches([50, 2, 2], [50, 2, 2], 20)
+    assert sorted(len(batch) for batch in batches) == [1, 2]
+    batches = token_batches([1] * 10, [1] * 10, 100, max_batch_size=3)
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
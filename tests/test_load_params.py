@@ -24,11 +24,20 @@ def test_params_exist():
     assert 'START_EVAL_ON_EPOCH' in params.keys()
     assert 'EVAL_EACH_EPOCHS' in params.keys()
     assert 'EVAL_EACH' in params.keys()
+    assert 'ASYNC_EVALUATION' in params.keys()
+    assert 'ASYNC_EVALUATION_DEVICES' in params.keys()
     assert 'SAMPLING' in params.keys()
     assert 'TEMPERATURE' in params.keys()
     assert 'BEAM_SEARCH' in params.keys()
     assert 'BEAM_SIZE' in params.keys()
     assert 'OPTIMIZED_SEARCH' in params.keys()
+    assert 'SEARCH_BATCH_SIZE' in params.keys()
+    assert 'BEAM_BATCH_SIZE' in params.keys()
+    assert 'SEARCH_BUCKET_WIDTH' in params.keys()
+    assert 'SHORTLIST' in params.keys()
+    assert 'SHORTLIST_FREQUENT_WORDS' in params.keys()
+    assert 'SHORTLIST_CANDIDATES' in params.keys()
+    assert 'SHORTLIST_MAPPING' in params.keys()
     assert 'LENGTH_PENALTY' in params.keys()
     assert 'LENGTH_NORM_FACTOR' in params.keys()
     assert 'COVERAGE_PENALTY' in params.keys()
@@ -44,6 +53,7 @@ def test_params_exist():
     assert 'ALIGN_FROM_RAW' in params.keys()
     assert 'MAPPING' in params.keys()
     assert 'TOKENIZATION_METHOD' in params.keys()
+    assert 'TOKENIZATION_JOBS' in params.keys()
     assert 'DETOKENIZATION_METHOD' in params.keys()
     assert 'APPLY_DETOKENIZATION' in params.keys()
     assert 'TOKENIZE_HYPOTHESES' in params.keys()
@@ -71,6 +81,8 @@ def test_params_exist():
     assert 'BATCH_SIZE' in params.keys()
     assert 'HOMOGENEOUS_BATCHES' in params.keys()
     assert 'JOINT_BATCHES' in params.keys()
+    assert 'MAX_TOKENS' in params.keys()
+    assert 'BUCKET_WIDTH' in params.keys()
     assert 'PARALLEL_LOADERS' in params.keys()
     assert 'EPOCHS_FOR_SAVE' in params.keys()
     assert 'WRITE_VALID_SAMPLES' in params.keys()
@@ -119,6 +131,8 @@ def test_params_exist():
     assert 'RELOAD' in params.keys()
     assert 'RELOAD_EPOCH' in params.keys()
     assert 'REBUILD_DATASET' in params.keys()
+    assert 'DATASET_CACHE' in params.keys()
+    assert 'BINARY_CORPUS' in params.keys()
     assert 'MODE' in params.keys()
     assert 'TRAIN_ON_TRAINVAL' in params.keys()
     assert 'FORCE_RELOAD_VOCABULARY' in params.keys()
@@ -141,11 +155,19 @@ def test_params_type():
     assert isinstance(params['START_EVAL_ON_EPOCH'], int)
     assert isinstance(params['EVAL_EACH_EPOCHS'], bool)
     assert isinstance(params['EVAL_EACH'], int)
+    assert isinstance(params['ASYNC_EVALUATION'], bool)
+    assert params['ASYNC_EVALUATION_DEVICES'] is None or isinstance(params['ASYNC_EVALUATION_DEVICES'], str)
     assert isinstance(params['SAMPLING'], str)
     assert isinstance(params['TEMPERATURE'], int)
     assert isinstance(params['BEAM_SEARCH'], bool)
     assert isinstance(params['BEAM_SIZE'], int)
     assert isinstance(params['OPTIMIZED_SEARCH'], bool)
+    assert isinstance(params['SEARCH_BATCH_SIZE'], int)
+    assert isinstance(params['BEAM_BATCH_SIZE'], int)
+    assert isinstance(params['SEARCH_BUCKET_WIDTH'], int)
+    assert isinstance(params['SHORTLIST'], bool)
+    assert isinstance(params['SHORTLIST_FREQUENT_WORDS'], int)
+    assert isinstance(params['SHORTLIST_CANDIDATES'], int)
     assert isinstance(params['LENGTH_PENALTY'], bool)
     assert isinstance(params['LENGTH_NORM_FACTOR'], float)
     assert isinstance(params['COVERAGE_PENALTY'], bool)
@@ -161,6 +183,7 @@ def test_params_type():
     assert isinstance(params['ALIGN_FROM_RAW'], bool)
     assert isinstance(params['MAPPING'], str)
     assert isinstance(params['TOKENIZATION_METHOD'], str)
+    assert isinstance(params['TOKENIZATION_JOBS'], int)
     assert isinstance(params['DETOKENIZATION_METHOD'], str)
     assert isinstance(params['APPLY_DETOKENIZATION'], bool)
     assert isinstance(params['TOKENIZE_HYPOTHESES'], bool)
@@ -188,6 +211,8 @@ def test_params_type():
     assert isinstance(params['BATCH_SIZE'], int)
     assert isinstance(params['HOMOGENEOUS_BATCHES'], bool)
     assert isinstance(params['JOINT_BATCHES'], int)
+    assert isinstance(params['MAX_TOKENS'], int)
+    assert isinstance(params['BUCKET_WIDTH'], int)
     assert isinstance(params['PARALLEL_LOADERS'], int)
     assert isinstance(params['EPOCHS_FOR_SAVE'], int)
     assert isinstance(params['WRITE_VALID_SAMPLES'], bool)
@@ -235,6 +260,8 @@ def test_params_type():
     assert isinstance(params['RELOAD'], int)
     assert isinstance(params['RELOAD_EPOCH'], bool)
     assert isinstance(params['REBUILD_DATASET'], bool)
+    assert isinstance(params['DATASET_CACHE'], bool)
+    assert isinstance(params['BINARY_CORPUS'], bool)
     assert isinstance(params['MODE'], str)
     assert isinstance(params['TRAIN_ON_TRAINVAL'], bool)
     assert isinstance(params['FORCE_RELOAD_VOCABULARY'], bool)
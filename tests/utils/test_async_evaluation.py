@@ -0,0 +1,214 @@
+import json
+import os
+
+import pytest
+
+from utils import async_evaluation
+from utils.async_evaluation import AsyncEvaluation
+
+
+class FakeModelWrapper(object):
+    """
+    Stores the logged metrics, as Model_Wrapper does.
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.logs = {}
+
+    def log(self, mode, data_type, value):
+        self.logs.setdefault(mode, {}).setdefault(data_type, []).append(value)
+
+    def getLog(self, mode, data_type):
+        return self.logs.get(mode, {}).get(data_type, [None])
+
+
+class FakeKerasModel(object):
+    stop_training = False
+
+
+class FakePopen(object):
+    """
+    Worker which finishes when told to, writing the results given for its model.
+    """
+
+    def __init__(self, command, results, processes):
+        self.command = command
+        self.results = results
+        self.returncode = None
+        processes.append(self)
+
+    def argument(self, name):
+        return self.command[self.command.index(name) + 1]
+
+    def finish(self):
+        result = self.results.get(int(self.argument('--update-num')))
+        if result is None:
+            self.returncode = 1
+        else:
+            with open(self.argument('--dest'), 'w') as f:
+                json.dump(result, f)
+            self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.finish()
+        return self.returncode
+
+
+def save_model(model_wrapper, update_num, path=None, full_path=False, store_iter=False):
+    # Files stored by keras_wrapper.cnn_model.saveModel
+    model_name = os.path.join(model_wrapper.model_path, ('update_' if store_iter else 'epoch_') + str(update_num))
+    for suffix in ['.h5', '_init.h5', '_next.h5', '_Model_Wrapper.pkl']:
+        open(model_name + suffix, 'w').close()
+
+
+@pytest.fixture
+def results():
+    return {}
+
+
+@pytest.fixture
+def processes(monkeypatch, results):
+    processes = []
+    monkeypatch.setattr(async_evaluation.subprocess, 'Popen',
+                        lambda command, **kwargs: FakePopen(command, results, processes))
+    monkeypatch.setattr('keras_wrapper.cnn_model.saveModel', save_model)
+    return processes
+
+
+def build_callback(tmpdir, **kwargs):
+    callback = AsyncEvaluation(FakeModelWrapper(str(tmpdir)), 'config.pkl', 'dataset.pkl', verbose=0, **kwargs)
+    callback.set_model(FakeKerasModel())
+    return callback
+
+
+def test_one_worker_at_a_time(tmpdir, processes, results):
+    callback = build_callback(tmpdir)
+    callback.on_epoch_end(0)
+    callback.on_epoch_end(1)
+    assert len(processes) == 1
+    assert processes[0].argument('--update-num') == '1'
+    assert list(callback.pending) == [(2, 'epoch')]
+
+    # The queued model is evaluated when the running worker finishes
+    results[1] = {'val': {'Bleu_4': 0.1}}
+    processes[0].finish()
+    callback.check_worker()
+    assert len(processes) == 2
+    assert processes[1].argument('--update-num') == '2'
+    assert not callback.pending
+
+
+def test_evaluation_schedule(tmpdir, processes):
+    callback = build_callback(tmpdir, eval_on_epochs=False, each_n_epochs=3)
+    for n_update in range(7):
+        callback.on_batch_end(n_update)
+    assert [process.argument('--update-num') for process in processes] == ['3']
+    assert list(callback.pending) == [(6, 'iteration')]
+    assert processes[0].argument('--counter-name') == 'iteration'
+
+
+def test_check_worker_merges_logs(tmpdir, processes, results):
+    callback = build_callback(tmpdir)
+    results[1] = {'val': {'Bleu_4': 0.2, 'TER': 0.7}, 'test': {'Bleu_4': 0.1}}
+    results[2] = {'val': {'Bleu_4': 0.3, 'TER': 0.6}, 'test': {'Bleu_4': 0.15}}
+    callback.on_epoch_end(0)
+    callback.on_epoch_end(1)
+    callback.on_train_end()
+    assert callback.model_to_eval.logs == {'val': {'Bleu_4': [0.2, 0.3], 'TER': [0.7, 0.6]},
+                                           'test': {'Bleu_4': [0.1, 0.15]}}
+
+
+def test_check_worker_failure(tmpdir, processes, results):
+    callback = build_callback(tmpdir, metric_check='Bleu_4', patience=1)
+    results[2] = {'val': {'Bleu_4': 0.3}}
+    callback.on_epoch_end(0)
+    callback.on_epoch_end(1)
+    processes[0].finish()
+    callback.check_worker()
+    # The failed evaluation is not logged, neither counted by the early stopping, and its model is kept
+    assert callback.model_to_eval.logs == {}
+    assert callback.wait == 0
+    assert tmpdir.join('epoch_1.h5').check()
+    assert len(processes) == 2
+    callback.on_train_end()
+    assert callback.model_to_eval.logs == {'val': {'Bleu_4': [0.3]}}
+
+
+def test_early_stopping_patience(tmpdir, processes, results):
+    callback = build_callback(tmpdir, metric_check='Bleu_4', patience=2)
+    results.update((epoch, {'val': {'Bleu_4': score}}) for epoch, score in zip(range(1, 5), [0.2, 0.3, 0.25, 0.28]))
+    for epoch in range(5):
+        callback.on_epoch_end(epoch)
+    callback.on_train_end()
+    assert callback.best_epoch == 2
+    assert callback.best_score == 0.3
+    assert callback.model.stop_training
+    # The queued evaluation of epoch 5 is discarded
+    assert [process.argument('--update-num') for process in processes] == ['1', '2', '3', '4']
+    assert not callback.pending
+
+
+def test_early_stopping_minimizes_ter(tmpdir, processes, results):
+    callback = build_callback(tmpdir, metric_check='TER', patience=1)
+    results.update((epoch, {'val': {'TER': score}}) for epoch, score in zip(range(1, 4), [0.5, 0.4, 0.45]))
+    for epoch in range(3):
+        callback.on_epoch_end(epoch)
+    callback.on_train_end()
+    assert callback.best_epoch == 2
+    assert callback.best_score == -0.4
+    assert callback.model.stop_training
+
+
+def test_early_stopping_from_log(tmpdir, processes, results):
+    # The scores logged before reloading the model count for the early stopping
+    model_wrapper = FakeModelWrapper(str(tmpdir))
+    for score in [0.3, 0.2]:
+        model_wrapper.log('val', 'Bleu_4', score)
+    callback = AsyncEvaluation(model_wrapper, 'config.pkl', 'dataset.pkl', reload_epoch=2, metric_check='Bleu_4',
+                               patience=2, verbose=0)
+    callback.set_model(FakeKerasModel())
+    results[3] = {'val': {'Bleu_4': 0.25}}
+    callback.on_epoch_end(2)
+    callback.on_train_end()
+    assert callback.model.stop_training
+
+
+def test_on_train_end_drains_queue(tmpdir, processes, results):
+    callback = build_callback(tmpdir)
+    results.update((epoch, {'val': {'Bleu_4': 0.1 * epoch}}) for epoch in range(1, 4))
+    for epoch in range(3):
+        callback.on_epoch_end(epoch)
+    assert len(processes) == 1
+    callback.on_train_end()
+    assert len(processes) == 3
+    assert callback.worker is None
+    assert not callback.pending
+    assert callback.model_to_eval.logs['val']['Bleu_4'] == [0.1 * epoch for epoch in range(1, 4)]
+
+
+def test_evaluated_snapshots_are_removed(tmpdir, processes, results):
+    callback = build_callback(tmpdir, epochs_for_save=2)
+    results.update((epoch, {'val': {'Bleu_4': 0.1}}) for epoch in range(1, 4))
+    for epoch in range(3):
+        callback.on_epoch_end(epoch)
+    callback.on_train_end()
+    # The model of epoch 2 is also a checkpoint of the training
+    assert sorted(path.basename for path in tmpdir.listdir(lambda path: not path.basename.startswith('async_'))) == \
+        ['epoch_2.h5', 'epoch_2_Model_Wrapper.pkl', 'epoch_2_init.h5', 'epoch_2_next.h5']
+
+
+def test_update_snapshots_are_removed(tmpdir, processes, results):
+    callback = build_callback(tmpdir, eval_on_epochs=False, epochs_for_save=1)
+    results[1] = {'val': {'Bleu_4': 0.1}}
+    callback.on_batch_end(0)
+    callback.on_train_end()
+    assert not tmpdir.listdir(lambda path: path.basename.startswith('update_'))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
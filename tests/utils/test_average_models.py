@@ -0,0 +1,56 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+from utils.average_models import average_model_files
+
+
+def store_model(path, dense, bias, optimizer):
+    # Files as stored by saveModel: a full model plus the weights of model_init
+    with h5py.File(path + '.h5', 'w') as f:
+        f.create_dataset('model_weights/dense/dense/kernel:0', data=dense)
+        f.create_dataset('model_weights/dense/dense/bias:0', data=bias)
+        f.create_dataset('optimizer_weights/iterations:0', data=optimizer)
+    with h5py.File(path + '_weights_init.h5', 'w') as f:
+        f.create_dataset('dense/dense/kernel:0', data=dense * 2)
+    with open(path + '_Model_Wrapper.pkl', 'w') as f:
+        f.write(os.path.basename(path))
+
+
+def test_average_model_files(tmpdir):
+    models = [str(tmpdir.join('epoch_%d' % i)) for i in range(1, 4)]
+    for i, model in enumerate(models):
+        store_model(model, np.full((2, 3), i, dtype='float32'), np.arange(3, dtype='float32') * i, np.float32(i))
+    dest = str(tmpdir.join('averaged', 'model'))
+
+    average_model_files(models, dest)
+    with h5py.File(dest + '.h5', 'r') as f:
+        np.testing.assert_allclose(f['model_weights/dense/dense/kernel:0'][()], np.full((2, 3), 1.))
+        np.testing.assert_allclose(f['model_weights/dense/dense/bias:0'][()], np.arange(3))
+        assert f['model_weights/dense/dense/kernel:0'].dtype == np.dtype('float32')
+        # The optimizer state is the one of the first model
+        assert f['optimizer_weights/iterations:0'][()] == 0
+    with h5py.File(dest + '_weights_init.h5', 'r') as f:
+        np.testing.assert_allclose(f['dense/dense/kernel:0'][()], np.full((2, 3), 2.))
+    assert open(dest + '_Model_Wrapper.pkl').read() == 'epoch_1'
+
+    average_model_files(models, dest, weights=['0.5', '0', '0.5'])
+    with h5py.File(dest + '.h5', 'r') as f:
+        np.testing.assert_allclose(f['model_weights/dense/dense/kernel:0'][()], np.full((2, 3), 1.))
+        np.testing.assert_allclose(f['model_weights/dense/dense/bias:0'][()], np.arange(3))
+
+    with pytest.raises(AssertionError):
+        average_model_files(models, dest, weights=[0.5, 0.5])
+
+
+def test_average_incompatible_models(tmpdir):
+    models = [str(tmpdir.join('epoch_1')), str(tmpdir.join('epoch_2'))]
+    store_model(models[0], np.zeros((2, 3), dtype='float32'), np.zeros(3, dtype='float32'), np.float32(0))
+    store_model(models[1], np.zeros((3, 3), dtype='float32'), np.zeros(3, dtype='float32'), np.float32(0))
+    with pytest.raises(AssertionError):
+        average_model_files(models, str(tmpdir.join('model')))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
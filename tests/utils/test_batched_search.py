@@ -0,0 +1,276 @@
+import numpy as np
+import pytest
+from utils.batched_search import BatchedBeamSearchEnsemble, length_buckets
+from utils.cache import LRUCache
+from utils.shortlist import Shortlist, SplitOutputLayer
+
+VOCABULARY_SIZE = 9
+NULL_SYM = 2
+
+
+class _SamplingModel:
+    def __init__(self, step):
+        self.predict_on_batch = step
+
+
+class ToyModel:
+    """
+    Deterministic numpy model exposing the optimized search interface of TranslationModel.
+    Its state only depends on the non-padded source words, so its outputs must not depend on the batch composition.
+    """
+    def __init__(self, seed):
+        rng = np.random.RandomState(seed)
+        self.emb = rng.randn(VOCABULARY_SIZE, VOCABULARY_SIZE)
+        self.ids_inputs_init = ['source_text', 'state_below']
+        self.ids_outputs_init = ['target_text', 'preprocessed_input', 'next_state_0']
+        self.ids_inputs_next = ['state_below', 'preprocessed_input', 'prev_state_0']
+        self.ids_outputs_next = ['target_text', 'preprocessed_input', 'next_state_0']
+        self.matchings_init_to_next = {'preprocessed_input': 'preprocessed_input', 'next_state_0': 'prev_state_0'}
+        self.matchings_next_to_next = {'preprocessed_input': 'preprocessed_input', 'next_state_0': 'prev_state_0'}
+        self.n_init_calls = 0
+        self.n_next_calls = 0
+        self.model_init = _SamplingModel(self._init)
+        self.model_next = _SamplingModel(self._next)
+
+    def _logits(self, state, words):
+        return (np.sin(state[:, None] * np.arange(1, VOCABULARY_SIZE + 1)[None]) + self.emb[words])[:, None, :]
+
+    def _probs(self, state, words):
+        probs = np.exp(self._logits(state, words))
+        return probs / probs.sum(axis=2, keepdims=True)
+
+    def _init(self, in_data, output=None):
+        self.n_init_calls += len(in_data['source_text'])
+        ctx = in_data['source_text'].astype('float32')[:, :, None]
+        state = ctx.sum(axis=(1, 2)) / 10.
+        return [(output or self._probs)(state, in_data['state_below'][:, -1]), ctx, state]
+
+    def _next(self, in_data, output=None):
+        self.n_next_calls += 1
+        ctx = in_data['preprocessed_input']
+        words = in_data['state_below'][:, -1]
+        state = 0.5 * in_data['prev_state_0'] + 0.1 * words + ctx.sum(axis=(1, 2)) / 100.
+        return [(output or self._probs)(state, words), ctx, state]
+
+    def split_output_layer(self):
+        # The logits are the input of an identity output layer
+        return SplitOutputLayer(_SamplingModel(lambda in_data: self._init(in_data, output=self._logits)),
+                                _SamplingModel(lambda in_data: self._next(in_data, output=self._logits)),
+                                np.eye(VOCABULARY_SIZE))
+
+
+class ToyGrowingModel(ToyModel):
+    """
+    ToyModel whose state is the sequence of its previous states (as the cached decoder states of the Transformer).
+    """
+    growing_states = True
+
+    def _init(self, in_data, output=None):
+        probs, ctx, state = ToyModel._init(self, in_data, output=output)
+        return [probs, ctx, state[:, None]]
+
+    def _next(self, in_data, output=None):
+        self.n_next_calls += 1
+        ctx = in_data['preprocessed_input']
+        words = in_data['state_below'][:, -1]
+        prev_states = in_data['prev_state_0']
+        state = 0.5 * prev_states.mean(axis=1) + 0.1 * words + ctx.sum(axis=(1, 2)) / 100.
+        return [(output or self._probs)(state, words), ctx, np.hstack((prev_states, state[:, None]))]
+
+
+class ToyDataset:
+    extra_words = {'<null>': NULL_SYM}
+    ids_inputs = ['source_text', 'state_below']
+
+    def __init__(self, sentences=None):
+        self.X_test = {'source_text': [' '.join(str(w) for w in s) for s in sentences or []]}
+
+    def getX_FromIndices(self, set_name, k):
+        return [pad([[int(w) for w in self.X_test['source_text'][i].split()] for i in k])['source_text'], None]
+
+
+def get_params(**kwargs):
+    params = {'beam_size': 4,
+              'maxlen': 10,
+              'optimized_search': True,
+              'pad_on_batch': True,
+              'model_inputs': ['source_text', 'state_below'],
+              'output_max_length_depending_on_x': True,
+              'output_max_length_depending_on_x_factor': 2,
+              'output_min_length_depending_on_x': True,
+              'output_min_length_depending_on_x_factor': 2,
+              'max_batch_size': 50}
+    params.update(kwargs)
+    return params
+
+
+def pad(sentences):
+    X = np.zeros((len(sentences), max(len(s) for s in sentences) + 1), dtype='int64')
+    for i, s in enumerate(sentences):
+        X[i, :len(s)] = s
+    return {'source_text': X}
+
+
+SENTENCES = [[3, 4, 5], [6, 7, 8, 3, 4], [5], [8, 8, 3, 6]]
+
+
+@pytest.mark.parametrize('n_models', [1, 2])
+def test_batch_matches_single_sentence_search(n_models):
+    models = [ToyModel(seed) for seed in range(n_models)]
+    searcher = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(), n_best=True)
+    batch_samples, _, batch_n_best = searcher.translate_batch(pad(SENTENCES))
+    for i, sentence in enumerate(SENTENCES):
+        samples, _, n_best = searcher.translate_batch(pad([sentence]))
+        assert batch_samples[i] == samples[0]
+        assert batch_n_best[i][0] == n_best[0][0]
+        np.testing.assert_allclose(batch_n_best[i][1], n_best[0][1], rtol=1e-5)
+
+
+def test_beam_batch_size():
+    models = [ToyModel(0)]
+    searcher = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params())
+    chunked = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(beam_batch_size=3))
+    assert searcher.translate_batch(pad(SENTENCES))[0] == chunked.translate_batch(pad(SENTENCES))[0]
+
+
+def test_alphas_required():
+    # Models without attention weights cannot be searched with pos_unk or coverage_penalty
+    with pytest.raises(NotImplementedError):
+        BatchedBeamSearchEnsemble([ToyModel(0)], ToyDataset(), get_params(pos_unk=True))
+    model = ToyModel(0)
+    model.return_alphas = True
+    searcher = BatchedBeamSearchEnsemble([model], ToyDataset(), get_params(coverage_penalty=True))
+    with pytest.raises(NotImplementedError):
+        searcher.translate_batch(pad(SENTENCES))
+
+
+def test_fixed_words():
+    searcher = BatchedBeamSearchEnsemble([ToyModel(0)], ToyDataset(), get_params())
+    fixed_words = [{0: 7, 1: 3}, None, {0: 1}, None]
+    valid_next_words = [[4, 5], None, None, [6]]
+    samples = searcher.translate_batch(pad(SENTENCES), fixed_words=fixed_words,
+                                       valid_next_words=valid_next_words)[0]
+    assert samples[0][:2] == [7, 3]
+    assert samples[0][2] in [4, 5]
+    assert samples[2][0] == 1
+    assert samples[3][0] == 6
+
+
+def test_init_cache():
+    model = ToyModel(0)
+    cache = LRUCache(max_items=10)
+    searcher = BatchedBeamSearchEnsemble([model], ToyDataset(), get_params(), init_cache=cache)
+    X = pad(SENTENCES[:2])
+    samples = searcher.translate_batch(X)[0]
+    assert model.n_init_calls == 2
+    assert searcher.translate_batch(X)[0] == samples
+    assert model.n_init_calls == 2
+    # Only the new sentence goes through model_init
+    X = pad([SENTENCES[1], [8, 3, 4, 6, 5]])
+    uncached = BatchedBeamSearchEnsemble([ToyModel(0)], ToyDataset(), get_params())
+    assert searcher.translate_batch(X)[0] == uncached.translate_batch(X)[0]
+    assert model.n_init_calls == 3
+    assert cache.hits == 3
+
+
+def test_prefix_cache():
+    model = ToyModel(0)
+    uncached_model = ToyModel(0)
+    searcher = BatchedBeamSearchEnsemble([model], ToyDataset(), get_params(beam_size=2),
+                                         init_cache=LRUCache(max_items=10), prefix_cache=LRUCache(max_items=100))
+    uncached = BatchedBeamSearchEnsemble([uncached_model], ToyDataset(), get_params(beam_size=2))
+    X = pad(SENTENCES[1:3])
+    prefix = [7, 3, 5, 4, 6]
+    for prefix_len in range(1, len(prefix) + 1):
+        fixed_words = [dict(enumerate(prefix[:prefix_len])), dict(enumerate(prefix[:prefix_len - 1]))]
+        valid_next_words = [None, [prefix[prefix_len - 1], 8]]
+        n_next_calls = model.n_next_calls
+        n_uncached_next_calls = uncached_model.n_next_calls
+        samples = searcher.translate_batch(X, fixed_words=fixed_words, valid_next_words=valid_next_words)[0]
+        expected = uncached.translate_batch(X, fixed_words=fixed_words, valid_next_words=valid_next_words)[0]
+        assert samples == expected
+        assert samples[0][:prefix_len] == prefix[:prefix_len]
+        if prefix_len > 2:
+            # The previous prefix is not forced again
+            assert model.n_next_calls - n_next_calls <= \
+                uncached_model.n_next_calls - n_uncached_next_calls - (prefix_len - 2)
+
+
+def shortlisted_searcher(models, shortlist, **kwargs):
+    searcher = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(), shortlist=shortlist, **kwargs)
+    searcher.output_layers = [model.split_output_layer() for model in models]
+    return searcher
+
+
+def test_shortlist():
+    models = [ToyModel(0), ToyModel(1)]
+    # A shortlist with the whole vocabulary does not change the search
+    full_shortlist = Shortlist({}, n_frequent=VOCABULARY_SIZE)
+    samples, _, n_best = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(),
+                                                   n_best=True).translate_batch(pad(SENTENCES))
+    shortlisted_samples, _, shortlisted_n_best = shortlisted_searcher(models, full_shortlist,
+                                                                      n_best=True).translate_batch(pad(SENTENCES))
+    assert shortlisted_samples == samples
+    for sentence_n_best, shortlisted_sentence_n_best in zip(n_best, shortlisted_n_best):
+        np.testing.assert_allclose(shortlisted_sentence_n_best[1], sentence_n_best[1], rtol=1e-5)
+
+    shortlist = Shortlist({3: np.asarray([7]), 4: np.asarray([8, 5]), 6: np.asarray([6])}, n_frequent=3)
+    searcher = shortlisted_searcher(models, shortlist, n_best=True)
+    batch_samples, _, batch_n_best = searcher.translate_batch(pad(SENTENCES))
+    for i, sentence in enumerate(SENTENCES):
+        allowed = shortlist.sentence_vocabulary(np.asarray(sentence))
+        for sample in batch_n_best[i][0]:
+            assert set(sample) <= set(allowed)
+        # The shortlist of a sentence does not depend on the rest of the batch
+        samples, _, n_best = searcher.translate_batch(pad([sentence]))
+        assert batch_samples[i] == samples[0]
+        np.testing.assert_allclose(batch_n_best[i][1], n_best[0][1], rtol=1e-5)
+
+    # Fixed words are allowed even if they are out of the shortlist
+    samples = searcher.translate_batch(pad(SENTENCES[2:3]), fixed_words=[{0: 4}])[0]
+    assert samples[0][0] == 4
+
+
+def test_growing_states():
+    models = [ToyGrowingModel(0), ToyModel(1)]
+    searcher = BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(beam_size=3), n_best=True,
+                                         init_cache=LRUCache(max_items=10), prefix_cache=LRUCache(max_items=100))
+    batch_samples, _, batch_n_best = searcher.translate_batch(pad(SENTENCES))
+    for i, sentence in enumerate(SENTENCES):
+        samples, _, n_best = searcher.translate_batch(pad([sentence]))
+        assert batch_samples[i] == samples[0]
+        np.testing.assert_allclose(batch_n_best[i][1], n_best[0][1], rtol=1e-5)
+    # Prefixes are not resumed: the sentences would need states of different lengths
+    fixed_words = [{0: 7, 1: 3}, {0: 7}, None, {0: 7, 1: 3, 2: 5}]
+    searcher.translate_batch(pad(SENTENCES), fixed_words=fixed_words)
+    assert len(searcher.prefix_cache) == 0
+    assert searcher.translate_batch(pad(SENTENCES), fixed_words=fixed_words)[0] == \
+        BatchedBeamSearchEnsemble(models, ToyDataset(), get_params(beam_size=3)).translate_batch(
+            pad(SENTENCES), fixed_words=fixed_words)[0]
+
+
+def test_length_buckets():
+    lengths = [5, 1, 3, 3, 5, 2, 3]
+    assert length_buckets(lengths, 2) == [[1], [5], [2, 3], [6], [0, 4]]
+    assert length_buckets(lengths, 3, bucket_width=3) == [[1, 5, 2], [3, 6, 0], [4]]
+
+
+@pytest.mark.parametrize('bucket_width', [1, 10])
+def test_predict_beam_search_net(bucket_width):
+    sentences = SENTENCES + [[4, 4, 4], [3, 6], [6, 7, 8, 3, 5]]
+    models = [ToyModel(0), ToyModel(1)]
+    params = get_params(predict_on_sets=['test'], dataset_inputs=['source_text', 'state_below'],
+                        search_batch_size=3, search_bucket_width=bucket_width)
+    searcher = BatchedBeamSearchEnsemble(models, ToyDataset(sentences), params, n_best=True)
+    predictions, n_best = searcher.predictBeamSearchNet()['test']
+    assert len(predictions) == len(sentences) == len(n_best)
+    for i, sentence in enumerate(sentences):
+        expected_samples, _, expected_n_best = searcher.translate_batch(pad([sentence]))
+        if bucket_width == 1:
+            assert predictions[i] == expected_samples[0]
+            assert [list(sample) for sample in n_best[i][0]] == expected_n_best[0][0]
+        assert list(n_best[i][0][0]) == predictions[i]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
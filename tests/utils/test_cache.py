@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from utils.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_items=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' becomes the least recently used entry
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.get('b') is None
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def test_memory_limit():
+    cache = LRUCache(max_items=100, max_bytes=3000, sizeof=lambda key, value: value.nbytes)
+    for i in range(5):
+        cache.put(i, np.zeros(100, dtype='float64'))  # 800 bytes
+    assert len(cache) == 3
+    assert cache.n_bytes == 2400
+    assert 0 not in cache and 1 not in cache
+    cache.put('big', np.zeros(1000, dtype='float64'))
+    assert 'big' not in cache
+    cache.clear()
+    assert len(cache) == 0 and cache.n_bytes == 0
+
+
+def test_disabled_cache():
+    cache = LRUCache(max_items=0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
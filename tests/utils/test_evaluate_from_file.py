@@ -1,6 +1,7 @@
 import pytest
 from config import load_parameters
-from utils.evaluate_from_file import load_textfiles, CocoScore
+from utils.evaluate_from_file import load_textfiles, load_hypotheses, load_references, CocoScore, \
+    evaluate_from_file, parser
 
 
 def test_load_textfiles():
@@ -71,5 +72,56 @@ def test_CocoScore():
     assert final_scores['TER'] - 0.0 <= 1e-6
 
 
+def test_CocoScore_jobs():
+    params = load_parameters()
+    filename = params['DATA_ROOT_PATH'] + params['TEXT_FILES']['val'] + params['TRG_LAN']
+    refs, _ = load_textfiles([open(filename, 'r')], open(filename, 'r'))
+    # Hypotheses: the references with the words of each odd sentence reversed
+    hypo = {idx: [' '.join(refs[idx][0].split()[::-1 if idx % 2 else 1])] for idx in refs}
+    metrics = ['bleu', 'ter', 'rouge_l']
+    final_scores = CocoScore(refs, hypo, metrics_list=metrics, language=params['TRG_LAN'])
+    parallel_scores = CocoScore(refs, hypo, metrics_list=metrics, language=params['TRG_LAN'], jobs=3)
+    assert sorted(parallel_scores.keys()) == sorted(final_scores.keys())
+    for metric in final_scores:
+        assert abs(parallel_scores[metric] - final_scores[metric]) <= 1e-9
+
+
+def test_CocoScore_fast():
+    params = load_parameters()
+    filename = params['DATA_ROOT_PATH'] + params['TEXT_FILES']['val'] + params['TRG_LAN']
+    refs, _ = load_textfiles([open(filename, 'r')], open(filename, 'r'))
+    hypo = {idx: [' '.join(refs[idx][0].split()[::-1 if idx % 2 else 1])] for idx in refs}
+    fast_scores = CocoScore(refs, hypo, metrics_list=['fast'], language=params['TRG_LAN'])
+    assert sorted(fast_scores.keys()) == ['Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4', 'TER', 'chrF']
+    # The BLEU of utils.mt_metrics is identical to the coco one
+    coco_scores = CocoScore(refs, hypo, metrics_list=['bleu'], language=params['TRG_LAN'])
+    for metric in coco_scores:
+        assert abs(fast_scores[metric] - coco_scores[metric]) <= 1e-9
+    parallel_scores = CocoScore(refs, hypo, metrics_list=['fast'], language=params['TRG_LAN'], jobs=2)
+    assert parallel_scores == fast_scores
+
+
+def test_load_hypotheses():
+    params = load_parameters()
+    filename = params['DATA_ROOT_PATH'] + params['TEXT_FILES']['val'] + params['TRG_LAN']
+    refs = load_references([open(filename, 'r'), open(filename, 'r')])
+    assert all(len(refs[idx]) == 2 for idx in refs)
+    hypo = load_hypotheses(open(filename, 'r'), len(refs))
+    assert sorted(hypo.keys()) == sorted(refs.keys())
+    with pytest.raises(ValueError):
+        load_hypotheses(open(filename, 'r'), len(refs) + 1)
+
+
+def test_evaluate_multiple_systems(capsys):
+    params = load_parameters()
+    filename = params['DATA_ROOT_PATH'] + params['TEXT_FILES']['val'] + params['TRG_LAN']
+    args = parser.parse_args(['-r', filename, '-t', filename, filename, '-m', 'bleu'])
+    evaluate_from_file(args)
+    lines = capsys.readouterr()[0].strip().split('\n')
+    assert lines[-3].split() == ['System', 'Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4']
+    assert lines[-2].split() == [filename, '1.00000', '1.00000', '1.00000', '1.00000']
+    assert lines[-1].split() == [filename, '1.00000', '1.00000', '1.00000', '1.00000']
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
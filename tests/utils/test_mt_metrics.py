@@ -0,0 +1,102 @@
+import math
+import random
+from collections import Counter
+
+import pytest
+from utils.mt_metrics import corpus_bleu, corpus_chrf, corpus_ter, edit_distance, get_fast_score
+
+
+def reference_bleu(hypotheses, references, max_order=4):
+    # Straightforward BLEU, as computed by the BleuScorer of pycocoevalcap
+    def ngrams(words):
+        return Counter(tuple(words[i:i + n]) for n in range(1, max_order + 1) for i in range(len(words) - n + 1))
+
+    correct = [0] * max_order
+    guess = [0] * max_order
+    testlen = reflen = 0
+    for hypothesis, refs in zip(hypotheses, references):
+        words = hypothesis.split()
+        max_counts = Counter()
+        for reference in refs:
+            for ngram, count in ngrams(reference.split()).items():
+                max_counts[ngram] = max(max_counts[ngram], count)
+        for ngram, count in ngrams(words).items():
+            correct[len(ngram) - 1] += min(count, max_counts[ngram])
+        for n in range(max_order):
+            guess[n] += max(0, len(words) - n)
+        testlen += len(words)
+        reflen += min((abs(len(reference.split()) - len(words)), len(reference.split())) for reference in refs)[1]
+    scores = []
+    bleu = 1.
+    for n in range(max_order):
+        bleu *= float(correct[n] + 1e-15) / (guess[n] + 1e-9)
+        scores.append(bleu ** (1. / (n + 1)))
+    ratio = (testlen + 1e-15) / (reflen + 1e-9)
+    if ratio < 1:
+        scores = [score * math.exp(1 - 1 / ratio) for score in scores]
+    return scores
+
+
+def test_bleu():
+    hypotheses = ['the cat is on the mat', 'there is a dog in the garden', 'a b c']
+    references = [['the cat sat on the mat', 'a cat is on the mat'], ['a dog is in the garden'], ['a b c d e']]
+    expected = [0.8806997462775461, 0.7977568773438772, 0.6686352023593147, 0.5322173961010159]
+    assert corpus_bleu(hypotheses, references) == pytest.approx(expected, abs=1e-12)
+    assert corpus_bleu(hypotheses, [[hypothesis] for hypothesis in hypotheses]) == pytest.approx([1.] * 4)
+
+
+def test_bleu_identical_to_reference():
+    rng = random.Random(1)
+    words = ['a', 'b', 'c', 'd', 'e', 'f']
+
+    def sentence():
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(0, 10)))
+
+    for _ in range(50):
+        n_sentences = rng.randint(1, 10)
+        hypotheses = [sentence() for _ in range(n_sentences)]
+        references = [[sentence() for _ in range(rng.randint(1, 3))] for _ in range(n_sentences)]
+        assert corpus_bleu(hypotheses, references) == reference_bleu(hypotheses, references)
+
+
+def test_chrf():
+    assert corpus_chrf(['the cat sat'], [['the cat sat']]) == pytest.approx(1.)
+    assert corpus_chrf(['abc'], [['xyz']]) == pytest.approx(0.)
+    # Unigram precision 1, recall 2/3; bigram precision 1, recall 1/2 -> P = 1, R = 7/12
+    assert corpus_chrf(['ab'], [['abc']], max_order=2) == pytest.approx(5 * 7. / 12 / (4 + 7. / 12))
+    # The best reference of each hypothesis is used
+    assert corpus_chrf(['the cat'], [['a dog', 'the cat']]) == pytest.approx(1.)
+
+
+def test_edit_distance():
+    assert edit_distance([1, 2, 3], [1, 2, 3]) == 0
+    assert edit_distance([], [1, 2]) == 2
+    assert edit_distance([1, 2, 3], [1, 4, 3, 5]) == 2
+    distance, trace = edit_distance([1, 2, 3], [1, 4, 3, 5], return_trace=True)
+    assert distance == 2
+    assert trace == ' s d'
+
+
+def test_ter():
+    assert corpus_ter(['a b c d'], [['a b c d']]) == 0.
+    # One shift
+    assert corpus_ter(['c d a b'], [['a b c d']]) == pytest.approx(1. / 4)
+    # One substitution and one deletion, over the average length of the references
+    assert corpus_ter(['a x c'], [['a b c d', 'a b c d e f']]) == pytest.approx(2. / 5)
+    assert corpus_ter(['a b', 'c'], [['a b'], ['d e']]) == pytest.approx(2. / 4)
+
+
+def test_get_fast_score():
+    extra_vars = {'val': {'references': {0: ['The cat is here'], 1: ['A dog']}},
+                  'tokenize_f': lambda sentence: sentence.lower(),
+                  'tokenize_hypotheses': True,
+                  'tokenize_references': True}
+    scores = get_fast_score(['the cat is here ', 'a dog'], 0, extra_vars, 'val')
+    assert sorted(scores) == ['Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4', 'TER', 'chrF']
+    assert scores['Bleu_4'] == pytest.approx(1.)
+    assert scores['chrF'] == pytest.approx(1.)
+    assert scores['TER'] == 0.
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -3,7 +3,9 @@ import os
 import pytest
 import numpy as np
 from subprocess import call
+from utils.preprocess_binary_word_vectors import word2vec2npy
 from utils.preprocess_text_word_vectors import txtvec2npy
+from utils.word_vectors import load_word_vectors, lookup_word_vectors, pretrained_embedding_weights, save_word_vectors
 
 
 def test_text_word2vec2npy():
@@ -15,10 +17,56 @@ def test_text_word2vec2npy():
               path + "/" + vectors_name],
              shell=True)
     txtvec2npy(path + '/' + vectors_name, './', vectors_name[:-4])
-    vectors = np.load('./' + vectors_name[:-4] + '.npy').item()
+    vectors, words, rows = load_word_vectors('./' + vectors_name[:-4] + '.npy')
 
-    assert len(vectors.keys()) == 8770
-    assert vectors['kihlkunnan'].shape[0] == 300
+    # The header of the file (number of vectors and dimension) is not a vector
+    assert vectors.shape == (8769, 300)
+    assert len(words) == len(rows) == 8769
+    found, word_vectors = lookup_word_vectors('./' + vectors_name[:-4] + '.npy', ['kihlkunnan'])
+    assert found.all()
+    assert word_vectors.shape == (1, 300)
+
+
+def test_text_vectors_vocabulary(tmpdir):
+    vectors_path = str(tmpdir.join('vectors.txt'))
+    with open(vectors_path, 'w') as f:
+        f.write('the 0.1 0.2\ncat 0.3 0.4\nbad\nnew york 0.5 0.6\ndog 0.7 0.8\n')
+    txtvec2npy(vectors_path, str(tmpdir), 'vectors')
+    vectors, words, rows = load_word_vectors(str(tmpdir.join('vectors.npy')))
+    assert list(words) == ['cat', 'dog', 'new york', 'the']
+    np.testing.assert_allclose(vectors[rows], [[0.3, 0.4], [0.7, 0.8], [0.5, 0.6], [0.1, 0.2]])
+
+    txtvec2npy(vectors_path, str(tmpdir), 'filtered', vocabulary={'dog', 'the', 'mouse'})
+    vectors, words, rows = load_word_vectors(str(tmpdir.join('filtered.npy')))
+    assert list(words) == ['dog', 'the']
+    np.testing.assert_allclose(vectors, [[0.1, 0.2], [0.7, 0.8]])
+
+
+def test_binary_word2vec2npy(tmpdir):
+    vectors_path = str(tmpdir.join('vectors.bin'))
+    vectors = np.arange(9, dtype='float32').reshape(3, 3)
+    with open(vectors_path, 'wb') as f:
+        f.write('3 3\n')
+        for word, vector in zip(['the', 'cat', 'dog'], vectors):
+            f.write(word + ' ' + vector.tostring() + '\n')
+    word2vec2npy(vectors_path, str(tmpdir), 'vectors', vocabulary={'cat', 'dog'})
+    found, word_vectors = lookup_word_vectors(str(tmpdir.join('vectors.npy')), ['dog', 'the', 'cat'])
+    assert list(found) == [True, False, True]
+    np.testing.assert_array_equal(word_vectors, vectors[[2, 1]])
+
+
+def test_pretrained_embedding_weights(tmpdir):
+    filepath = str(tmpdir.join('vectors.npy'))
+    vectors = np.arange(12, dtype='float32').reshape(4, 3)
+    save_word_vectors(['the', 'cat', u'\xe9t\xe9', 'a'], vectors, filepath)
+    words2idx = {'<pad>': 0, 'a': 1, 'cat': 2, u'\xe9t\xe9': 3, 'dog': 4, 'a_very_long_word': 5}
+    weights = pretrained_embedding_weights(filepath, words2idx, 6, 3)
+    assert weights.shape == (6, 3)
+    np.testing.assert_array_equal(weights[1], vectors[3])
+    np.testing.assert_array_equal(weights[2], vectors[1])
+    np.testing.assert_array_equal(weights[3], vectors[2])
+    # Random initialization of the words without pretrained vectors
+    assert np.all((weights[[0, 4, 5]] >= 0) & (weights[[0, 4, 5]] < 1))
 
 
 if __name__ == '__main__':
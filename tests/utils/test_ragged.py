@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from utils.ragged import RaggedArray, RaggedWriter
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'int32'])
+def test_write_and_read(tmpdir, dtype):
+    arrays = [np.arange(3), np.asarray([]), np.asarray([7, 8]), np.asarray([-1])]
+    filepath = str(tmpdir.join('values'))
+    with RaggedWriter(filepath, dtype=dtype) as writer:
+        writer.append(arrays[0])
+        writer.extend(arrays[1:3])
+        writer.extend([])
+        writer.append(arrays[3])
+    ragged = RaggedArray(filepath, dtype=dtype)
+    assert len(ragged) == len(arrays)
+    assert list(ragged.offsets) == [0, 3, 3, 5, 6]
+    for values, expected in zip(ragged, arrays):
+        assert values.dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(values, expected)
+    np.testing.assert_array_equal(ragged[-2], arrays[2])
+    with pytest.raises(IndexError):
+        ragged[len(arrays)]
+
+
+def test_empty(tmpdir):
+    filepath = str(tmpdir.join('values'))
+    RaggedWriter(filepath).close()
+    assert len(RaggedArray(filepath)) == 0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from keras.layers import Input, PositionLayer
+from keras.models import Model
+
+from config import load_parameters
+from model_zoo import TranslationModel, updateTranslationModel
+
+
+def load_tests_params():
+    params = load_parameters()
+    params['INPUT_VOCABULARY_SIZE'] = 11
+    params['OUTPUT_VOCABULARY_SIZE'] = 13
+    params['SOURCE_TEXT_EMBEDDING_SIZE'] = 8
+    params['TARGET_TEXT_EMBEDDING_SIZE'] = 8
+    params['ENCODER_HIDDEN_SIZE'] = 4
+    params['DECODER_HIDDEN_SIZE'] = 4
+    params['ATTENTION_SIZE'] = 5
+    params['SKIP_VECTORS_HIDDEN_SIZE'] = 8
+    params['DEEP_OUTPUT_LAYERS'] = [('linear', 8)]
+    params['SRC_PRETRAINED_VECTORS'] = None
+    params['TRG_PRETRAINED_VECTORS'] = None
+    params['COVERAGE_PENALTY'] = False
+    params['POS_UNK'] = False
+    return params
+
+
+def build_model(params, tmpdir):
+    return TranslationModel(params, model_type=params['MODEL_TYPE'], verbose=0, model_name='test_sampling',
+                            vocabularies=None, store_path=str(tmpdir), set_optimizer=False)
+
+
+def stepwise_probabilities(model, src, trg_below):
+    """
+    Probabilities of each target position computed with model_init (first position) and model_next (following ones),
+    feeding the models as the beam search does.
+    """
+    n_samples = len(src)
+    outputs = model.model_init.predict_on_batch({model.ids_inputs[0]: src, model.ids_inputs[1]: trg_below[:, :1]})
+    probs = [np.reshape(outputs[0], (n_samples, -1))]
+    matchings = model.matchings_init_to_next
+    output_ids = model.ids_outputs_init
+    for t in range(1, trg_below.shape[1]):
+        in_data = dict((matchings[name], output) for name, output in zip(output_ids, outputs) if name in matchings)
+        in_data[model.ids_inputs_next[0]] = trg_below[:, t:t + 1]
+        outputs = model.model_next.predict_on_batch(in_data)
+        probs.append(np.reshape(outputs[0], (n_samples, -1)))
+        matchings = model.matchings_next_to_next
+        output_ids = model.ids_outputs_next
+    return np.asarray(probs).transpose(1, 0, 2)
+
+
+def check_stepwise_probabilities(model, params):
+    rng = np.random.RandomState(1)
+    src = rng.randint(1, params['INPUT_VOCABULARY_SIZE'], size=(3, 6))
+    trg_below = rng.randint(1, params['OUTPUT_VOCABULARY_SIZE'], size=(3, 5))
+    expected = model.model.predict_on_batch({model.ids_inputs[0]: src, model.ids_inputs[1]: trg_below})
+    np.testing.assert_allclose(stepwise_probabilities(model, src, trg_below), expected, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize('decoder_rnn_type', ['LSTM', 'GRU', 'ConditionalLSTM', 'ConditionalGRU'])
+def test_rnn_sampling_models(tmpdir, decoder_rnn_type):
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'AttentionRNNEncoderDecoder'
+    params['DECODER_RNN_TYPE'] = decoder_rnn_type
+    params['N_LAYERS_DECODER'] = 2
+    model = build_model(params, tmpdir)
+    # model_init hands the projected annotations to model_next
+    assert model.matchings_init_to_next['projected_ctx'] == 'prev_projected_ctx'
+    assert 'prev_projected_ctx' in model.ids_inputs_next
+    check_stepwise_probabilities(model, params)
+
+
+def load_transformer_params():
+    params = load_tests_params()
+    params['MODEL_TYPE'] = 'Transformer'
+    params['MODEL_SIZE'] = 8
+    params['FF_SIZE'] = 16
+    params['N_HEADS'] = 2
+    params['N_LAYERS_ENCODER'] = 2
+    params['N_LAYERS_DECODER'] = 2
+    return params
+
+
+def test_transformer_sampling_models(tmpdir):
+    params = load_transformer_params()
+    model = build_model(params, tmpdir)
+    # model_next caches the keys and values of the self-attention of each decoder block
+    assert len(model.ids_inputs_next) == 2 + 2 * params['N_LAYERS_DECODER']
+    check_stepwise_probabilities(model, params)
+
+
+@pytest.mark.parametrize('model_type', ['AttentionRNNEncoderDecoder', 'Transformer'])
+def test_update_translation_model(tmpdir, model_type):
+    # Only the weights of the training model are stored: the sampling models get them from it
+    params = load_transformer_params()
+    params['MODEL_TYPE'] = model_type
+    model = build_model(params, tmpdir.join('stored'))
+    model_path = str(tmpdir.join('epoch_1'))
+    model.model.save_weights(model_path + '_weights.h5')
+    updated_model = updateTranslationModel(build_model(params, tmpdir.join('updated')), model_path, 1, full_path=True)
+
+    rng = np.random.RandomState(2)
+    src = rng.randint(1, params['INPUT_VOCABULARY_SIZE'], size=(2, 4))
+    trg_below = rng.randint(1, params['OUTPUT_VOCABULARY_SIZE'], size=(2, 3))
+    np.testing.assert_allclose(stepwise_probabilities(updated_model, src, trg_below),
+                               stepwise_probabilities(model, src, trg_below), rtol=1e-5)
+
+
+def test_position_layer():
+    # The positional encodings of the Transformer are indexed from position 0
+    words = Input(batch_shape=(None, None), dtype='int32')
+    positions = Model(inputs=words, outputs=PositionLayer()(words)).predict(np.array([[4, 2, 7]]))
+    np.testing.assert_array_equal(positions, [[0, 1, 2]])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from utils.scoring import ForcedDecodingScorer
+
+VOCABULARY_SIZE = 7
+
+
+class _TrainingModel:
+    def __init__(self, step):
+        self.predict_on_batch = step
+
+
+class ToyModel:
+    """
+    Deterministic numpy teacher-forced model: the probabilities of each time-step depend on the source sentence and
+    on the previous target word (state_below).
+    """
+    def __init__(self, seed):
+        rng = np.random.RandomState(seed)
+        self.emb = rng.randn(VOCABULARY_SIZE, VOCABULARY_SIZE)
+        self.model = _TrainingModel(self._forward)
+
+    def _forward(self, in_data):
+        ctx = in_data['source_text'].astype('float32').sum(axis=1) / 10.
+        logits = np.sin(ctx[:, None, None] * np.arange(1, VOCABULARY_SIZE + 1)[None, None]) + \
+            self.emb[in_data['state_below']]
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=2, keepdims=True)
+
+
+def toy_batch():
+    src = np.asarray([[3, 4, 0], [5, 6, 6]])
+    y = np.asarray([[4, 5, 0, 0], [3, 0, 0, 0]])
+    mask = np.asarray([[1, 1, 1, 0], [1, 1, 0, 0]], dtype='int8')
+    state_below = np.hstack((np.ones((2, 1), dtype='int64'), y[:, :-1]))
+    return {'source_text': src, 'state_below': state_below}, y, mask
+
+
+def test_score_batch():
+    models = [ToyModel(0), ToyModel(1)]
+    X, y, mask = toy_batch()
+    scorer = ForcedDecodingScorer(models, {}, model_weights=[0.25, 0.75])
+    scores, tokens = scorer.score_batch(X, y, mask)
+    log_probs = tokens['log_probs']
+    probs = 0.25 * models[0].model.predict_on_batch(X) + 0.75 * models[1].model.predict_on_batch(X)
+    for i in range(len(y)):
+        length = mask[i].sum()
+        expected = [np.log(probs[i, t, y[i, t]]) for t in range(length)]
+        np.testing.assert_allclose(log_probs[i, :length], expected, rtol=1e-5)
+        assert np.all(log_probs[i, length:] == 0.)
+        np.testing.assert_allclose(scores[i], -np.sum(expected), rtol=1e-5)
+
+
+def test_normalization():
+    models = [ToyModel(0)]
+    X, y, mask = toy_batch()
+    scores, _ = ForcedDecodingScorer(models, {}).score_batch(X, y, mask)
+    normalized, _ = ForcedDecodingScorer(models, {'normalize_probs': True, 'alpha_factor': 1.0}).score_batch(X, y, mask)
+    np.testing.assert_allclose(normalized, scores / mask.sum(axis=1))
+
+
+def test_score_in_order():
+    models = [ToyModel(0)]
+    X, y, mask = toy_batch()
+    scorer = ForcedDecodingScorer(models, {})
+    scores, tokens = scorer.score_batch(X, y, mask)
+    # Batches sorted by length, in reverse order of the sentences
+    batches = [([1], {'source_text': X['source_text'][1:], 'state_below': X['state_below'][1:]}, y[1:], mask[1:]),
+               ([0], {'source_text': X['source_text'][:1], 'state_below': X['state_below'][:1]}, y[:1], mask[:1])]
+    results = list(scorer.score(batches))
+    assert len(results) == 2
+    for i, (score, sentence_tokens) in enumerate(results):
+        np.testing.assert_allclose(score, scores[i], rtol=1e-5)
+        np.testing.assert_allclose(sentence_tokens['log_probs'], tokens['log_probs'][i, :mask[i].sum()], rtol=1e-5)
+    with pytest.raises(AssertionError):
+        list(scorer.score(batches[:1]))
+
+
+def test_entropies_and_alignments():
+    models = [ToyModel(0), ToyModel(1)]
+    X, y, mask = toy_batch()
+    alphas = [np.random.RandomState(seed).rand(2, 4, 3) for seed in [2, 3]]
+    scorer = ForcedDecodingScorer(models, {}, entropies=True, alignments=True)
+    # Attention models returning time-major attention weights, as the AttRNNCond layers
+    scorer.attention_models = [
+        _TrainingModel(lambda in_data, m=m, a=a: [m.model.predict_on_batch(in_data), np.transpose(a, (1, 0, 2))])
+        for m, a in zip(models, alphas)]
+    scores, tokens = scorer.score_batch(X, y, mask)
+    expected_scores, expected_tokens = ForcedDecodingScorer(models, {}).score_batch(X, y, mask)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+    np.testing.assert_allclose(tokens['log_probs'], expected_tokens['log_probs'], rtol=1e-5)
+    probs = 0.5 * models[0].model.predict_on_batch(X) + 0.5 * models[1].model.predict_on_batch(X)
+    entropies = -np.sum(probs * np.log(probs), axis=2)
+    np.testing.assert_allclose(tokens['entropies'], entropies * mask, rtol=1e-5)
+    np.testing.assert_array_equal(tokens['alignments'], np.argmax(alphas[0] + alphas[1], axis=2) * mask)
+
+
+def test_coverage_penalty():
+    models = [ToyModel(0), ToyModel(1)]
+    X, y, mask = toy_batch()
+    alphas = [np.random.RandomState(seed).rand(2, 4, 3) / 2. for seed in [2, 3]]
+    params = {'coverage_penalty': True, 'coverage_norm_factor': 0.2, 'length_penalty': True,
+              'length_norm_factor': 0.6, 'model_inputs': ['source_text', 'state_below']}
+    scorer = ForcedDecodingScorer(models, params)
+    scorer.attention_models = [
+        _TrainingModel(lambda in_data, m=m, a=a: [m.model.predict_on_batch(in_data), np.transpose(a, (1, 0, 2))])
+        for m, a in zip(models, alphas)]
+    scores, _ = scorer.score_batch(X, y, mask)
+    unnormalized, _ = ForcedDecodingScorer(models, {}).score_batch(X, y, mask)
+    alpha = 0.5 * alphas[0] + 0.5 * alphas[1]
+    for i in range(len(y)):
+        # Penalties of BeamSearchEnsemble.scoreNet, over the (unpadded) source and target words
+        length = mask[i].sum()
+        cp_penalty = 0.0
+        for cp_i in range(np.count_nonzero(X['source_text'][i])):
+            att_weight = 0.0
+            for cp_j in range(length):
+                att_weight += alpha[i, cp_j, cp_i]
+            cp_penalty += np.log(min(att_weight, 1.0))
+        length_penalty = (5 + length) ** 0.6 / (5 + 1) ** 0.6
+        np.testing.assert_allclose(scores[i], unnormalized[i] / length_penalty + 0.2 * cp_penalty, rtol=1e-5)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import codecs
+import pytest
+from utils.sharding import split_file, merge_files, merge_nbest_files
+
+
+@pytest.mark.parametrize('n_shards', [1, 3, 7, 20])
+def test_split_and_merge(tmpdir, n_shards):
+    lines = [u'sentence número %d\n' % i for i in range(10)]
+    filepath = str(tmpdir.join('text'))
+    with codecs.open(filepath, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    shards_dir = str(tmpdir.mkdir('shards'))
+    shards = split_file(filepath, n_shards, shards_dir)
+    assert len(shards) == min(n_shards, len(lines))
+    assert shards[0][1] == 0
+    for (shard_path, offset), next_offset in zip(shards, [s[1] for s in shards[1:]] + [len(lines)]):
+        with codecs.open(shard_path, 'r', encoding='utf-8') as f:
+            assert f.readlines() == lines[offset:next_offset]
+    merged = str(tmpdir.join('merged'))
+    merge_files([shard_path for shard_path, _ in shards], merged)
+    with codecs.open(merged, 'r', encoding='utf-8') as f:
+        assert f.readlines() == lines
+
+
+def test_merge_nbest_files(tmpdir):
+    nbest_0 = str(tmpdir.join('nbest_0'))
+    nbest_1 = str(tmpdir.join('nbest_1'))
+    with codecs.open(nbest_0, 'w', encoding='utf-8') as f:
+        f.write(u'0 ||| una casa ||| 1.5\n0 ||| la casa ||| 2.0\n1 ||| adiós ||| 0.3\n')
+    with codecs.open(nbest_1, 'w', encoding='utf-8') as f:
+        f.write(u'0 ||| hola ||| 0.1\n')
+    merged = str(tmpdir.join('merged'))
+    merge_nbest_files([nbest_0, nbest_1], [0, 2], merged)
+    with codecs.open(merged, 'r', encoding='utf-8') as f:
+        assert f.read() == u'0 ||| una casa ||| 1.5\n0 ||| la casa ||| 2.0\n1 ||| adiós ||| 0.3\n2 ||| hola ||| 0.1\n'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
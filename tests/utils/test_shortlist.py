@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from utils.shortlist import Shortlist, SplitOutputLayer, build_shortlist
+
+
+def test_build_shortlist():
+    word2index_x = {u'<pad>': 0, u'<unk>': 1, u'casa': 2, u'perro': 3, u'camión': 4}
+    word2index_y = {u'<pad>': 0, u'<unk>': 1, u'the': 2, u'house': 3, u'home': 4, u'dog': 5, u'truck': 6}
+    mapping = {'casa': ['house', 'home', 'building'],  # Candidates lists
+               'perro': 'dog',  # Top-1 mappings
+               'cami\xc3\xb3n': ['truck'],
+               'gato': ['cat']}
+    shortlist = build_shortlist(mapping, word2index_x, word2index_y, n_frequent=3, n_candidates=2)
+    assert sorted(shortlist.candidates) == [2, 3, 4]
+    assert list(shortlist.candidates[2]) == [3, 4]
+    assert list(shortlist.candidates[3]) == [5]
+    assert list(shortlist.candidates[4]) == [6]
+    shortlist = build_shortlist(mapping, word2index_x, word2index_y, n_frequent=3, n_candidates=1)
+    assert list(shortlist.candidates[2]) == [3]
+
+
+def test_select():
+    shortlist = Shortlist({2: np.asarray([3, 4]), 3: np.asarray([5]), 4: np.asarray([6])}, n_frequent=3)
+    src = np.asarray([[2, 3, 0, 0],
+                      [4, 4, 1, 0],
+                      [1, 0, 0, 0]])
+    vocabulary, allowed = shortlist.select(src, extra_words=[None, [9], None])
+    assert list(vocabulary) == [0, 1, 2, 3, 4, 5, 6, 9]
+    assert [list(vocabulary[sentence_allowed]) for sentence_allowed in allowed] == \
+        [[0, 1, 2, 3, 4, 5], [0, 1, 2, 6, 9], [0, 1, 2]]
+
+
+def test_split_output_layer_probs():
+    rng = np.random.RandomState(0)
+    kernel = rng.randn(4, 10)
+    bias = rng.randn(10)
+    hidden = rng.randn(2, 4)
+    output_layer = SplitOutputLayer(None, None, kernel, bias)
+    vocabulary = np.asarray([0, 3, 4, 7])
+    allowed = np.asarray([[True, True, True, True], [True, False, True, False]])
+    probs = output_layer.probs(hidden, vocabulary, allowed)
+    np.testing.assert_allclose(probs.sum(axis=1), 1.)
+    assert np.all(probs[~allowed] == 0.)
+    logits = np.dot(hidden, kernel) + bias
+    expected = np.exp(logits[0, vocabulary]) / np.exp(logits[0, vocabulary]).sum()
+    np.testing.assert_allclose(probs[0], expected)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import pytest
+from utils.vocabulary import PrefixIndex
+
+
+def test_prefix_index():
+    word2index = {'casa': 3, 'casas': 4, 'caso': 5, 'cas@@': 6, 'cama': 7, 'árbol': 8, 'c': 9, 'd': 10}
+    index = PrefixIndex(word2index)
+    assert len(index) == len(word2index)
+    for prefix in [u'', u'c', u'ca', u'cas', u'casa', u'casas', u'casass', u'á', u'ár', u'z', u'b']:
+        expected = dict((i, w) for w, i in word2index.iteritems() if w.decode('utf-8').startswith(prefix))
+        assert index.completions(prefix) == expected
+
+
+def test_prefix_index_greatest_character():
+    greatest = unichr(sys.maxunicode)
+    words = [u'a' + greatest, u'a' + greatest + u'b', u'a' + greatest * 2, u'b', greatest]
+    index = PrefixIndex(dict((word, i) for i, word in enumerate(words)))
+    assert index.completions(u'a' + greatest) == {0: words[0], 1: words[1], 2: words[2]}
+    assert index.completions(u'a' + greatest * 2) == {2: words[2]}
+    assert index.completions(greatest) == {4: greatest}
+    assert index.completions(greatest * 2) == {}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
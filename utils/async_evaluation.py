@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+from collections import deque
+
+from keras.callbacks import Callback as KerasCallback
+
+from average_models import MODEL_FILES, MODEL_EXTRA_FILES
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEvaluation(KerasCallback):
+    def __init__(self,
+                 model,
+                 config_filename,
+                 dataset_filename,
+                 each_n_epochs=1,
+                 eval_on_epochs=True,
+                 start_eval_on_epoch=0,
+                 reload_epoch=0,
+                 metric_check=None,
+                 check_split='val',
+                 patience=0,
+                 min_delta=0.,
+                 epochs_for_save=0,
+                 devices=None,
+                 verbose=1):
+        """
+        Evaluates the model in a separate process, so that the training goes on while the evaluation sets are decoded
+        and scored. At each evaluation point, the model is stored (as saveModel does) and a worker process (see
+        evaluate_snapshot) loads it and evaluates it with the PrintPerformanceMetricOnEpochEndOrEachNUpdates callback
+        built by main.buildCallbacks. When the worker finishes, its metrics are added to the log of the model and
+        early stopping is applied on them, as the EarlyStopping callback does. The stored model is then removed,
+        unless it is also a checkpoint of the training (see epochs_for_save).
+        A single worker runs at once: the evaluation points reached while it runs are queued.
+
+        :param model: Model_Wrapper object to evaluate
+        :param config_filename: Parameters of the model (as stored by main.train_model)
+        :param dataset_filename: Dataset instance (pkl) with the evaluation sets
+        :param each_n_epochs: Evaluate each this number of epochs or updates
+        :param eval_on_epochs: Evaluate each epochs (True) or each updates (False)
+        :param start_eval_on_epoch: Only starts evaluating the model if a given epoch has been reached
+        :param reload_epoch: Reloading epoch
+        :param metric_check: Metric checked for early stopping (None for disabling it)
+        :param check_split: Split on which metric_check is checked
+        :param patience: Number of evaluations without improvement before stopping the training
+        :param min_delta: Minimum change of metric_check to qualify as an improvement
+        :param epochs_for_save: Number of epochs between the models stored by the training (EPOCHS_FOR_SAVE), which are
+                                kept after their evaluation (0 for none)
+        :param devices: Value of CUDA_VISIBLE_DEVICES for the workers (None for inheriting it)
+        :param verbose: Verbosity level
+        """
+        super(AsyncEvaluation, self).__init__()
+        self.model_to_eval = model
+        self.config_filename = config_filename
+        self.dataset_filename = dataset_filename
+        self.each_n_epochs = each_n_epochs
+        self.eval_on_epochs = eval_on_epochs
+        self.start_eval_on_epoch = start_eval_on_epoch
+        self.metric_check = metric_check
+        self.check_split = check_split
+        self.patience = patience
+        self.want_to_minimize = metric_check is not None and 'TER' in metric_check
+        self.min_delta = -min_delta if self.want_to_minimize else min_delta
+        self.epochs_for_save = epochs_for_save
+        self.devices = devices
+        self.verbose = verbose
+        self.epoch = reload_epoch
+        self.cum_update = 0
+        self.pending = deque()
+        self.worker = None
+        self.best_score = -1.
+        self.best_epoch = -1
+        self.wait = 0
+        if metric_check is not None:
+            # Check the already stored scores in case we have loaded a pre-trained model
+            all_scores = self.model_to_eval.getLog(self.check_split, self.metric_check)
+            if all_scores[-1] is not None:
+                all_scores = [-score if self.want_to_minimize else score for score in all_scores]
+                self.best_score = max(all_scores)
+                self.wait = len(all_scores) - 1 - all_scores.index(self.best_score)
+
+    def on_epoch_end(self, epoch, logs=None):
+        """
+        On epoch end, collect the finished evaluations and launch a new one if necessary.
+        :param epoch: Current epoch number
+        :param logs:
+        :return:
+        """
+        epoch += 1  # start by index 1
+        self.epoch = epoch
+        self.check_worker()
+        if not self.eval_on_epochs or epoch < self.start_eval_on_epoch or \
+                (epoch - self.start_eval_on_epoch) % self.each_n_epochs != 0:
+            return
+        self.schedule(epoch, 'epoch')
+
+    def on_batch_end(self, n_update, logs=None):
+        """
+        On (mini)batch end (update), collect the finished evaluations and launch a new one if necessary.
+        :param n_update: Current update number
+        :param logs:
+        :return:
+        """
+        self.cum_update += 1  # start by index 1
+        self.check_worker()
+        if self.eval_on_epochs or self.cum_update % self.each_n_epochs != 0 or self.epoch < self.start_eval_on_epoch:
+            return
+        self.schedule(self.cum_update, 'iteration')
+
+    def on_train_end(self, logs=None):
+        """
+        Waits for the evaluations still running or queued.
+        :param logs:
+        :return:
+        """
+        while self.worker is not None:
+            self.worker[0].wait()
+            self.check_worker()
+
+    def schedule(self, update_num, counter_name):
+        """
+        Stores the current model and queues its evaluation.
+        :param update_num: Current epoch or update
+        :param counter_name: 'epoch' or 'iteration'
+        :return:
+        """
+        from keras_wrapper.cnn_model import saveModel
+        saveModel(self.model_to_eval, update_num, store_iter=counter_name != 'epoch')
+        self.pending.append((update_num, counter_name))
+        self.launch_worker()
+
+    def launch_worker(self):
+        """
+        Launches the evaluation of the next queued model, if no worker is running.
+        :return:
+        """
+        if self.worker is not None or not self.pending:
+            return
+        update_num, counter_name = self.pending.popleft()
+        result_filename = os.path.join(self.model_to_eval.model_path,
+                                       'async_evaluation_' + counter_name + '_' + str(update_num))
+        command = [sys.executable, '-m', 'utils.async_evaluation',
+                   '--config', self.config_filename,
+                   '--dataset', self.dataset_filename,
+                   '--models-path', self.model_to_eval.model_path,
+                   '--update-num', str(update_num),
+                   '--counter-name', counter_name,
+                   '--dest', result_filename + '.json']
+        env = dict(os.environ)
+        # The worker runs in the current directory (the paths of the model may be relative to it)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+                                            ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        if self.devices is not None:
+            env['CUDA_VISIBLE_DEVICES'] = str(self.devices)
+        if self.verbose > 0:
+            logger.info('Evaluating the model of %s %d in the background (log: %s.log)' %
+                        (counter_name, update_num, result_filename))
+        with open(result_filename + '.log', 'w') as log_file:
+            process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+        self.worker = (process, update_num, counter_name, result_filename)
+
+    def check_worker(self):
+        """
+        Collects the results of the running worker, if it finished, and launches the next one.
+        :return:
+        """
+        if self.worker is None or self.worker[0].poll() is None:
+            return
+        process, update_num, counter_name, result_filename = self.worker
+        self.worker = None
+        if process.returncode != 0:
+            # The model is kept, for evaluating it again
+            logger.error('The evaluation of the model of %s %d failed (see %s.log)' %
+                         (counter_name, update_num, result_filename))
+        else:
+            with open(result_filename + '.json', 'r') as f:
+                results = json.load(f)
+            for split in sorted(results):
+                for metric in sorted(results[split]):
+                    self.model_to_eval.log(str(split), str(metric), results[split][metric])
+                    if self.verbose > 0 and metric != counter_name:
+                        logger.info('%s %d: %s %s: %f' % (counter_name, update_num, split, metric,
+                                                          results[split][metric]))
+            self.remove_snapshot(update_num, counter_name)
+            self.check_early_stopping(results, update_num, counter_name)
+        self.launch_worker()
+
+    def remove_snapshot(self, update_num, counter_name):
+        """
+        Removes a model stored for its evaluation, unless it is also a checkpoint of the training.
+        :param update_num: Epoch or update of the model
+        :param counter_name: 'epoch' or 'iteration'
+        :return:
+        """
+        if counter_name == 'epoch' and self.epochs_for_save > 0 and update_num % self.epochs_for_save == 0:
+            return
+        model_name = os.path.join(self.model_to_eval.model_path,
+                                  ('epoch_' if counter_name == 'epoch' else 'update_') + str(update_num))
+        for suffix in [suffix for model_files in MODEL_FILES for suffix in model_files] + MODEL_EXTRA_FILES:
+            if os.path.isfile(model_name + suffix):
+                os.remove(model_name + suffix)
+
+    def check_early_stopping(self, results, update_num, counter_name):
+        """
+        Checks the early stopping conditions with the results of an evaluation.
+        :param results: Dictionary {split: {metric: value}}
+        :param update_num: Epoch or update of the evaluated model
+        :param counter_name: 'epoch' or 'iteration'
+        :return:
+        """
+        if self.metric_check is None:
+            return
+        current_score = results.get(self.check_split, {}).get(self.metric_check)
+        if current_score is None:
+            logger.warning('The chosen metric ' + str(self.metric_check) + ' does not exist; the early stopping '
+                           'works only with a valid metric.')
+            return
+        if self.want_to_minimize:
+            current_score = -current_score
+        if current_score - self.min_delta > self.best_score:
+            self.best_epoch = update_num
+            self.best_score = current_score
+            self.wait = 0
+            if self.verbose > 0:
+                logger.info('---current best %s %s: %.3f' % (self.check_split, self.metric_check,
+                                                             -current_score if self.want_to_minimize
+                                                             else current_score))
+        elif self.patience > 0:
+            self.wait += 1
+            logger.info('---bad counter: %d/%d' % (self.wait, self.patience))
+            if self.wait >= self.patience:
+                logger.info('---%s %d: early stopping. Best %s found at %s %d: %f' %
+                            (counter_name, update_num, self.metric_check, counter_name, self.best_epoch,
+                             -self.best_score if self.want_to_minimize else self.best_score))
+                # The queued evaluations are discarded
+                while self.pending:
+                    self.remove_snapshot(*self.pending.popleft())
+                self.model.stop_training = True
+
+
+def evaluate_snapshot(args):
+    """
+    Evaluates a stored model as the PrintPerformanceMetricOnEpochEndOrEachNUpdates callback of main.buildCallbacks
+    does during the training, and stores the logged metrics.
+    :param args: Command-line arguments (see parse_args)
+    :return: Dictionary {split: {metric: value}}
+    """
+    from keras_wrapper.cnn_model import loadModel
+    from keras_wrapper.dataset import loadDataset
+    from keras_wrapper.extra.read_write import pkl2dict
+    from main import buildCallbacks
+    from model_zoo import CUSTOM_OBJECTS
+
+    params = pkl2dict(args.config)
+    params['ASYNC_EVALUATION'] = False
+    params['SAMPLE_ON_SETS'] = []
+    dataset = loadDataset(args.dataset)
+    model = loadModel(args.models_path, args.update_num, reload_epoch=args.counter_name == 'epoch',
+                      custom_objects=CUSTOM_OBJECTS)
+    callback_metric = buildCallbacks(params, model, dataset)[0]
+    # The plots and stored models are managed by the training process
+    callback_metric.do_plot = False
+    callback_metric.save_each_evaluation = False
+    # The header of the results files was written by a previous evaluation
+    callback_metric.written_header = os.path.isfile(model.model_path + '/' + params['EVAL_ON_SETS'][0] + '.' +
+                                                    params['METRICS'][0])
+
+    results = dict()
+    log = model.log
+
+    def log_result(mode, data_type, value):
+        results.setdefault(mode, dict())[data_type] = float(value)
+        log(mode, data_type, value)
+
+    model.log = log_result
+    callback_metric.evaluate(args.update_num, counter_name=args.counter_name)
+
+    # The results file is written under a temporary name, so it is complete when it exists
+    with open(args.dest + '.tmp', 'w') as f:
+        json.dump(results, f)
+    os.rename(args.dest + '.tmp', args.dest)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Evaluates a stored model (worker of the asynchronous evaluation)")
+    parser.add_argument("-c", "--config", required=True, help="Config pkl of the model")
+    parser.add_argument("-ds", "--dataset", required=True, help="Dataset instance with the evaluation sets")
+    parser.add_argument("-m", "--models-path", required=True, help="Path to the stored models")
+    parser.add_argument("-n", "--update-num", required=True, type=int, help="Epoch or update of the model")
+    parser.add_argument("--counter-name", default='epoch', choices=['epoch', 'iteration'],
+                        help="Whether update-num is an epoch or an update")
+    parser.add_argument("-d", "--dest", required=True, help="Destination file of the results (json)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
+    evaluate_snapshot(parse_args())
@@ -1,10 +1,21 @@
 import argparse
 import logging
-from keras_wrapper.utils import average_models
+import os
+import posixpath
+import shutil
+
+import h5py
+import numpy as np
 
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
+# Weight files of the models stored by keras_wrapper.cnn_model.saveModel: (full model, weights only), for the model
+# and the auxiliary models of the optimized search (model_init, model_next)
+MODEL_FILES = [('.h5', '_weights.h5'), ('_init.h5', '_weights_init.h5'), ('_next.h5', '_weights_next.h5')]
+# Other files stored by saveModel, copied from the first model
+MODEL_EXTRA_FILES = ['_structure.json', '_structure_init.json', '_structure_next.json', '_Model_Wrapper.pkl']
+
 
 def parse_args():
     parser = argparse.ArgumentParser("Averages models")
@@ -17,13 +28,107 @@ def parse_args():
     parser.add_argument("-w", "--weights", nargs="*", help="Weight given to each model in the averaging. You should provide the same number of weights than models."
                                                            "By default, it applies the same weight to each model (1/N).", default=[])
     parser.add_argument("-m", "--models", nargs="+", required=True, help="Path to the models")
+    parser.add_argument("--in-memory", action='store_true', default=False,
+                        help="Load all the models with Keras before averaging them (instead of averaging the weight "
+                             "files layer by layer).")
     return parser.parse_args()
 
 
+def weight_datasets(h5_file):
+    """
+    Names of the weight datasets of a Keras h5 file: a full model (weights in the 'model_weights' group) or only its
+    weights.
+    :param h5_file: Opened h5py File
+    :return: List of absolute dataset names
+    """
+    root = h5_file['model_weights'] if 'model_weights' in h5_file else h5_file
+    names = []
+
+    def add_dataset(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            names.append(posixpath.join(root.name, name))
+
+    root.visititems(add_dataset)
+    return names
+
+
+def average_weight_files(filenames, dest, weights):
+    """
+    Weighted average of the weights of several Keras h5 files of the same model. The destination is a copy of the first
+    file whose weights are overwritten with the average. The weights are averaged one dataset (layer weight) at a time,
+    with a float64 accumulator, so only one dataset of the models is held in memory.
+    :param filenames: h5 files of the models
+    :param dest: Destination h5 file
+    :param weights: Weight of each model
+    """
+    shutil.copyfile(filenames[0], dest)
+    sources = [h5py.File(filename, 'r') for filename in filenames]
+    try:
+        with h5py.File(dest, 'r+') as averaged:
+            names = weight_datasets(averaged)
+            for filename, source in zip(filenames, sources):
+                if sorted(weight_datasets(source)) != sorted(names):
+                    raise AssertionError('The weights of %s and %s are not the same!' % (filenames[0], filename))
+            for name in names:
+                dataset = averaged[name]
+                if dataset.dtype.kind != 'f':
+                    continue
+                total = np.zeros(dataset.shape, dtype='float64')
+                for filename, source, weight in zip(filenames, sources, weights):
+                    if source[name].shape != dataset.shape:
+                        raise AssertionError('The shapes of %s in %s and %s do not match!' %
+                                             (name, filenames[0], filename))
+                    total += np.asarray(source[name], dtype='float64') * weight
+                dataset[...] = total.astype(dataset.dtype)
+    finally:
+        for source in sources:
+            source.close()
+
+
+def average_model_files(models, output_model, weights=None):
+    """
+    Weighted average of models stored by saveModel, reading their weight files layer by layer (see
+    average_weight_files). The memory does not depend on the number of models, and the models are not built.
+    :param models: Paths to the models (as given to loadModel with full_path=True)
+    :param output_model: Path to the averaged model
+    :param weights: Weight of each model. By default, 1/N
+    :return: None
+    """
+    if not isinstance(models, list):
+        raise AssertionError('You must give a list of models to average.')
+    if len(models) == 0:
+        raise AssertionError('You provided an empty list of models to average!')
+    if weights is None or weights == []:
+        weights = [1. / len(models)] * len(models)
+    weights = [float(weight) for weight in weights]
+    if len(weights) != len(models):
+        raise AssertionError('You must give a list of weights of the same size than the list of models.')
+    if os.path.dirname(output_model) and not os.path.isdir(os.path.dirname(output_model)):
+        os.makedirs(os.path.dirname(output_model))
+
+    n_files = 0
+    for model_files in MODEL_FILES:
+        for suffix in model_files:
+            if os.path.isfile(models[0] + suffix):
+                logger.info('Averaging the weights of %s' % (models[0] + suffix))
+                average_weight_files([model + suffix for model in models], output_model + suffix, weights)
+                n_files += 1
+                break
+    if n_files == 0:
+        raise AssertionError('No weights found for the model ' + models[0])
+    for suffix in MODEL_EXTRA_FILES:
+        if os.path.isfile(models[0] + suffix):
+            shutil.copyfile(models[0] + suffix, output_model + suffix)
+
+
 def weighted_average(args):
 
     logging.info("Averaging %d models" % len(args.models))
-    average_models(args.models, args.dest, weights=args.weights)
+    if args.in_memory:
+        from keras_wrapper.utils import average_models
+        average_models(args.models, args.dest, weights=args.weights)
+    else:
+        average_model_files(args.models, args.dest, weights=args.weights)
     logging.info('Averaging finished.')
 
 
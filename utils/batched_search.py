@@ -0,0 +1,605 @@
+# -*- coding: utf-8 -*-
+import logging
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def length_buckets(lengths, batch_size, bucket_width=1):
+    """
+    Groups sentences into batches of similar length.
+    :param lengths: Length of each sentence
+    :param batch_size: Maximum number of sentences per batch
+    :param bucket_width: The lengths of the sentences of a batch differ in less than bucket_width
+    :return: List of batches (lists of sentence indices), sorted by length
+    """
+    batches = []
+    batch = []
+    for idx in np.argsort(lengths, kind='mergesort'):
+        if batch and (len(batch) >= batch_size or lengths[idx] - lengths[batch[0]] >= bucket_width):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BatchedBeamSearchEnsemble:
+    def __init__(self, models, dataset, params_prediction, model_weights=None, n_best=False, init_cache=None,
+                 prefix_cache=None, shortlist=None, verbose=0):
+        """
+        Beam search over several source sentences at once. The beams of all the sentences of a batch are stacked
+        row-wise and fed through the optimized search models (model_init / model_next) of every model of the ensemble
+        in a single predict_on_batch call per time-step.
+
+        The models must implement the optimized search interface (model_init, model_next, ids_outputs_init,
+        ids_inputs_next, ids_outputs_next, matchings_init_to_next and matchings_next_to_next).
+
+        :param models: List of models (TranslationModel instances)
+        :param dataset: Dataset instance
+        :param params_prediction: Search parameters (as built in sample_ensemble.py)
+        :param model_weights: Weight of each model of the ensemble. If None, the ensemble is averaged.
+        :param n_best: Whether to keep the n-best list of each sentence
+        :param init_cache: Cache (e.g. utils.cache.LRUCache) for the outputs of model_init. Since model_init only
+                           receives the source sentence and the <null> symbol, its outputs (annotations, initial
+                           decoder states and first word probabilities) are reused for every search on the same
+                           sentence. It must be cleared if the weights of the models change.
+        :param prefix_cache: Cache for the decoder states reached after forcing the fixed words of a sentence. A
+                             later search on the same sentence, whose fixed words extend a cached prefix, resumes from
+                             the deepest cached state instead of forcing the prefix again from the first word. It
+                             requires init_cache (which provides the static inputs of model_next, e.g. the
+                             annotations) and is not used for models that attend on their outputs or whose states
+                             grow with the hypotheses (Transformer).
+        :param shortlist: utils.shortlist.Shortlist restricting the output vocabulary of each sentence. The softmax
+                          output layer is split from the search models and only computed for the shortlisted words
+                          of the batch (see utils.shortlist.split_output_layer).
+        :param verbose: Verbosity level
+        """
+        self.models = models
+        self.dataset = dataset
+        self.params = params_prediction
+        self.n_best = n_best
+        self.verbose = verbose
+        self.init_cache = init_cache
+        self.prefix_cache = prefix_cache
+        self.shortlist = shortlist
+        self.output_layers = [None] * len(models)
+        if model_weights is None or model_weights == []:
+            model_weights = [1. / len(models)] * len(models)
+        if len(model_weights) != len(models):
+            raise AssertionError('You should give a weight to each model. You gave %d model weights but have %d '
+                                 'models.' % (len(model_weights), len(models)))
+        self.model_weights = np.asarray(model_weights, dtype='float32')
+        self.return_alphas = self.params.get('pos_unk', False) or self.params.get('coverage_penalty', False)
+        if self.return_alphas and not all(getattr(model, 'return_alphas', False) for model in models):
+            raise NotImplementedError('POS_UNK and COVERAGE_PENALTY require models that return their attention '
+                                      'weights.')
+        # Models whose states grow with the hypotheses (e.g. the cached decoder states of the Transformer) cannot mix
+        # in a batch hypotheses resumed from a cached prefix with the rest
+        self.growing_states = any(getattr(model, 'growing_states', False) for model in models)
+        if not self.params.get('optimized_search', True):
+            raise NotImplementedError('Batched beam search requires OPTIMIZED_SEARCH models.')
+        if not self.params.get('pad_on_batch', True):
+            raise NotImplementedError('Batched beam search requires PAD_ON_BATCH.')
+        # Inputs of model_next that it outputs unchanged (e.g. the annotations), vs. the ones it updates (states)
+        self.static_inputs = [[next_in for next_out, next_in in model.matchings_next_to_next.iteritems()
+                               if next_out == next_in] for model in self.models]
+        self.dynamic_inputs = [[next_in for next_out, next_in in model.matchings_next_to_next.iteritems()
+                                if next_out != next_in] for model in self.models]
+
+    def predict_cond_optimized(self, X, states_below, ii, prev_outs, use_cache=True, shortlist=None):
+        """
+        Calls the optimized search models of the ensemble and combines their outputs.
+        :param X: Padded model inputs (only used at the first time-step)
+        :param states_below: Batch of partial hypotheses, one row per live hypothesis
+        :param ii: Decoding time-step
+        :param prev_outs: Inputs of model_next for each model ({input_id: array}), as returned by the previous
+                          time-step and already aligned with states_below
+        :param use_cache: Whether to use init_cache (if any) at the first time-step
+        :param shortlist: None or (vocabulary, allowed) tuple, as returned by Shortlist.select, but with a row of
+                          'allowed' for each row of states_below. The probabilities of the words out of the
+                          shortlist of each row are 0.
+        :return: Combined probabilities, list of inputs of model_next for the next time-step of each model and
+                 combined attention weights
+        """
+        if ii == 0 and use_cache and self.init_cache is not None:
+            return self._predict_init_cached(X, states_below, shortlist=shortlist)
+        n_samples = states_below.shape[0]
+        attend_on_output = self.params.get('attend_on_output', False)
+        pick_idx = ii if attend_on_output else 0
+        probs = None
+        alphas = None
+        next_outs = []
+        for n_model, model in enumerate(self.models):
+            in_data = {}
+            output_layer = self._output_layer(n_model) if shortlist is not None else None
+            if ii == 0:
+                sampling_model = model.model_init if output_layer is None else output_layer.model_init
+                output_ids, matchings = model.ids_outputs_init, model.matchings_init_to_next
+                state_below_id = self.params['model_inputs'][self.params.get('state_below_index', -1)]
+                for model_input in self.params['model_inputs']:
+                    if model_input != state_below_id:
+                        in_data[model_input] = X[model_input]
+                in_data[state_below_id] = states_below
+            else:
+                sampling_model = model.model_next if output_layer is None else output_layer.model_next
+                output_ids, matchings = model.ids_outputs_next, model.matchings_next_to_next
+                in_data[model.ids_inputs_next[0]] = states_below if attend_on_output else states_below[:, -1:]
+                in_data.update(prev_outs[n_model])
+            out_data = self._predict_on_batch(sampling_model, in_data, n_samples)
+            if getattr(model, 'return_alphas', False) and len(out_data) > len(output_ids):
+                if self.return_alphas:
+                    model_alphas = self.model_weights[n_model] * out_data[-1][0]
+                    alphas = model_alphas if alphas is None else alphas + model_alphas
+                out_data = out_data[:-1]
+            if output_layer is None:
+                model_probs = self.model_weights[n_model] * out_data[0][:, pick_idx, :]
+            else:
+                model_probs = self.model_weights[n_model] * output_layer.probs(out_data[0][:, pick_idx, :],
+                                                                               *shortlist)
+            probs = model_probs if probs is None else probs + model_probs
+            # The first output must be the output probs.
+            next_outs.append(dict((matchings[out_name], out_data[idx]) for idx, out_name in enumerate(output_ids)
+                                  if idx > 0 and out_name in matchings))
+        if self.return_alphas and alphas is None:
+            # e.g. the Transformer, whose search models do not output the attention weights
+            raise NotImplementedError('POS_UNK and COVERAGE_PENALTY require models that return their attention '
+                                      'weights.')
+        if shortlist is not None:
+            shortlist_probs = probs
+            probs = np.zeros((n_samples, self._output_layer(0).kernel.shape[1]), dtype=shortlist_probs.dtype)
+            probs[:, shortlist[0]] = shortlist_probs
+        return probs, next_outs, alphas
+
+    def _output_layer(self, n_model):
+        """
+        Search models of the n_model-th model without their output layer, built on first use.
+        """
+        if self.output_layers[n_model] is None:
+            from utils.shortlist import split_output_layer
+            self.output_layers[n_model] = split_output_layer(self.models[n_model])
+        return self.output_layers[n_model]
+
+    def _source_key(self, src_row):
+        return src_row.shape, src_row.dtype.str, src_row.tostring()
+
+    def _predict_init_cached(self, X, states_below, shortlist=None):
+        """
+        First time-step of predict_cond_optimized, only running model_init for the sentences missing from init_cache.
+        """
+        keys = [self._source_key(row) for row in X[self.params['model_inputs'][0]]]
+        entries = [self.init_cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            X_missing = dict((input_id, value[missing]) for input_id, value in X.iteritems())
+            missing_shortlist = (shortlist[0], shortlist[1][missing]) if shortlist is not None else None
+            probs, next_outs, alphas = self.predict_cond_optimized(X_missing, states_below[missing], 0, None,
+                                                                   use_cache=False, shortlist=missing_shortlist)
+            for j, i in enumerate(missing):
+                # Copies, so the cache does not keep alive the outputs of the whole batch
+                entries[i] = (probs[j].copy(),
+                              [dict((name, value[j].copy()) for name, value in model_outs.iteritems())
+                               for model_outs in next_outs],
+                              alphas[j].copy() if alphas is not None else None)
+                self.init_cache.put(keys[i], entries[i])
+        logger.log(2, 'model_init cache: %d/%d sentences found' % (len(keys) - len(missing), len(keys)))
+        return self._stack_entries(entries)
+
+    def _stack_entries(self, entries):
+        """
+        Stacks per-sentence (probs, inputs of model_next of each model, alphas) entries into a batch.
+        """
+        probs = np.asarray([entry[0] for entry in entries])
+        next_outs = [dict((name, np.asarray([entry[1][n_model][name] for entry in entries]))
+                          for name in entries[0][1][n_model])
+                     for n_model in range(len(self.models))]
+        alphas = np.asarray([entry[2] for entry in entries]) if self.return_alphas else None
+        return probs, next_outs, alphas
+
+    def _resume_point(self, src_row, fixed, n_prefix):
+        """
+        Looks for the deepest decoder state cached for a prefix of the n_prefix first fixed words of a sentence.
+        :return: None or a (prefix, score, alphas, inputs of model_next of each model) tuple
+        """
+        src_key = self._source_key(src_row)
+        init_entry = self.init_cache.get(src_key)
+        if init_entry is None:
+            return None
+        prefix = tuple(int(fixed[pos]) for pos in range(n_prefix))
+        for prefix_len in range(n_prefix, 0, -1):
+            entry = self.prefix_cache.get((src_key, prefix[:prefix_len]))
+            if entry is not None:
+                score, alphas, dynamic_inputs = entry
+                inputs = []
+                for n_model in range(len(self.models)):
+                    model_inputs = dict(dynamic_inputs[n_model])
+                    for name in self.static_inputs[n_model]:
+                        model_inputs[name] = init_entry[1][n_model][name]
+                    inputs.append(model_inputs)
+                return list(prefix[:prefix_len]), score, alphas, inputs
+        return None
+
+    def _predict_on_batch(self, sampling_model, in_data, n_samples):
+        """
+        Runs sampling_model on in_data. The rows of a time-step (up to 'search_batch_size' x 'beam_size'
+        hypotheses) are fed in a single call, unless they are more than 'beam_batch_size' (if given and positive):
+        then they are split in chunks of 'beam_batch_size' rows.
+        :return: List of outputs of the model
+        """
+        beam_batch_size = self.params.get('beam_batch_size', 0)
+        if beam_batch_size <= 0 or beam_batch_size >= n_samples:
+            out_data = sampling_model.predict_on_batch(in_data)
+            return list(out_data) if isinstance(out_data, list) else [out_data]
+        chunks = []
+        for start in range(0, n_samples, beam_batch_size):
+            chunk_data = dict((k, v[start:start + beam_batch_size]) for k, v in in_data.iteritems())
+            out_data = sampling_model.predict_on_batch(chunk_data)
+            chunks.append(list(out_data) if isinstance(out_data, list) else [out_data])
+        return [np.concatenate([chunk[i] for chunk in chunks], axis=0) for i in range(len(chunks[0]))]
+
+    def _source_lengths(self, X):
+        """
+        Length of each source sentence, as it would be padded by Dataset.loadText if it were loaded alone
+        (words + <eos>, truncated to the batch width).
+        """
+        src = X[self.params['model_inputs'][0]]
+        return np.minimum((src > 0).sum(axis=1) + 1, src.shape[1])
+
+    def sample_beam_search_batch(self, X, fixed_words=None, valid_next_words=None, eos_sym=0, null_sym=None):
+        """
+        Beam search on a batch of source sentences. It follows the same algorithm as keras_wrapper.search.beam_search,
+        but all the beams are decoded together. A sentence leaves the batch once its beam is exhausted or it reaches
+        its maximum length.
+
+        Hypotheses can be constrained as in the interactive sampler: fixed_words[i] maps positions to the word
+        indices that the i-th hypothesis must contain at them and valid_next_words[i] restricts the word following
+        the last fixed position.
+
+        :param X: Dictionary of padded model inputs, with one row per sentence
+        :param fixed_words: List (one per sentence) of dictionaries {position: word_index}, or None
+        :param valid_next_words: List (one per sentence) of iterables of word indices, or None
+        :param eos_sym: <eos> symbol
+        :param null_sym: <null> symbol. By default, taken from the dataset
+        :return: List with an UNSORTED [samples, scores, alphas] entry for each sentence
+        """
+        params = self.params
+        k = params['beam_size']
+        attend_on_output = params.get('attend_on_output', False)
+        null_sym = self.dataset.extra_words['<null>'] if null_sym is None else null_sym
+        src = X[params['model_inputs'][0]]
+        src_lengths = self._source_lengths(X)
+        n_sentences = len(src_lengths)
+        fixed_words = fixed_words or [None] * n_sentences
+        valid_next_words = valid_next_words or [None] * n_sentences
+
+        if params.get('output_max_length_depending_on_x', False):
+            maxlens = [int(l * params['output_max_length_depending_on_x_factor']) for l in src_lengths]
+        else:
+            maxlens = [params['maxlen']] * n_sentences
+        if params.get('output_min_length_depending_on_x', False):
+            minlens = [int(l / params['output_min_length_depending_on_x_factor'] + 1e-7) for l in src_lengths]
+        else:
+            minlens = [0] * n_sentences
+        maxlens = [max(maxlen, 1) for maxlen in maxlens]
+
+        constraints = []
+        for i in range(n_sentences):
+            fixed = dict(fixed_words[i]) if fixed_words[i] else dict()
+            valid = np.asarray(sorted(valid_next_words[i]), dtype='int64') if valid_next_words[i] else None
+            last_fixed = max(fixed.keys()) if fixed else -1
+            # Number of words fixed from the first position on: their states can be cached and resumed
+            n_prefix = 0
+            while n_prefix in fixed:
+                n_prefix += 1
+            constraints.append((fixed, valid, last_fixed, n_prefix))
+            maxlens[i] = max(maxlens[i], last_fixed + 2)
+
+        shortlist = None
+        if self.shortlist is not None:
+            # The fixed and valid words of each sentence are always allowed
+            shortlist = self.shortlist.select(src, extra_words=[
+                list(constraint[0].itervalues()) + (list(constraint[1]) if constraint[1] is not None else [])
+                for constraint in constraints])
+
+        use_prefix_cache = self.prefix_cache is not None and self.init_cache is not None and not attend_on_output \
+            and not self.growing_states
+        resumed = dict()
+        if use_prefix_cache:
+            for i in range(n_sentences):
+                if constraints[i][3] > 0:
+                    resume_point = self._resume_point(src[i], constraints[i][0], constraints[i][3])
+                    if resume_point is not None:
+                        resumed[i] = resume_point
+            if resumed:
+                logger.log(2, 'prefix cache: resuming %d/%d sentences (%d words skipped)' %
+                           (len(resumed), n_sentences, sum(len(point[0]) for point in resumed.itervalues())))
+
+        samples = [[] for _ in range(n_sentences)]
+        sample_scores = [[] for _ in range(n_sentences)]
+        sample_alphas = [[] for _ in range(n_sentences)]
+        dead_k = [0] * n_sentences
+        # Position of the first word predicted for each sentence (> 0 for sentences resumed from a cached prefix)
+        offsets = [0] * n_sentences
+        # Live hypotheses of each active sentence. Their rows in the batch are stored contiguously, in the same
+        # order as 'active'.
+        fresh = [i for i in range(n_sentences) if i not in resumed]
+        active = fresh + sorted(resumed)
+        hyp_samples = dict((i, [[]]) for i in fresh)
+        hyp_scores = dict((i, np.zeros(1, dtype='float32')) for i in fresh)
+        hyp_alphas = dict((i, [[]]) for i in fresh)
+        for i, (prefix, score, alphas, _) in resumed.iteritems():
+            offsets[i] = len(prefix)
+            hyp_samples[i] = [prefix]
+            hyp_scores[i] = np.asarray([score], dtype='float32')
+            hyp_alphas[i] = [list(alphas) if self.return_alphas else []]
+
+        for ii in range(max(maxlen - offset for maxlen, offset in zip(maxlens, offsets))):
+            if ii == 0:
+                probs, prev_outs, alphas = self._first_step(X, fresh, resumed, null_sym, shortlist=shortlist)
+            else:
+                rows_shortlist = None
+                if shortlist is not None:
+                    rows_shortlist = (shortlist[0], shortlist[1][[i for i in active for _ in hyp_samples[i]]])
+                probs, prev_outs, alphas = self.predict_cond_optimized(None, state_below, ii, prev_outs,
+                                                                       shortlist=rows_shortlist)
+            with np.errstate(divide='ignore'):
+                # Words out of the shortlist have probability 0
+                log_probs = np.log(probs)
+            voc_size = log_probs.shape[1]
+            still_active = []
+            parent_rows = []
+            start = 0
+            for i in active:
+                pos = ii + offsets[i]
+                n_rows = len(hyp_samples[i])
+                rows_log_probs = log_probs[start:start + n_rows]
+                fixed, valid, last_fixed, n_prefix = constraints[i]
+                if pos in fixed:
+                    forced = np.full_like(rows_log_probs, -np.inf)
+                    forced[:, fixed[pos]] = rows_log_probs[:, fixed[pos]]
+                    rows_log_probs = forced
+                elif pos == last_fixed + 1 and valid is not None:
+                    allowed = np.full_like(rows_log_probs, -np.inf)
+                    allowed[:, valid] = rows_log_probs[:, valid]
+                    rows_log_probs = allowed
+                if pos < minlens[i] or pos <= last_fixed:
+                    rows_log_probs[:, eos_sym] = -np.inf
+
+                cand_flat = (hyp_scores[i][:, None] - rows_log_probs).flatten()
+                n_keep = min(k - dead_k[i], cand_flat.size)
+                if n_keep < cand_flat.size:
+                    ranks_flat = np.argpartition(cand_flat, n_keep - 1)[:n_keep]
+                    ranks_flat = ranks_flat[np.argsort(cand_flat[ranks_flat])]
+                else:
+                    ranks_flat = np.argsort(cand_flat)
+                ranks_flat = ranks_flat[np.isfinite(cand_flat[ranks_flat])]
+                costs = cand_flat[ranks_flat]
+                trans_indices = ranks_flat // voc_size
+                word_indices = ranks_flat % voc_size
+
+                new_samples = []
+                new_scores = []
+                new_alphas = []
+                for idx, (ti, wi) in enumerate(zip(trans_indices, word_indices)):
+                    if params.get('search_pruning', False) and costs[idx] >= k * costs[0]:
+                        dead_k[i] += 1
+                        continue
+                    sample = hyp_samples[i][ti] + [wi]
+                    sample_alpha = hyp_alphas[i][ti] + [alphas[start + ti]] if self.return_alphas else None
+                    if wi == eos_sym:
+                        samples[i].append(sample)
+                        sample_scores[i].append(costs[idx])
+                        sample_alphas[i].append(sample_alpha)
+                        dead_k[i] += 1
+                    else:
+                        new_samples.append(sample)
+                        new_scores.append(costs[idx])
+                        new_alphas.append(sample_alpha)
+                        parent_rows.append(start + ti)
+                        if use_prefix_cache and pos < n_prefix:
+                            # Forced word: this is the only live hypothesis
+                            self._cache_prefix(src[i], sample, costs[idx], sample_alpha, prev_outs, start + ti)
+                start += n_rows
+
+                if len(new_samples) == 0 or dead_k[i] >= k or pos + 1 >= maxlens[i]:
+                    # Dump every remaining hypothesis and drop them from the batch
+                    samples[i].extend(new_samples)
+                    sample_scores[i].extend(new_scores)
+                    sample_alphas[i].extend(new_alphas)
+                    if new_samples:
+                        del parent_rows[-len(new_samples):]
+                    del hyp_samples[i], hyp_scores[i], hyp_alphas[i]
+                else:
+                    hyp_samples[i] = new_samples
+                    hyp_scores[i] = np.asarray(new_scores, dtype='float32')
+                    hyp_alphas[i] = new_alphas
+                    still_active.append(i)
+
+            active = still_active
+            if not active:
+                break
+            if attend_on_output:
+                state_below = np.asarray([sample for i in active for sample in hyp_samples[i]], dtype='int64')
+                state_below = np.hstack((np.zeros((state_below.shape[0], 1), dtype='int64') + null_sym,
+                                         state_below))
+            else:
+                # Only the last word is fed to model_next. Hypotheses may have different lengths.
+                state_below = np.asarray([[sample[-1]] for i in active for sample in hyp_samples[i]], dtype='int64')
+            parent_rows = np.asarray(parent_rows, dtype='int64')
+            prev_outs = [dict((name, value[parent_rows]) for name, value in model_outs.iteritems())
+                         for model_outs in prev_outs]
+
+        return [[samples[i], sample_scores[i], sample_alphas[i] if self.return_alphas else None]
+                for i in range(n_sentences)]
+
+    def _first_step(self, X, fresh, resumed, null_sym, shortlist=None):
+        """
+        First time-step of the search: model_init for the fresh sentences and model_next from the cached states for
+        the resumed ones (in this order).
+        """
+        def sentences_shortlist(sentences):
+            return (shortlist[0], shortlist[1][sentences]) if shortlist is not None else None
+
+        steps = []
+        if fresh:
+            X_fresh = X if len(fresh) == len(X[self.params['model_inputs'][0]]) else \
+                dict((input_id, value[fresh]) for input_id, value in X.iteritems())
+            state_below = np.zeros((len(fresh), 1), dtype='int64') + null_sym
+            steps.append(self.predict_cond_optimized(X_fresh, state_below, 0, None,
+                                                     shortlist=sentences_shortlist(fresh)))
+        if resumed:
+            resumed_ids = sorted(resumed)
+            state_below = np.asarray([[resumed[i][0][-1]] for i in resumed_ids], dtype='int64')
+            prev_outs = [dict((name, np.asarray([resumed[i][3][n_model][name] for i in resumed_ids]))
+                              for name in resumed[resumed_ids[0]][3][n_model])
+                         for n_model in range(len(self.models))]
+            steps.append(self.predict_cond_optimized(None, state_below, 1, prev_outs,
+                                                     shortlist=sentences_shortlist(resumed_ids)))
+        if len(steps) == 1:
+            return steps[0]
+        probs = np.concatenate([step[0] for step in steps])
+        next_outs = [dict((name, np.concatenate([step[1][n_model][name] for step in steps]))
+                          for name in steps[0][1][n_model])
+                     for n_model in range(len(self.models))]
+        alphas = np.concatenate([step[2] for step in steps]) if self.return_alphas else None
+        return probs, next_outs, alphas
+
+    def _cache_prefix(self, src_row, prefix, score, alphas, next_outs, row):
+        """
+        Stores the decoder state reached after a forced prefix (only the inputs of model_next that it updates).
+        """
+        dynamic_inputs = [dict((name, next_outs[n_model][name][row].copy()) for name in self.dynamic_inputs[n_model])
+                          for n_model in range(len(self.models))]
+        self.prefix_cache.put((self._source_key(src_row), tuple(int(word) for word in prefix)),
+                              (float(score), alphas, dynamic_inputs))
+
+    def rescore(self, samples, scores, alphas, src_length):
+        """
+        Applies the length/coverage penalties or the length normalization to the scores of a sentence, as
+        BeamSearchEnsemble.predictBeamSearchNet does.
+        :param samples: Hypotheses of the sentence
+        :param scores: Their (-log) probabilities
+        :param alphas: Their attention weights (only needed for the coverage penalty)
+        :param src_length: Length of the source sentence
+        :return: List of rescored scores
+        """
+        params = self.params
+        if params.get('length_penalty', False) or params.get('coverage_penalty', False):
+            if params.get('length_penalty', False):
+                # this 5 is a magic number by Google...
+                length_penalties = [(5 + len(sample)) ** params['length_norm_factor'] /
+                                    (5 + 1) ** params['length_norm_factor'] for sample in samples]
+            else:
+                length_penalties = [1.0 for _ in samples]
+            if params.get('coverage_penalty', False):
+                coverage_penalties = []
+                for sample_alphas in alphas:
+                    att_weights = np.asarray(sample_alphas)[:, :src_length].sum(axis=0)
+                    coverage_penalties.append(params['coverage_norm_factor'] *
+                                              np.sum(np.log(np.minimum(att_weights, 1.0))))
+            else:
+                coverage_penalties = [0.0 for _ in samples]
+            scores = [co / lp + cov_p for co, lp, cov_p in zip(scores, length_penalties, coverage_penalties)]
+        elif params.get('normalize_probs', False):
+            scores = [co / len(sample) ** params['alpha_factor'] for co, sample in zip(scores, samples)]
+        return list(scores)
+
+    def translate_batch(self, X, fixed_words=None, valid_next_words=None):
+        """
+        Translates a batch of sentences.
+        :param X: Dictionary of padded model inputs, with one row per sentence
+        :param fixed_words: See sample_beam_search_batch
+        :param valid_next_words: See sample_beam_search_batch
+        :return: List of best hypotheses, list of their attention weights (None if not computed) and the n-best list
+                 of each sentence ([samples, scores, alphas], sorted by score), if n_best is set
+        """
+        src_lengths = self._source_lengths(X)
+        best_samples = []
+        best_alphas = []
+        n_best_list = []
+        for src_length, (samples, scores, alphas) in zip(src_lengths,
+                                                         self.sample_beam_search_batch(X,
+                                                                                       fixed_words=fixed_words,
+                                                                                       valid_next_words=valid_next_words)):
+            scores = self.rescore(samples, scores, alphas, src_length)
+            best = int(np.argmin(scores))
+            best_samples.append(samples[best])
+            best_alphas.append(np.asarray(alphas[best]) if alphas is not None else None)
+            if self.n_best:
+                n_best_indices = np.argsort(scores)
+                n_best_list.append([[samples[j] for j in n_best_indices],
+                                    np.asarray(scores)[n_best_indices],
+                                    [np.stack(alphas[j]) if alphas is not None else None for j in n_best_indices]])
+        return best_samples, best_alphas, n_best_list
+
+    def predictBeamSearchNet(self):
+        """
+        Approximates by beam search the best predictions of the ensemble on the 'predict_on_sets' splits of the
+        dataset, returning them in the same format as BeamSearchEnsemble.predictBeamSearchNet.
+
+        Sentences are sorted by length and decoded in batches of up to 'search_batch_size' sentences whose lengths
+        differ in less than 'search_bucket_width' words. With a width of 1, all the sentences of a batch have the same
+        length and the hypotheses are the ones of a sentence-by-sentence search. Wider buckets fill the batches
+        better, but the padding of the shorter sentences slightly changes their hypotheses (model_next does not mask
+        the annotations).
+        :return: Dictionary with set splits as keys and predictions as values
+        """
+        params = self.params
+        batch_size = params.get('search_batch_size', 50)
+        bucket_width = params.get('search_bucket_width', 1)
+        source_id = params['dataset_inputs'][0]
+        source_position = self.dataset.ids_inputs.index(source_id)
+        predictions = dict()
+        for s in params['predict_on_sets']:
+            logger.info("\n <<< Predicting outputs of " + s + " set >>>")
+            lengths = [len(sentence.split()) for sentence in getattr(self.dataset, 'X_' + s)[source_id]]
+            n_samples = len(lengths)
+            best_samples = [None] * n_samples
+            best_alphas = [None] * n_samples
+            sources = [None] * n_samples
+            n_best_list = [None] * n_samples
+            total_cost = 0.
+            sampled = 0
+            start_time = time.time()
+            for batch in length_buckets(lengths, batch_size, bucket_width):
+                x = self.dataset.getX_FromIndices(s, batch)[source_position]
+                X = {params['model_inputs'][0]: np.asarray(x)}
+                src_lengths = self._source_lengths(X)
+                searched = self.sample_beam_search_batch(X, null_sym=self.dataset.extra_words['<null>'])
+                for j, idx in enumerate(batch):
+                    samples, scores, alphas = searched[j]
+                    scores = self.rescore(samples, scores, alphas, src_lengths[j])
+                    best = int(np.argmin(scores))
+                    best_samples[idx] = samples[best]
+                    total_cost += scores[best]
+                    if params.get('pos_unk', False):
+                        best_alphas[idx] = np.asarray(alphas[best])
+                        # Sources as they would have been loaded alone
+                        source = X[params['model_inputs'][0]][j:j + 1, :src_lengths[j]]
+                        sources[idx] = {params['model_inputs'][0]: source}
+                    if self.n_best:
+                        n_best_indices = np.argsort(scores)
+                        n_best_list[idx] = [np.asarray(samples)[n_best_indices],
+                                            np.asarray(scores)[n_best_indices],
+                                            [np.stack(alphas[n]) if alphas is not None else None
+                                             for n in n_best_indices]]
+                sampled += len(batch)
+                eta = (n_samples - sampled) * (time.time() - start_time) / sampled
+                sys.stdout.write("Sampling %d/%d  -  ETA: %ds \r" % (sampled, n_samples, int(eta)))
+                sys.stdout.flush()
+
+            sys.stdout.write('Total cost of the translations: %f \t '
+                             'Average cost of the translations: %f\n' % (total_cost, total_cost / max(n_samples, 1)))
+            sys.stdout.write('The sampling took: %f secs (Speed: %f sec/sample)\n' %
+                             ((time.time() - start_time), (time.time() - start_time) / max(n_samples, 1)))
+            sys.stdout.flush()
+            if params.get('pos_unk', False):
+                split_predictions = (np.asarray(best_samples), np.asarray(best_alphas), sources)
+            else:
+                split_predictions = np.asarray(best_samples)
+            predictions[s] = (split_predictions, n_best_list) if self.n_best else split_predictions
+        return predictions
@@ -167,9 +167,11 @@ if [ ${verbose} -gt 0 ]; then
 fi
 
 python ${utilsdir}/ttables_to_dict.py --fname ${dest_dir}/${source_lan}_${target_lan}.ttables \
-                                      --dest  ${dest_file}  --verbose ${verbose}
+                                      --dest  ${dest_file}  --verbose ${verbose} \
+                                      --candidates-dest ${dest_dir}/candidates.${source_lan}_${target_lan}.pkl
 
 echo "Finished! Alignments stored in: ${dest_file}"
+echo "Translation candidates (for SHORTLIST) stored in: ${dest_dir}/candidates.${source_lan}_${target_lan}.pkl"
 
 if [ "${debug}" != "-debug" ]; then
     if [ ${verbose} -gt 0 ]; then
@@ -0,0 +1,88 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+def default_sizeof(key, value):
+    """
+    Rough size (in bytes) of a cache entry: numpy arrays count their buffers and containers are measured recursively.
+    """
+    return _sizeof(key) + _sizeof(value)
+
+
+def _sizeof(obj):
+    if hasattr(obj, 'nbytes'):
+        return obj.nbytes
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(_sizeof(item) for item in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_sizeof(k) + _sizeof(v) for k, v in obj.iteritems())
+    return sys.getsizeof(obj)
+
+
+class LRUCache:
+    def __init__(self, max_items=1000, max_bytes=None, sizeof=default_sizeof):
+        """
+        Thread-safe least-recently-used cache, bounded both in number of entries and in (estimated) memory.
+        :param max_items: Maximum number of entries. If 0, nothing is stored.
+        :param max_bytes: Maximum memory (in bytes) of the stored entries, as estimated by sizeof. None means no limit.
+        :param sizeof: Function (key, value) -> estimated size in bytes of an entry
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for key (marking it as the most recently used) or default.
+        """
+        with self.lock:
+            try:
+                value, size = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the least recently used entries until the limits are satisfied.
+        Entries larger than max_bytes are not stored.
+        """
+        if self.max_items <= 0:
+            return
+        size = self.sizeof(key, value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.n_bytes += size
+            while len(self.entries) > self.max_items or \
+                    (self.max_bytes is not None and self.n_bytes > self.max_bytes):
+                self.n_bytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __str__(self):
+        requests = self.hits + self.misses
+        return 'LRUCache: %d entries (%d bytes), %d hits, %d misses (hit rate: %.2f%%)' % \
+               (len(self.entries), self.n_bytes, self.hits, self.misses,
+                100. * self.hits / requests if requests > 0 else 0.)
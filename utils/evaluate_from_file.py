@@ -1,5 +1,10 @@
 import argparse
 import codecs
+from itertools import izip
+from multiprocessing import Pool
+
+import numpy as np
+from mt_metrics import bleu_from_statistics, bleu_statistics, fast_scores
 from pycocoevalcap.bleu.bleu import Bleu
 from pycocoevalcap.cider.cider import Cider
 from pycocoevalcap.meteor.meteor import Meteor
@@ -8,14 +13,49 @@ from pycocoevalcap.ter.ter import Ter
 
 parser = argparse.ArgumentParser(
     description="""Computes BLEU, TER, METEOR, ROUGE-L and CIDEr from a htypotheses file with respect to one
-    or more reference files.""", formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('-t', '--hypotheses', type=str, help='Hypotheses file')
+    or more reference files. The 'fast' metric computes BLEU, chrF and TER in-process (see utils/mt_metrics.py).
+    If several hypotheses files (systems) are given, the references are read once and a table with the scores of each
+    system is printed.""", formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('-t', '--hypotheses', type=str, nargs='+', help='Hypotheses file(s)')
 parser.add_argument('-m', '--metrics', default=['bleu', 'ter', 'meteor', 'rouge_l', 'cider'], nargs='*',
-                    help='Metrics to evaluate on')
+                    help='Metrics to evaluate on (bleu, ter, meteor, rouge_l, cider or fast)')
 parser.add_argument('-l', '--language', type=str, default='en', help='Meteor language')
 parser.add_argument('-s', '--step-size', type=int, default=0, help='Step size. 0 == Evaluate all sentences')
 parser.add_argument('-r', '--references', type=argparse.FileType('r'), nargs="+",
                     help='Path to all the reference files (single-reference files)')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of processes. The metrics are computed in parallel and the decomposable metrics '
+                         '(BLEU and ROUGE-L) are also split into shards of sentences')
+
+# Metrics whose scores can be computed from the statistics of shards of the sentences
+DECOMPOSABLE_METRICS = ['bleu', 'rouge_l']
+
+
+def load_references(references):
+    """
+    Reads the reference files line by line.
+
+    :param references: Reference files (single-reference files, with the same number of lines)
+    :return: Dictionary of reference sentences (id, [sentences])
+    """
+    return {idx: [line.strip() for line in lines] for (idx, lines) in enumerate(izip(*references))}
+
+
+def load_hypotheses(hypotheses, n_sentences):
+    """
+    Reads a hypotheses file line by line.
+
+    :param hypotheses: Hypotheses file
+    :param n_sentences: Number of reference sentences
+    :return: Dictionary of hypothesis sentences (id, [sentence])
+    """
+    hypo = {idx: [line.strip()] for (idx, line) in enumerate(hypotheses)}
+    # sanity check that we have the same number of references as hypothesis
+    if len(hypo) != n_sentences:
+        raise ValueError("There is a sentence number mismatch between the inputs: \n"
+                         "\t # sentences in references: %d\n"
+                         "\t # sentences in hypotheses: %d" % (n_sentences, len(hypo)))
+    return hypo
 
 
 def load_textfiles(references, hypotheses):
@@ -27,32 +67,30 @@ def load_textfiles(references, hypotheses):
     :return:
     """
     print "The number of references is {}".format(len(references))
-    hypo = {idx: [lines.strip()] for (idx, lines) in enumerate(hypotheses)}
-    # take out newlines before creating dictionary
-    raw_refs = [map(str.strip, r) for r in zip(*references)]
-    refs = {idx: rr for idx, rr in enumerate(raw_refs)}
-    # sanity check that we have the same number of references as hypothesis
-    if len(hypo) != len(refs):
-        raise ValueError("There is a sentence number mismatch between the inputs: \n"
-                         "\t # sentences in references: %d\n"
-                         "\t # sentences in hypotheses: %d" % (len(refs), len(hypo)))
+    refs = load_references(references)
+    hypo = load_hypotheses(hypotheses, len(refs))
     return refs, hypo
 
 
-def CocoScore(ref, hyp, metrics_list=None, language='en'):
+def CocoScore(ref, hyp, metrics_list=None, language='en', jobs=1, pool=None):
     """
     Obtains the COCO scores from the references and hypotheses.
 
     :param ref: Dictionary of reference sentences (id, sentence)
     :param hyp: Dictionary of hypothesis sentences (id, sentence)
-    :param metrics_list: List of metrics to evaluate on
+    :param metrics_list: List of metrics to evaluate on. 'fast' computes BLEU, chrF and TER with utils.mt_metrics; the
+                         scores of the other metrics, if also selected, replace them.
     :param language: Language of the sentences (for METEOR)
+    :param jobs: Number of processes. If greater than 1, the scores are computed by ParallelCocoScore
+    :param pool: Pool of jobs processes for ParallelCocoScore (if None, it is created for this call)
     :return: dictionary of scores
     """
     if metrics_list is None:
         metrics_list = ['bleu', 'ter', 'meteor', 'rouge_l', 'cider']
     else:
         metrics_list = [metric.lower() for metric in metrics_list]
+    if jobs > 1:
+        return ParallelCocoScore(ref, hyp, metrics_list=metrics_list, language=language, jobs=jobs, pool=pool)
     scorers = []
     if 'bleu' in metrics_list:
         scorers.append((Bleu(4), ["Bleu_1", "Bleu_2", "Bleu_3", "Bleu_4"]))
@@ -66,6 +104,8 @@ def CocoScore(ref, hyp, metrics_list=None, language='en'):
         scorers.append((Cider(), "CIDEr"))
 
     final_scores = {}
+    if 'fast' in metrics_list:
+        final_scores.update(fast_scores([hyp[idx][0] for idx in sorted(hyp)], [ref[idx] for idx in sorted(hyp)]))
     for scorer, method in scorers:
         score, _ = scorer.compute_score(ref, hyp)
         if isinstance(score, list):
@@ -76,36 +116,150 @@ def CocoScore(ref, hyp, metrics_list=None, language='en'):
     return final_scores
 
 
+def score_shard(task):
+    """
+    Computes a metric (or its statistics) on a set of sentences. Run by the processes of ParallelCocoScore.
+
+    :param task: Tuple (metric, ref, hyp, language), with the references and hypotheses as in CocoScore
+    :return: The BLEU statistics (see mt_metrics.bleu_statistics) for 'bleu', the sentence scores for 'rouge_l' and
+             the dictionary of scores (see CocoScore) for the other metrics
+    """
+    metric, ref, hyp, language = task
+    if metric == 'bleu':
+        # The statistics of the Bleu scorer of pycocoevalcap
+        return bleu_statistics([hyp[idx][0] for idx in sorted(hyp)], [ref[idx] for idx in sorted(hyp)])
+    elif metric == 'rouge_l':
+        return Rouge().compute_score(ref, hyp)[1]
+    return CocoScore(ref, hyp, metrics_list=[metric], language=language)
+
+
+def ParallelCocoScore(ref, hyp, metrics_list, language='en', jobs=2, pool=None):
+    """
+    Obtains the COCO scores from the references and hypotheses, computing the metrics in a pool of processes.
+    BLEU and ROUGE-L are also computed on shards of the sentences: the BLEU statistics of the shards are added up and
+    the ROUGE-L sentence scores are averaged, so the scores are the same as those of CocoScore.
+
+    :param ref: Dictionary of reference sentences (id, sentence)
+    :param hyp: Dictionary of hypothesis sentences (id, sentence)
+    :param metrics_list: List of metrics to evaluate on (lowercased)
+    :param language: Language of the sentences (for METEOR)
+    :param jobs: Number of processes
+    :param pool: Pool of jobs processes (if None, it is created for this call)
+    :return: dictionary of scores
+    """
+    metrics_list = ['rouge_l' if metric == 'rouge' else metric for metric in metrics_list]
+    ids = sorted(hyp)
+    shards = [shard.tolist() for shard in np.array_split(ids, jobs) if len(shard) > 0]
+    tasks = []
+    for metric in ['fast', 'bleu', 'meteor', 'ter', 'rouge_l', 'cider']:
+        if metric not in metrics_list:
+            continue
+        if metric in DECOMPOSABLE_METRICS:
+            for shard in shards:
+                tasks.append((metric, {idx: ref[idx] for idx in shard}, {idx: hyp[idx] for idx in shard}, language))
+        else:
+            tasks.append((metric, ref, hyp, language))
+    if pool is not None:
+        results = pool.map(score_shard, tasks, chunksize=1)
+    else:
+        pool = Pool(jobs)
+        try:
+            results = pool.map(score_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    final_scores = {}
+    bleu_shards = []
+    rouge_scores = []
+    for (metric, _, _, _), result in zip(tasks, results):
+        if metric == 'bleu':
+            bleu_shards.append(result)
+        elif metric == 'rouge_l':
+            rouge_scores.extend(result)
+        else:
+            final_scores.update(result)
+    if bleu_shards:
+        statistics = {'correct': np.sum([shard['correct'] for shard in bleu_shards], axis=0).tolist(),
+                      'guess': np.sum([shard['guess'] for shard in bleu_shards], axis=0).tolist(),
+                      'testlen': sum(shard['testlen'] for shard in bleu_shards),
+                      'reflen': sum(shard['reflen'] for shard in bleu_shards)}
+        for n, score in enumerate(bleu_from_statistics(statistics), 1):
+            final_scores['Bleu_' + str(n)] = score
+    if rouge_scores:
+        final_scores['ROUGE_L'] = np.mean(rouge_scores)
+    return final_scores
+
+
+def print_scores_table(systems, scores):
+    """
+    Prints the scores of several systems as a table, one row per system.
+
+    :param systems: Names of the systems
+    :param scores: List with the dictionary of scores of each system
+    """
+    score_names = sorted(set(score_name for score in scores for score_name in score))
+    max_system_len = max([len(system) for system in systems] + [len('System')])
+    columns_len = [max(len(score_name), 8) for score_name in score_names]
+    print "{0:{1}}".format('System', max_system_len) + ''.join(
+        "  {0:>{1}}".format(score_name, column_len) for score_name, column_len in zip(score_names, columns_len))
+    for system, score in zip(systems, scores):
+        print "{0:{1}}".format(system, max_system_len) + ''.join(
+            "  {0:>{1}.5f}".format(score[score_name], column_len) if score_name in score else
+            "  {0:>{1}}".format('-', column_len) for score_name, column_len in zip(score_names, columns_len))
+
+
 def evaluate_from_file(args):
     """
     Evaluate translation hypotheses from a file or a list of files of references.
+    The references are read once and the hypotheses files (systems) are evaluated one after another.
     :param args: Evaluation parameters
     :return: None
     """
     language = args.language
-    hypotheses_file = codecs.open(args.hypotheses, 'r', encoding='utf-8')
     step_size = args.step_size
-    ref, hypothesis = load_textfiles(args.references, hypotheses_file)
-    if step_size < 1:
-        score = CocoScore(ref, hypothesis, metrics_list=args.metrics, language=language)
-        print "Scores: "
-        max_score_name_len = max([len(x) for x in score.keys()])
-        for score_name in sorted(score.keys()):
-            print "\t {0:{1}}".format(score_name, max_score_name_len) + ": %.5f" % score[score_name]
-    else:
-        n = 0
-        while True:
-            n += step_size
-            indices = range(min(n, len(ref)))
-            partial_refs = {}
-            partial_hyps = {}
-            for i in indices:
-                partial_refs[i] = ref[i]
-                partial_hyps[i] = hypothesis[i]
-            score = CocoScore(partial_refs, partial_hyps, metrics_list=args.metrics, language=language)
-            print str(min(n, len(ref))) + " \tScore: ", score
-            if n > len(ref):
-                break
+    print "The number of references is {}".format(len(args.references))
+    ref = load_references(args.references)
+    # The processes are shared by the evaluations of all the systems
+    pool = Pool(args.jobs) if args.jobs > 1 else None
+    scores = []
+    try:
+        for hypotheses_filename in args.hypotheses:
+            with codecs.open(hypotheses_filename, 'r', encoding='utf-8') as hypotheses_file:
+                hypothesis = load_hypotheses(hypotheses_file, len(ref))
+            if step_size < 1:
+                score = CocoScore(ref, hypothesis, metrics_list=args.metrics, language=language, jobs=args.jobs,
+                                  pool=pool)
+                scores.append(score)
+                if len(args.hypotheses) > 1:
+                    continue
+                print "Scores: "
+                max_score_name_len = max([len(x) for x in score.keys()])
+                for score_name in sorted(score.keys()):
+                    print "\t {0:{1}}".format(score_name, max_score_name_len) + ": %.5f" % score[score_name]
+            else:
+                if len(args.hypotheses) > 1:
+                    print "System: " + hypotheses_filename
+                n = 0
+                while True:
+                    n += step_size
+                    indices = range(min(n, len(ref)))
+                    partial_refs = {}
+                    partial_hyps = {}
+                    for i in indices:
+                        partial_refs[i] = ref[i]
+                        partial_hyps[i] = hypothesis[i]
+                    score = CocoScore(partial_refs, partial_hyps, metrics_list=args.metrics, language=language,
+                                      jobs=args.jobs, pool=pool)
+                    print str(min(n, len(ref))) + " \tScore: ", score
+                    if n > len(ref):
+                        break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if len(args.hypotheses) > 1 and step_size < 1:
+        print_scores_table(args.hypotheses, scores)
     return
 
 
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Smoothing constants of the BleuScorer of pycocoevalcap
+BLEU_TINY = 1e-15
+BLEU_SMALL = 1e-9
+
+# Limits of the shift search of TER (as in tercom)
+TER_MAX_SHIFT_SIZE = 10
+TER_MAX_SHIFT_DIST = 50
+TER_MAX_SHIFT_CANDIDATES = 1000
+
+
+def to_unicode(sentence):
+    """
+    Decodes a (utf-8) byte string, so that the characters are not split into bytes.
+    """
+    return sentence.decode('utf-8', 'replace') if isinstance(sentence, str) else sentence
+
+
+def encode_sentences(sentences):
+    """
+    Maps the symbols of a list of sentences to integer ids.
+    :param sentences: List of sentences (sequences of words or characters)
+    :return: Array with the ids of the symbols of all the sentences (concatenated) and array of len(sentences) + 1
+             offsets of the sentences
+    """
+    vocabulary = dict()
+    ids = [vocabulary.setdefault(symbol, len(vocabulary)) for sentence in sentences for symbol in sentence]
+    offsets = np.zeros(len(sentences) + 1, dtype='int64')
+    offsets[1:] = np.cumsum([len(sentence) for sentence in sentences])
+    return np.asarray(ids, dtype='int64'), offsets
+
+
+def ngram_codes(ids, offsets, max_order):
+    """
+    Integer codes of the n-grams of a list of sentences: two n-grams of the same order have the same code if and only if
+    they are equal. The codes of the n-grams are built from the codes of their (n-1)-gram prefixes, so they are exact.
+    :param ids: Symbol ids of the sentences (see encode_sentences)
+    :param offsets: Offsets of the sentences
+    :param max_order: Maximum order of the n-grams
+    :return: List with the (positions, codes) of the n-grams of each order: the start positions (in ids) of the
+             n-grams, which do not cross the sentence boundaries, and their codes
+    """
+    n_symbols = len(ids)
+    n_ids = ids.max() + 1 if n_symbols > 0 else 1
+    sentence_end = np.repeat(offsets[1:], np.diff(offsets))
+    positions = np.arange(n_symbols)
+    ngrams = [(positions, ids)]
+    prefix_codes = ids
+    for n in range(2, max_order + 1):
+        positions = positions[positions + n <= sentence_end[positions]]
+        _, codes = np.unique(prefix_codes[positions] * n_ids + ids[positions + n - 1], return_inverse=True)
+        ngrams.append((positions, codes))
+        prefix_codes = np.zeros(n_symbols, dtype='int64')
+        prefix_codes[positions] = codes
+    return ngrams
+
+
+def lookup(keys, values, queries):
+    """
+    Values of a set of keys, 0 for the missing keys.
+    :param keys: Sorted array of keys
+    :param values: Values of the keys
+    :param queries: Keys to look up
+    :return: Array of values
+    """
+    if len(keys) == 0:
+        return np.zeros(len(queries), dtype=values.dtype)
+    positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[positions] == queries, values[positions], 0)
+
+
+class NgramMatcher:
+    def __init__(self, hypotheses, references, max_order):
+        """
+        Counts the common n-grams of each hypothesis and each of its references.
+        :param hypotheses: List of hypotheses (sequences of words or characters)
+        :param references: List with the references (sequences of words or characters) of each hypothesis
+        :param max_order: Maximum order of the n-grams
+        """
+        self.n_hypotheses = len(hypotheses)
+        self.n_references = np.asarray([len(refs) for refs in references], dtype='int64')
+        if np.any(self.n_references == 0):
+            raise ValueError('Each hypothesis must have at least one reference.')
+        ids, offsets = encode_sentences(list(hypotheses) + [ref for refs in references for ref in refs])
+        lengths = np.diff(offsets)
+        self.hypothesis_lengths = lengths[:self.n_hypotheses]
+        self.reference_lengths = lengths[self.n_hypotheses:]
+        # Hypothesis of each reference
+        self.reference_owner = np.repeat(np.arange(self.n_hypotheses), self.n_references)
+        self.sentence_of_symbol = np.repeat(np.arange(len(lengths)), lengths)
+        self.ngrams = ngram_codes(ids, offsets, max_order)
+
+    def counts(self, n):
+        """
+        Counts of the n-grams of a given order.
+        :param n: Order of the n-grams
+        :return: hypothesis_keys, hypothesis_counts, reference_keys, reference_counts: the key of an n-gram of the
+                 hypothesis h is h * n_codes + code and the key of an n-gram of the reference r (of the hypothesis h) is
+                 r * n_codes + code. The keys are sorted.
+        """
+        positions, codes = self.ngrams[n - 1]
+        n_codes = codes.max() + 1 if len(codes) > 0 else 1
+        sentences = self.sentence_of_symbol[positions]
+        in_hypothesis = sentences < self.n_hypotheses
+        hypothesis_keys, hypothesis_counts = np.unique(sentences[in_hypothesis] * n_codes + codes[in_hypothesis],
+                                                       return_counts=True)
+        in_reference = ~in_hypothesis
+        reference_keys, reference_counts = np.unique((sentences[in_reference] - self.n_hypotheses) * n_codes +
+                                                     codes[in_reference], return_counts=True)
+        return n_codes, hypothesis_keys, hypothesis_counts, reference_keys, reference_counts
+
+
+def bleu_statistics(hypotheses, references, max_order=4):
+    """
+    Sufficient statistics of the corpus BLEU, computed as the BleuScorer of pycocoevalcap does: the words are split on
+    whitespaces, the n-gram counts are clipped by their maximum count in a reference and the reference length of each
+    hypothesis is the closest one (the shortest one on ties).
+    :param hypotheses: List of hypotheses (strings)
+    :param references: List with the references (strings) of each hypothesis
+    :param max_order: Maximum order of the n-grams
+    :return: Dictionary with the clipped n-gram matches ('correct') and the hypothesis n-grams ('guess') of each order,
+             and the hypothesis ('testlen') and reference ('reflen') lengths of the corpus
+    """
+    matcher = NgramMatcher([hypothesis.split() for hypothesis in hypotheses],
+                           [[reference.split() for reference in refs] for refs in references], max_order)
+    correct = []
+    guess = []
+    for n in range(1, max_order + 1):
+        n_codes, hypothesis_keys, hypothesis_counts, reference_keys, reference_counts = matcher.counts(n)
+        # Maximum count of each n-gram in the references of its hypothesis
+        max_keys, max_positions = np.unique(matcher.reference_owner[reference_keys // n_codes] * n_codes +
+                                            reference_keys % n_codes, return_inverse=True)
+        max_counts = np.zeros(len(max_keys), dtype='int64')
+        np.maximum.at(max_counts, max_positions, reference_counts)
+        correct.append(int(np.minimum(hypothesis_counts,
+                                      lookup(max_keys, max_counts, hypothesis_keys)).sum()))
+        guess.append(int(np.maximum(matcher.hypothesis_lengths - n + 1, 0).sum()))
+    # Closest reference length: minimum of (|reference length - hypothesis length|, reference length)
+    reference_lengths = matcher.reference_lengths
+    length_base = reference_lengths.max() + 1 if len(reference_lengths) > 0 else 1
+    distances = np.abs(reference_lengths - matcher.hypothesis_lengths[matcher.reference_owner])
+    first_references = np.cumsum(matcher.n_references) - matcher.n_references
+    if matcher.n_hypotheses > 0:
+        closest = np.minimum.reduceat(distances * length_base + reference_lengths, first_references) % length_base
+    else:
+        closest = np.zeros(0, dtype='int64')
+    return {'correct': correct,
+            'guess': guess,
+            'testlen': int(matcher.hypothesis_lengths.sum()),
+            'reflen': int(closest.sum())}
+
+
+def bleu_from_statistics(statistics):
+    """
+    BLEU scores of all the orders, with the smoothing and brevity penalty of the BleuScorer of pycocoevalcap.
+    :param statistics: BLEU statistics (see bleu_statistics)
+    :return: List of scores (BLEU-1, BLEU-2, ...)
+    """
+    scores = []
+    bleu = 1.
+    for correct, guess in zip(statistics['correct'], statistics['guess']):
+        bleu *= float(correct + BLEU_TINY) / (guess + BLEU_SMALL)
+        scores.append(bleu ** (1. / (len(scores) + 1)))
+    ratio = (statistics['testlen'] + BLEU_TINY) / (statistics['reflen'] + BLEU_SMALL)
+    if ratio < 1:
+        scores = [score * math.exp(1 - 1 / ratio) for score in scores]
+    return scores
+
+
+def corpus_bleu(hypotheses, references, max_order=4):
+    """
+    Corpus BLEU, identical to the Bleu scorer of pycocoevalcap.
+    :param hypotheses: List of hypotheses (strings)
+    :param references: List with the references (strings) of each hypothesis
+    :param max_order: Maximum order of the n-grams
+    :return: List of scores (BLEU-1, BLEU-2, ...)
+    """
+    return bleu_from_statistics(bleu_statistics(hypotheses, references, max_order=max_order))
+
+
+def chrf_from_statistics(hypothesis_ngrams, reference_ngrams, matches, beta=2):
+    """
+    chrF scores from the character n-gram statistics, as in sacreBLEU: the precisions and recalls are averaged over the
+    orders with n-grams in the hypothesis and the reference.
+    :param hypothesis_ngrams: Array (..., max_order) of hypothesis n-grams
+    :param reference_ngrams: Array (..., max_order) of reference n-grams
+    :param matches: Array (..., max_order) of common n-grams
+    :param beta: Weight of the recall
+    :return: Array (...) of scores
+    """
+    hypothesis_ngrams = np.asarray(hypothesis_ngrams, dtype='float64')
+    reference_ngrams = np.asarray(reference_ngrams, dtype='float64')
+    matches = np.asarray(matches, dtype='float64')
+    effective = (hypothesis_ngrams > 0) & (reference_ngrams > 0)
+    effective_order = np.maximum(effective.sum(axis=-1), 1)
+    precision = np.where(effective, matches / np.maximum(hypothesis_ngrams, 1), 0.).sum(axis=-1) / effective_order
+    recall = np.where(effective, matches / np.maximum(reference_ngrams, 1), 0.).sum(axis=-1) / effective_order
+    denominator = beta ** 2 * precision + recall
+    return np.where(denominator > 0, (1 + beta ** 2) * precision * recall / np.maximum(denominator, BLEU_TINY), 0.)
+
+
+def corpus_chrf(hypotheses, references, max_order=6, beta=2):
+    """
+    Corpus chrF (character n-gram F-score), as in sacreBLEU: the whitespaces are removed and the statistics of the
+    sentences are added up. For each hypothesis, the reference with the best sentence chrF is used.
+    :param hypotheses: List of hypotheses (strings)
+    :param references: List with the references (strings) of each hypothesis
+    :param max_order: Maximum order of the character n-grams
+    :param beta: Weight of the recall
+    :return: Score
+    """
+    matcher = NgramMatcher([u''.join(to_unicode(hypothesis).split()) for hypothesis in hypotheses],
+                           [[u''.join(to_unicode(reference).split()) for reference in refs] for refs in references],
+                           max_order)
+    n_references = len(matcher.reference_lengths)
+    orders = np.arange(1, max_order + 1)
+    hypothesis_ngrams = np.maximum(matcher.hypothesis_lengths[:, None] - orders + 1, 0)
+    reference_ngrams = np.maximum(matcher.reference_lengths[:, None] - orders + 1, 0)
+    matches = np.zeros((n_references, max_order), dtype='int64')
+    for n in orders:
+        n_codes, hypothesis_keys, hypothesis_counts, reference_keys, reference_counts = matcher.counts(n)
+        references_ids = reference_keys // n_codes
+        common = np.minimum(reference_counts,
+                            lookup(hypothesis_keys, hypothesis_counts,
+                                   matcher.reference_owner[references_ids] * n_codes + reference_keys % n_codes))
+        matches[:, n - 1] = np.bincount(references_ids, weights=common, minlength=n_references)
+    # Best reference of each hypothesis (the first one on ties)
+    scores = chrf_from_statistics(hypothesis_ngrams[matcher.reference_owner], reference_ngrams, matches, beta=beta)
+    order = np.lexsort((-scores, matcher.reference_owner))
+    best = order[np.cumsum(matcher.n_references) - matcher.n_references]
+    return float(chrf_from_statistics(hypothesis_ngrams.sum(axis=0), reference_ngrams[best].sum(axis=0),
+                                      matches[best].sum(axis=0), beta=beta))
+
+
+def edit_distance(hypothesis, reference, return_trace=False):
+    """
+    Levenshtein distance between two sequences of word ids. Each row of the dynamic programming matrix is computed at
+    once: the insertions within a row are solved with a cumulative minimum.
+    :param hypothesis: Sequence of word ids
+    :param reference: Sequence of word ids
+    :param return_trace: Whether to return the alignment of a minimal cost path
+    :return: Distance, and the trace if return_trace: string of matches (' '), substitutions ('s'), insertions ('i', a
+             hypothesis word) and deletions ('d', a reference word)
+    """
+    hypothesis = np.asarray(hypothesis)
+    reference = np.asarray(reference)
+    n_hypothesis = len(hypothesis)
+    columns = np.arange(len(reference) + 1)
+    row = columns
+    rows = [row]
+    for i in range(n_hypothesis):
+        candidates = np.empty(len(columns), dtype='int64')
+        candidates[0] = i + 1
+        candidates[1:] = np.minimum(row[:-1] + (reference != hypothesis[i]), row[1:] + 1)
+        row = np.minimum.accumulate(candidates - columns) + columns
+        if return_trace:
+            rows.append(row)
+    distance = int(row[-1])
+    if not return_trace:
+        return distance
+    trace = []
+    i, j = n_hypothesis, len(reference)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and rows[i][j] == rows[i - 1][j - 1] + (hypothesis[i - 1] != reference[j - 1]):
+            trace.append(' ' if hypothesis[i - 1] == reference[j - 1] else 's')
+            i -= 1
+            j -= 1
+        elif i > 0 and rows[i][j] == rows[i - 1][j] + 1:
+            trace.append('i')
+            i -= 1
+        else:
+            trace.append('d')
+            j -= 1
+    return distance, ''.join(reversed(trace))
+
+
+def trace_to_alignment(trace):
+    """
+    Alignment of the reference and hypothesis words from an edit trace (see edit_distance).
+    :param trace: Edit trace
+    :return: Dictionary {reference position: hypothesis position}, errors of the reference words and errors of the
+             hypothesis words
+    """
+    position_hypothesis = position_reference = -1
+    alignment = dict()
+    reference_errors = []
+    hypothesis_errors = []
+    for operation in trace:
+        if operation in ' s':
+            position_hypothesis += 1
+            position_reference += 1
+            alignment[position_reference] = position_hypothesis
+            hypothesis_errors.append(int(operation == 's'))
+            reference_errors.append(int(operation == 's'))
+        elif operation == 'i':
+            position_hypothesis += 1
+            hypothesis_errors.append(1)
+        else:
+            position_reference += 1
+            alignment[position_reference] = position_hypothesis
+            reference_errors.append(1)
+    return alignment, reference_errors, hypothesis_errors
+
+
+def shifted_pairs(hypothesis, reference):
+    """
+    Common word sequences of the hypothesis and the reference that may be shifted.
+    :return: Generator of (hypothesis start, reference start, length)
+    """
+    for start_h in range(len(hypothesis)):
+        for start_r in range(max(0, start_h - TER_MAX_SHIFT_DIST),
+                             min(len(reference), start_h + TER_MAX_SHIFT_DIST + 1)):
+            length = 0
+            while start_h + length < len(hypothesis) and start_r + length < len(reference) and \
+                    length < TER_MAX_SHIFT_SIZE and hypothesis[start_h + length] == reference[start_r + length]:
+                length += 1
+                yield start_h, start_r, length
+
+
+def shift_words(words, start, length, target):
+    """
+    Moves the words [start, start + length) before the word target (of the original sequence).
+    """
+    if target < start:
+        return words[:target] + words[start:start + length] + words[target:start] + words[start + length:]
+    elif target > start + length:
+        return words[:start] + words[start + length:target] + words[start:start + length] + words[target:]
+    return words[:start] + words[start + length:length + target] + words[start:start + length] + \
+        words[length + target:]
+
+
+def best_shift(hypothesis, reference, n_candidates):
+    """
+    Shift of a word sequence of the hypothesis that most reduces its edit distance to the reference (as in tercom).
+    :param hypothesis: List of word ids
+    :param reference: Array of word ids
+    :param n_candidates: Number of shifts already tried
+    :return: Reduction of the edit distance, shifted hypothesis and number of shifts tried
+    """
+    distance, trace = edit_distance(hypothesis, reference, return_trace=True)
+    alignment, reference_errors, hypothesis_errors = trace_to_alignment(trace)
+    best = None
+    for start_h, start_r, length in shifted_pairs(hypothesis, reference):
+        # Only shift wrong hypothesis words to wrong reference positions, out of the shifted words
+        if sum(hypothesis_errors[start_h:start_h + length]) == 0 or \
+                sum(reference_errors[start_r:start_r + length]) == 0 or \
+                start_h <= alignment[start_r] < start_h + length:
+            continue
+        previous_target = -1
+        for offset in range(-1, length):
+            if start_r + offset == -1:
+                target = 0
+            elif start_r + offset in alignment:
+                target = alignment[start_r + offset] + 1
+            else:
+                break
+            if target == previous_target:
+                continue
+            previous_target = target
+            shifted = shift_words(hypothesis, start_h, length, target)
+            candidate = (distance - edit_distance(shifted, reference), length, -start_h, -target, shifted)
+            n_candidates += 1
+            if best is None or candidate > best:
+                best = candidate
+        if n_candidates >= TER_MAX_SHIFT_CANDIDATES:
+            break
+    if best is None:
+        return 0, hypothesis, n_candidates
+    return best[0], best[4], n_candidates
+
+
+def translation_edits(hypothesis, reference):
+    """
+    Number of edits (insertions, deletions, substitutions and shifts of word sequences) of TER, with the greedy shift
+    search of tercom.
+    :param hypothesis: List of words
+    :param reference: List of words
+    :return: Number of edits
+    """
+    vocabulary = dict()
+    hypothesis = [vocabulary.setdefault(word, len(vocabulary)) for word in hypothesis]
+    reference = np.asarray([vocabulary.setdefault(word, len(vocabulary)) for word in reference], dtype='int64')
+    if len(reference) == 0:
+        return len(hypothesis)
+    n_shifts = 0
+    n_candidates = 0
+    while True:
+        delta, shifted, n_candidates = best_shift(hypothesis, reference, n_candidates)
+        if n_candidates >= TER_MAX_SHIFT_CANDIDATES or delta <= 0:
+            break
+        n_shifts += 1
+        hypothesis = shifted
+    return n_shifts + edit_distance(hypothesis, reference)
+
+
+def corpus_ter(hypotheses, references):
+    """
+    Corpus TER: edits of the hypotheses with respect to their closest references, divided by the average length of the
+    references (added up over the sentences).
+    :param hypotheses: List of hypotheses (strings)
+    :param references: List with the references (strings) of each hypothesis
+    :return: Score
+    """
+    n_edits = 0
+    reference_length = 0.
+    for hypothesis, refs in zip(hypotheses, references):
+        words = hypothesis.split()
+        refs = [reference.split() for reference in refs]
+        n_edits += min(translation_edits(words, reference) for reference in refs)
+        reference_length += float(sum(len(reference) for reference in refs)) / len(refs)
+    if reference_length > 0:
+        return n_edits / reference_length
+    return 1. if n_edits > 0 else 0.
+
+
+def fast_scores(hypotheses, references):
+    """
+    BLEU (identical to the coco metric), chrF and TER of a corpus.
+    :param hypotheses: List of hypotheses (strings)
+    :param references: List with the references (strings) of each hypothesis
+    :return: Dictionary with the scores
+    """
+    final_scores = dict()
+    for n, score in enumerate(corpus_bleu(hypotheses, references), 1):
+        final_scores['Bleu_' + str(n)] = score
+    final_scores['chrF'] = corpus_chrf(hypotheses, references)
+    final_scores['TER'] = corpus_ter(hypotheses, references)
+    return final_scores
+
+
+def get_fast_score(pred_list, verbose, extra_vars, split):
+    """
+    BLEU (identical to the coco metric), chrF and TER, computed in-process with numpy. It can be selected in METRICS
+    as 'fast' (see register_metrics).
+    :param pred_list: List of hypothesis sentences
+    :param verbose: if greater than 0 the metric measures are printed out
+    :param extra_vars: extra variables, as in the coco metric of keras_wrapper.extra.evaluation:
+            extra_vars[split]['references'] - dict mapping sample indices to list with all valid captions
+            extra_vars['tokenize_f'] - tokenization function used during model training
+            extra_vars['detokenize_f'] - detokenization function used during model training
+            extra_vars['tokenize_hypotheses'] - Whether tokenize or not the hypotheses during evaluation
+            extra_vars['tokenize_references'] - Whether tokenize or not the references during evaluation
+            extra_vars['apply_detokenization'] - Whether detokenize or not the references during evaluation
+    :param split: split on which we are evaluating
+    :return: Dictionary with the scores
+    """
+    gts = extra_vars[split]['references']
+    if extra_vars.get('tokenize_hypotheses', False):
+        hypotheses = [extra_vars['tokenize_f'](line.strip()) for line in pred_list]
+    else:
+        hypotheses = [line.strip() for line in pred_list]
+    references = [gts[idx] for idx in range(len(hypotheses))]
+    if extra_vars.get('tokenize_references', False):
+        references = [map(extra_vars['tokenize_f'], refs) for refs in references]
+    if extra_vars.get('apply_detokenization', False):
+        references = [map(extra_vars['detokenize_f'], refs) for refs in references]
+
+    final_scores = fast_scores(hypotheses, references)
+
+    if verbose > 0:
+        logger.info('Computing fast scores on the %s split...' % split)
+    for metric in sorted(final_scores):
+        logger.info(metric + ': ' + str(final_scores[metric]))
+    return final_scores
+
+
+def register_metrics():
+    """
+    Adds the 'fast' metric (see get_fast_score) to the metrics of keras_wrapper, so it can be selected in METRICS.
+    It must be called before building the callbacks that evaluate the model (see main.buildCallbacks).
+    """
+    from keras_wrapper.extra import evaluation
+    evaluation.select['fast'] = get_fast_score
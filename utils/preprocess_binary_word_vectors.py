@@ -1,19 +1,22 @@
 import numpy as np
 import argparse
 from os.path import basename, dirname
+from word_vectors import WordVectorsWriter, read_vocabulary
 
 
 # Preprocess pretrained binary vectors
-# and stores them in a suitable format (.npy)
+# and stores them in a suitable format (.npy matrix and word index, see word_vectors.py)
 
-def word2vec2npy(v_path, base_path_save, dest_filename):
+def word2vec2npy(v_path, base_path_save, dest_filename, vocabulary=None):
     """
     Preprocess pretrained binary vectors and stores them in a suitable format.
+    The vectors are written to the destination as they are read, so the memory does not depend on the size of the
+    vectors file.
     :param v_path: Path to the binary vectors file.
     :param base_path_save: Path where the formatted vectors will be stored.
     :param dest_filename: Filename of the formatted vectors.
+    :param vocabulary: Set of words to keep (utf-8 encoded). If None, all the vectors are kept.
     """
-    word_vecs = dict()
     print "Loading vectors from %s" % v_path
     with open(v_path, "rb") as f:
         header = f.readline()
@@ -21,6 +24,7 @@ def word2vec2npy(v_path, base_path_save, dest_filename):
         binary_len = np.dtype('float32').itemsize * layer1_size
         i = 0
         print "Vector length:", layer1_size
+        writer = WordVectorsWriter(base_path_save + '/' + dest_filename + '.npy', layer1_size)
         for _ in xrange(vocab_size):
             word = []
             while True:
@@ -30,17 +34,18 @@ def word2vec2npy(v_path, base_path_save, dest_filename):
                     break
                 if ch != '\n':
                     word.append(ch)
-            word_vecs[word] = np.fromstring(f.read(binary_len),
-                                            dtype='float32')
+            vector = f.read(binary_len)
+            if vocabulary is None or word in vocabulary:
+                writer.append(word, np.frombuffer(vector, dtype='float32'))
             i += 1
             if i % 1000 == 0:
                 print "Processed %d vectors (%.2f %%)\r" % \
                       (i, 100 * float(i) / vocab_size),
 
-    # Store dict
-    print "Saving word vectors in %s" % \
-          (base_path_save + '/' + dest_filename + '.npy')
-    np.save(base_path_save + '/' + dest_filename + '.npy', word_vecs)
+    # Store matrix and word index
+    print "Saving %d word vectors in %s" % \
+          (writer.n_words, base_path_save + '/' + dest_filename + '.npy')
+    writer.close()
     print
 
 
@@ -49,6 +54,8 @@ def parse_args():
     parser.add_argument("-v", "--vectors", required=True, help="Pre-trained word embeddings file.",
                         default="GoogleNews-vectors-negative300.bin")
     parser.add_argument("-d", "--destination", required=True, help="Destination file.", default='word2vec.en')
+    parser.add_argument("--vocabulary", required=False, help="Only keep the vectors of the words of this file "
+                                                             "(first field of each line).", default=None)
     return parser.parse_args()
 
 
@@ -57,4 +64,5 @@ if __name__ == "__main__":
     dest_file = basename(args.destination)
     base_path = dirname(args.destination)
 
-    word2vec2npy(args.vectors, base_path, dest_file)
+    word2vec2npy(args.vectors, base_path, dest_file,
+                 vocabulary=read_vocabulary(args.vocabulary) if args.vocabulary is not None else None)
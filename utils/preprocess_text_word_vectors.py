@@ -1,39 +1,61 @@
 import numpy as np
 import argparse
 from os.path import basename, dirname
+from word_vectors import WordVectorsWriter, read_vocabulary
 
 
 # Preprocess pretrained text vectors
-# and stores them in a suitable format (.npy)
+# and stores them in a suitable format (.npy matrix and word index, see word_vectors.py)
 
-def txtvec2npy(v_path, base_path_save, dest_filename):
+def txtvec2npy(v_path, base_path_save, dest_filename, vocabulary=None):
     """
-    Preprocess pretrained text vectors and stores them in a suitable format
+    Preprocess pretrained text vectors and stores them in a suitable format.
+    The file is read line by line and the vectors are written to the destination as they are read, so the memory
+    does not depend on the size of the vectors file.
     :param v_path: Path to the text vectors file.
     :param base_path_save: Path where the formatted vectors will be stored.
     :param dest_filename: Filename of the formatted vectors.
+    :param vocabulary: Set of words to keep (utf-8 encoded). If None, all the vectors are kept.
     """
-    word_vecs = dict()
     print "Loading vectors from %s" % v_path
-    glove_vectors = [x[:-1] for x in open(v_path).readlines()]
-    n_vecs = len(glove_vectors)
-    print "Found %d vectors in %s" % (n_vecs, v_path)
+    writer = None
+    dimension = None
     i = 0
-    for vector in glove_vectors:
-        v = vector.split()
-        word = v[0]
-        vec = np.asarray(v[1:], dtype='float32')
-        word_vecs[word] = vec
-        i += 1
-        if i % 1000 == 0:
-            print "Processed %d vectors (%.2f %%)\r" % \
-                  (i, 100 * float(i) / n_vecs),
+    n_skipped = 0
+    with open(v_path, 'r') as f:
+        for n_line, line in enumerate(f):
+            v = line.split()
+            if n_line == 0 and len(v) == 2 and v[0].isdigit() and v[1].isdigit():
+                # Header of the word2vec/fastText text format: number of vectors and dimension
+                dimension = int(v[1])
+                print "Found %s vectors of dimension %d in %s" % (v[0], dimension, v_path)
+                continue
+            if not v:
+                continue
+            if dimension is None:
+                dimension = len(v) - 1
+            if len(v) < dimension + 1:
+                n_skipped += 1
+                continue
+            # Some words contain spaces: the vector is made of the last fields
+            word = ' '.join(v[:len(v) - dimension])
+            if vocabulary is None or word in vocabulary:
+                if writer is None:
+                    writer = WordVectorsWriter(base_path_save + '/' + dest_filename + '.npy', dimension)
+                writer.append(word, np.asarray(v[len(v) - dimension:], dtype='float32'))
+            i += 1
+            if i % 1000 == 0:
+                print "Processed %d vectors\r" % i,
 
     print
-    # Store dict
-    print "Saving word vectors in %s" % \
-          (base_path_save + '/' + dest_filename + '.npy')
-    np.save(base_path_save + '/' + dest_filename + '.npy', word_vecs)
+    if writer is None:
+        writer = WordVectorsWriter(base_path_save + '/' + dest_filename + '.npy', dimension or 0)
+    if n_skipped > 0:
+        print "Skipped %d malformed lines" % n_skipped
+    # Store matrix and word index
+    print "Saving %d word vectors in %s" % \
+          (writer.n_words, base_path_save + '/' + dest_filename + '.npy')
+    writer.close()
     print
 
 
@@ -42,6 +64,8 @@ def parse_args():
     parser.add_argument("-v", "--vectors", required=True, help="Pre-trained word embeddings file.",
                         default="GoogleNews-vectors-negative300.txt")
     parser.add_argument("-d", "--destination", required=True, help="Destination file.", default='word2vec.en')
+    parser.add_argument("--vocabulary", required=False, help="Only keep the vectors of the words of this file "
+                                                             "(first field of each line).", default=None)
     return parser.parse_args()
 
 
@@ -49,4 +73,5 @@ if __name__ == "__main__":
     args = parse_args()
     dest_file = basename(args.destination)
     base_path = dirname(args.destination)
-    txtvec2npy(args.vectors, base_path, dest_file)
+    txtvec2npy(args.vectors, base_path, dest_file,
+               vocabulary=read_vocabulary(args.vocabulary) if args.vocabulary is not None else None)
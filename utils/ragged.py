@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+
+
+class RaggedWriter:
+    def __init__(self, filepath, dtype='float32'):
+        """
+        Incrementally writes a sequence of variable-length arrays (e.g. a value per target word of each sentence) in a
+        memory-mappable ragged format:
+            * filepath: The values of all the arrays, concatenated (raw binary, dtype).
+            * filepath + '.offsets': n_arrays + 1 int64 offsets (raw binary). The i-th array is
+              values[offsets[i]:offsets[i + 1]].
+        :param filepath: Destination file of the values
+        :param dtype: Type of the values
+        """
+        self.filepath = filepath
+        self.dtype = np.dtype(dtype)
+        self.offset = 0
+        self.values_file = io.open(filepath, 'wb')
+        self.offsets_file = io.open(filepath + '.offsets', 'wb')
+        self.offsets_file.write(np.zeros(1, dtype='int64').tostring())
+
+    def append(self, values):
+        """
+        Appends an array.
+        :param values: 1D array
+        """
+        self.extend([values])
+
+    def extend(self, arrays):
+        """
+        Appends several arrays.
+        :param arrays: List of 1D arrays
+        """
+        if not arrays:
+            return
+        arrays = [np.asarray(values, dtype=self.dtype).ravel() for values in arrays]
+        self.values_file.write(np.concatenate(arrays).tostring())
+        offsets = self.offset + np.cumsum([len(values) for values in arrays], dtype='int64')
+        self.offsets_file.write(offsets.tostring())
+        self.offset = int(offsets[-1])
+
+    def close(self):
+        self.values_file.close()
+        self.offsets_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RaggedArray:
+    def __init__(self, filepath, dtype='float32'):
+        """
+        Read-only, memory-mapped view of a file written by RaggedWriter. Only the accessed arrays are read from disk.
+        :param filepath: File of the values
+        :param dtype: Type of the values (as given to RaggedWriter)
+        """
+        self.offsets = np.memmap(filepath + '.offsets', dtype='int64', mode='r')
+        n_values = int(self.offsets[-1])
+        # np.memmap cannot map empty files
+        self.values = np.memmap(filepath, dtype=dtype, mode='r', shape=(n_values,)) if n_values > 0 \
+            else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Index %d out of range for %d arrays' % (i, len(self)))
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
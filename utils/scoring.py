@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def dataset_batches(dataset, split, batch_size, model_inputs, dataset_inputs, dataset_output, sort_window=20):
+    """
+    Reads the teacher-forcing batches of a split of a Dataset. The sentences of each window of sort_window batches
+    are sorted by target length before batching them, in order to reduce the padding.
+    :param dataset: Dataset instance (with the targets and the state_below inputs of the split)
+    :param split: Split to read
+    :param batch_size: Number of sentences per batch
+    :param model_inputs: Ids of the inputs of the models
+    :param dataset_inputs: Ids of the inputs of the dataset (in the same order as model_inputs)
+    :param dataset_output: Id of the target text output of the dataset
+    :param sort_window: Number of batches sorted together
+    :return: Generator of (sentence indices, model inputs, target word indices, target mask)
+    """
+    n_samples = getattr(dataset, 'len_' + split)
+    output_position = dataset.ids_outputs.index(dataset_output)
+    window_size = batch_size * max(sort_window, 1)
+    for init in range(0, n_samples, window_size):
+        final = min(init + window_size, n_samples)
+        targets = dataset.getY(split, init, final, get_only_ids=True)[output_position]
+        order = np.argsort([len(target.split()) for target in targets], kind='mergesort')
+        for batch in [order[i:i + batch_size] for i in range(0, len(order), batch_size)]:
+            indices = [init + int(idx) for idx in batch]
+            X = dict(zip(dataset.ids_inputs, dataset.getX_FromIndices(split, indices)))
+            y, mask = dataset.loadText([targets[idx] for idx in batch],
+                                       dataset.vocabulary[dataset_output],
+                                       dataset.max_text_len[dataset_output][split],
+                                       dataset.text_offset[dataset_output],
+                                       dataset.fill_text[dataset_output],
+                                       dataset.pad_on_batch[dataset_output],
+                                       dataset.words_so_far[dataset_output],
+                                       loading_X=False)
+            X = dict((model_in, X[dataset_in]) for model_in, dataset_in in zip(model_inputs, dataset_inputs))
+            yield indices, X, y, mask
+
+
+def attention_decoders(model):
+    """
+    Attentional RNN decoder layers of the training model of a TranslationModel.
+    :param model: TranslationModel instance
+    :return: List of layers
+    """
+    return [layer for layer in model.model.layers if layer.name.startswith('decoder_Att')]
+
+
+def attention_model(model):
+    """
+    Training model of a TranslationModel that also outputs the attention weights of its attentional RNN decoder.
+    :param model: TranslationModel instance (with an AttRNNCond decoder)
+    :return: Model with the inputs of model.model and its outputs plus the (time-major) attention weights
+    """
+    from keras.models import Model
+
+    decoders = attention_decoders(model)
+    if not decoders:
+        raise NotImplementedError('The attention weights are only available for the attentional RNN models.')
+    # The first node of the (shared) decoder is the one of the training model
+    alphas = decoders[0].get_output_at(0)[2]
+    return Model(inputs=model.model.inputs, outputs=model.model.outputs + [alphas])
+
+
+class ForcedDecodingScorer:
+    def __init__(self, models, params, model_weights=None, entropies=False, alignments=False, verbose=0):
+        """
+        Scores source--target pairs by forced decoding: each batch of targets is fed (as state_below) through the
+        training model of every model of the ensemble in a single teacher-forced forward pass, instead of decoding it
+        word by word as BeamSearchEnsemble.scoreNet does.
+        The probability of each target word is the weighted average of the probabilities given by the models.
+        :param models: List of models (TranslationModel instances)
+        :param params: Scoring parameters (as built in score.py). The normalization of the scores follows scoreNet
+                       (normalize_probs, alpha_factor, length_penalty, length_norm_factor, coverage_penalty and
+                       coverage_norm_factor). The coverage penalty is computed from the attention weights of the
+                       source sentences, which are the first of the model_inputs, so it requires attentional RNN
+                       models (see attention_model).
+        :param model_weights: Weight of each model of the ensemble. If None, the ensemble is averaged.
+        :param entropies: Whether to compute the entropy of the (ensembled) distribution of each target word
+        :param alignments: Whether to compute the source position with the highest (ensembled) attention weight for
+                           each target word. It requires attentional RNN models (see attention_model).
+        :param verbose: Verbosity level
+        """
+        self.models = models
+        self.params = params
+        self.entropies = entropies
+        self.alignments = alignments
+        self.coverage_penalty = params.get('coverage_penalty', False)
+        self.verbose = verbose
+        self.attention_models = [None] * len(models)
+        if model_weights is None or model_weights == []:
+            model_weights = [1. / len(models)] * len(models)
+        if len(model_weights) != len(models):
+            raise AssertionError('You should give a weight to each model. You gave %d model weights but have %d '
+                                 'models.' % (len(model_weights), len(models)))
+        self.model_weights = np.asarray(model_weights, dtype='float32')
+
+    def _predict(self, n_model, X):
+        """
+        Probabilities (and attention weights, if required for the alignments or the coverage penalty) of the
+        n_model-th model for a batch.
+        """
+        if self.alignments or self.coverage_penalty:
+            if self.attention_models[n_model] is None:
+                self.attention_models[n_model] = attention_model(self.models[n_model])
+            out_data = self.attention_models[n_model].predict_on_batch(X)
+            # AttRNNCond layers return time-major attention weights
+            return out_data[0], np.transpose(out_data[-1], (1, 0, 2))
+        probs = self.models[n_model].model.predict_on_batch(X)
+        return probs[0] if isinstance(probs, list) else probs, None
+
+    def score_batch(self, X, y, mask):
+        """
+        Scores a batch of targets.
+        :param X: Model inputs ({input_id: array}), including the shifted targets (state_below)
+        :param y: (n_sentences, n_steps) target word indices
+        :param mask: (n_sentences, n_steps) target mask
+        :return: Scores of the sentences (negative log-probabilities, normalized as in scoreNet) and dictionary of
+                 (n_sentences, n_steps) arrays (0 in the padding) with the 'log_probs' of the target words and, if
+                 required, their 'entropies' and 'alignments'
+        """
+        n_sentences = y.shape[0]
+        n_steps = y.shape[1]
+        target_probs = 0.
+        ensemble_probs = 0.
+        ensemble_alphas = 0.
+        for n_model, weight in enumerate(self.model_weights):
+            probs, alphas = self._predict(n_model, X)
+            # The models only see the padded state_below, which may be shorter than the padded targets
+            n_steps = min(n_steps, probs.shape[1])
+            probs = probs[:, :n_steps]
+            target_probs = weight * probs[np.arange(n_sentences)[:, None], np.arange(n_steps)[None], y[:, :n_steps]] \
+                + target_probs
+            if self.entropies:
+                ensemble_probs = weight * probs + ensemble_probs
+            if self.alignments or self.coverage_penalty:
+                ensemble_alphas = weight * alphas[:, :n_steps] + ensemble_alphas
+        mask = mask[:, :n_steps]
+        with np.errstate(divide='ignore'):
+            log_probs = np.where(mask > 0, np.log(target_probs), 0.)
+        tokens = {'log_probs': log_probs}
+        if self.entropies:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropies = -np.sum(np.where(ensemble_probs > 0, ensemble_probs * np.log(ensemble_probs), 0.),
+                                    axis=2)
+            tokens['entropies'] = np.where(mask > 0, entropies, 0.)
+        if self.alignments:
+            tokens['alignments'] = np.where(mask > 0, np.argmax(ensemble_alphas, axis=2), 0)
+        scores = -log_probs.sum(axis=1)
+        lengths = mask.sum(axis=1).astype('float64')
+        if self.params.get('length_penalty', False) or self.coverage_penalty:
+            if self.params.get('length_penalty', False):
+                length_norm_factor = self.params.get('length_norm_factor', 0.0)
+                scores /= (5 + lengths) ** length_norm_factor / (5 + 1) ** length_norm_factor
+            if self.coverage_penalty:
+                # As in scoreNet, the source sentences are the first input of the models
+                model_inputs = self.params.get('model_inputs', [])
+                source = X[model_inputs[0]] if model_inputs else None
+                scores += self.params.get('coverage_norm_factor', 0.0) * self.coverage(ensemble_alphas, mask, source)
+        elif self.params.get('normalize_probs', False):
+            scores /= lengths ** self.params.get('alpha_factor', 0.0)
+        return scores, tokens
+
+    @staticmethod
+    def coverage(alphas, mask, source=None):
+        """
+        Coverage penalty of scoreNet: sum over the source words of the logarithm of their attention weights
+        accumulated over the target words (capped at 1).
+        :param alphas: (n_sentences, n_steps, source length) attention weights
+        :param mask: (n_sentences, n_steps) target mask
+        :param source: (n_sentences, source length) source word indices, whose padding (index 0) is not penalized.
+                       If None, all the source positions are penalized.
+        :return: Coverage penalty of each sentence
+        """
+        attention = np.sum(alphas * mask[:, :, None], axis=1)
+        with np.errstate(divide='ignore'):
+            penalties = np.log(np.minimum(attention, 1.0))
+        if source is not None:
+            penalties = np.where(np.asarray(source)[:, :alphas.shape[2]] > 0, penalties, 0.)
+        return penalties.sum(axis=1)
+
+    def score(self, batches, n_samples=None):
+        """
+        Scores a sequence of batches, yielding the results in the order of the sentences (the batches may be sorted
+        by length, as in dataset_batches). Only the results of the batches that are not ready to be yielded are kept in
+        memory.
+        :param batches: Iterable of (sentence indices, model inputs, target word indices, target mask)
+        :param n_samples: Total number of sentences (for reporting the progress only)
+        :return: Generator of (sentence score, dictionary of per-token arrays, as in score_batch) tuples
+        """
+        pending = dict()
+        next_index = 0
+        scored = 0
+        total_cost = 0.
+        start_time = time.time()
+        for indices, X, y, mask in batches:
+            scores, tokens = self.score_batch(X, y, mask)
+            lengths = mask[:, :tokens['log_probs'].shape[1]].sum(axis=1)
+            for i, (index, score, length) in enumerate(zip(indices, scores, lengths)):
+                pending[index] = (score, dict((key, values[i, :int(length)]) for key, values in tokens.iteritems()))
+            scored += len(indices)
+            total_cost += scores.sum()
+            if self.verbose > 0:
+                logger.info('Scored %d%s sentences (%.1f sentences/s)' %
+                            (scored, '' if n_samples is None else '/%d' % n_samples,
+                             scored / max(time.time() - start_time, 1e-6)))
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        if pending:
+            raise AssertionError('The batches did not include the sentence %d.' % next_index)
+        logger.info('Total cost of the sentences: %f \t Average cost of the sentences: %f' %
+                    (total_cost, total_cost / max(scored, 1)))
+        logger.info('The scoring took: %f secs' % (time.time() - start_time))
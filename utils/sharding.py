@@ -0,0 +1,67 @@
+import codecs
+import io
+import os
+
+
+def split_file(filepath, n_shards, dest_dir):
+    """
+    Splits a text file into n_shards files of contiguous lines, whose sizes differ at most by one line.
+    If the file has less than n_shards lines, one shard per line is created.
+    :param filepath: File to split
+    :param n_shards: Number of shards
+    :param dest_dir: Directory where the shards are stored
+    :return: List of (shard path, index of its first line in the original file)
+    """
+    with io.open(filepath, 'rb') as f:
+        n_lines = sum(1 for _ in f)
+    n_shards = max(1, min(n_shards, n_lines))
+    first_lines = set(n_lines * i // n_shards for i in range(n_shards))
+    shards = []
+    shard = None
+    with io.open(filepath, 'rb') as f:
+        for n_line, line in enumerate(f):
+            if n_line in first_lines:
+                if shard is not None:
+                    shard.close()
+                shard_path = os.path.join(dest_dir, 'shard_%d' % len(shards))
+                shard = io.open(shard_path, 'wb')
+                shards.append((shard_path, n_line))
+            shard.write(line)
+    if shard is not None:
+        shard.close()
+    return shards
+
+
+def merge_files(filepaths, dest):
+    """
+    Concatenates files.
+    :param filepaths: Files to concatenate, in order
+    :param dest: Destination file or file object
+    """
+    out = io.open(dest, 'wb') if isinstance(dest, basestring) else dest
+    try:
+        for filepath in filepaths:
+            with io.open(filepath, 'rb') as f:
+                for line in f:
+                    out.write(line)
+    finally:
+        if isinstance(dest, basestring):
+            out.close()
+
+
+def merge_nbest_files(filepaths, offsets, dest, separator=u'|||'):
+    """
+    Concatenates n-best files (as written by nbest2file), shifting the sentence index of their entries.
+    :param filepaths: N-best files to concatenate, in order
+    :param offsets: Index of the first sentence of each file in the merged file
+    :param dest: Destination file
+    :param separator: Separator between the fields of the n-best entries
+    """
+    with codecs.open(dest, 'w', encoding='utf-8') as out:
+        for filepath, offset in zip(filepaths, offsets):
+            with codecs.open(filepath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    index, entry = line.split(separator, 1)
+                    out.write(u'%d %s%s' % (int(index) + offset, separator, entry))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Shortlist:
+    def __init__(self, candidates, n_frequent=1000):
+        """
+        Lexical shortlist for decoding: the output vocabulary of each sentence is restricted to the n_frequent most
+        frequent target words plus the translation candidates of its source words.
+        Since the Dataset sorts the vocabularies by frequency, the n_frequent most frequent target words are the ones
+        with the lowest indices (including the extra words, e.g. <pad>/<eos> and <unk>).
+        :param candidates: Dictionary {source word index: array of target word indices}
+        :param n_frequent: Number of frequent target words always included
+        """
+        self.candidates = candidates
+        self.n_frequent = max(n_frequent, 1)
+        self.frequent = np.arange(self.n_frequent, dtype='int64')
+
+    def sentence_vocabulary(self, src_row, extra_words=None):
+        """
+        Target words allowed for a source sentence.
+        :param src_row: Source word indices (padded with 0s)
+        :param extra_words: Additional target word indices to allow (e.g. fixed words)
+        :return: Sorted array of target word indices
+        """
+        words = [self.frequent]
+        for src_word in np.unique(src_row[src_row > 0]):
+            src_candidates = self.candidates.get(int(src_word))
+            if src_candidates is not None:
+                words.append(src_candidates)
+        if extra_words is not None:
+            words.append(np.asarray(list(extra_words), dtype='int64'))
+        return np.unique(np.concatenate(words))
+
+    def select(self, src, extra_words=None):
+        """
+        Shortlist of a batch of sentences.
+        :param src: Source word indices, one padded row per sentence
+        :param extra_words: List (one per sentence) of additional target word indices to allow, or None
+        :return: Union of the vocabularies of the sentences (sorted array of target word indices) and a boolean
+                 (n_sentences, len(vocabulary)) matrix with the words allowed for each sentence
+        """
+        extra_words = extra_words or [None] * len(src)
+        sentence_vocabularies = [self.sentence_vocabulary(src_row, extra)
+                                 for src_row, extra in zip(src, extra_words)]
+        vocabulary = np.unique(np.concatenate(sentence_vocabularies))
+        allowed = np.zeros((len(src), len(vocabulary)), dtype='bool')
+        for i, sentence_vocabulary in enumerate(sentence_vocabularies):
+            allowed[i, np.searchsorted(vocabulary, sentence_vocabulary)] = True
+        return vocabulary, allowed
+
+
+def build_shortlist(mapping, word2index_x, word2index_y, n_frequent=1000, n_candidates=10):
+    """
+    Builds a Shortlist from a source -- target mapping.
+    :param mapping: Dictionary {source word: target word(s)}. Values may be a single word (as in the mappings used by
+                    the unknown words heuristics) or a list of candidates sorted by probability (as stored by
+                    ttables_to_dict.py --candidates-dest).
+    :param word2index_x: Source vocabulary
+    :param word2index_y: Target vocabulary
+    :param n_frequent: Number of frequent target words always included
+    :param n_candidates: Maximum number of candidates of each source word
+    :return: Shortlist instance
+    """
+    def to_unicode(word):
+        return word.decode('utf-8') if isinstance(word, str) else word
+
+    candidates = dict()
+    for src_word, trg_words in mapping.iteritems():
+        src_idx = word2index_x.get(to_unicode(src_word))
+        if src_idx is None:
+            continue
+        if isinstance(trg_words, basestring):
+            trg_words = [trg_words]
+        trg_indices = [word2index_y[to_unicode(trg_word)] for trg_word in trg_words[:n_candidates]
+                       if to_unicode(trg_word) in word2index_y]
+        if trg_indices:
+            candidates[src_idx] = np.asarray(trg_indices, dtype='int64')
+    logger.info('Shortlist: %d frequent target words and candidates for %d source words' %
+                (n_frequent, len(candidates)))
+    return Shortlist(candidates, n_frequent=n_frequent)
+
+
+class SplitOutputLayer:
+    def __init__(self, model_init, model_next, kernel, bias=None):
+        """
+        Optimized search models whose first output is the input of the softmax output layer (instead of the
+        probabilities), together with the weights of that layer. This allows to compute the probabilities of a
+        subset of the vocabulary only.
+        :param model_init: Model with the inputs and outputs of model_init, but the output layer
+        :param model_next: Model with the inputs and outputs of model_next, but the output layer
+        :param kernel: (hidden_size, vocabulary_size) weights of the output layer
+        :param bias: (vocabulary_size, ) bias of the output layer, or None
+        """
+        self.model_init = model_init
+        self.model_next = model_next
+        self.kernel = kernel
+        self.bias = bias
+
+    def probs(self, hidden, vocabulary, allowed):
+        """
+        Softmax over the words of a shortlist.
+        :param hidden: (n_rows, hidden_size) inputs of the output layer
+        :param vocabulary: Indices of the shortlisted words
+        :param allowed: (n_rows, len(vocabulary)) boolean matrix of the words allowed for each row
+        :return: (n_rows, len(vocabulary)) probabilities (0 for the words not allowed)
+        """
+        logits = np.dot(hidden, self.kernel[:, vocabulary])
+        if self.bias is not None:
+            logits += self.bias[vocabulary]
+        logits[~allowed] = -np.inf
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+
+def _layer_input(layer, output_tensor):
+    """
+    Input tensor of the node of a (possibly shared) layer that produced output_tensor.
+    """
+    node_index = 0
+    while True:
+        try:
+            layer_output = layer.get_output_at(node_index)
+        except ValueError:
+            raise ValueError('Tensor %s is not an output of layer %s' % (str(output_tensor), layer.name))
+        if layer_output is output_tensor:
+            return layer.get_input_at(node_index)
+        node_index += 1
+
+
+def split_output_layer(model):
+    """
+    Splits the softmax output layer (named as the first output of the model) from the optimized search models.
+    :param model: Model with model_init and model_next (e.g. a TranslationModel instance)
+    :return: SplitOutputLayer instance
+    """
+    from keras.models import Model
+
+    output_layer = model.model_next.get_layer(model.ids_outputs[0])
+    dense = getattr(output_layer, 'layer', output_layer)  # TimeDistributed
+    if getattr(dense.activation, '__name__', None) != 'softmax':
+        raise NotImplementedError('The shortlist requires a softmax output layer (CLASSIFIER_ACTIVATION).')
+    weights = dense.get_weights()
+    split_models = []
+    for sampling_model in [model.model_init, model.model_next]:
+        hidden = _layer_input(sampling_model.get_layer(model.ids_outputs[0]), sampling_model.outputs[0])
+        split_models.append(Model(inputs=sampling_model.inputs, outputs=[hidden] + sampling_model.outputs[1:]))
+    return SplitOutputLayer(split_models[0], split_models[1], weights[0], weights[1] if len(weights) > 1 else None)
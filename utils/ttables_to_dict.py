@@ -9,6 +9,8 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--fname", type=str)  # T-tables
 parser.add_argument("--dest", type=str)
 parser.add_argument("--verbose", type=int)
+parser.add_argument("--candidates-dest", type=str, default=None)  # Top-k candidates of each word (for SHORTLIST)
+parser.add_argument("--top-k", type=int, default=10)
 
 args = parser.parse_args()
 
@@ -50,3 +52,6 @@ for elt in e:
     f1[elt] = e[elt][0]
 
 dict2pkl(f1, args.dest)
+
+if args.candidates_dest is not None:
+    dict2pkl(dict((elt, e[elt][:args.top_k]) for elt in e), args.candidates_dest)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+
+
+class PrefixIndex:
+    def __init__(self, word2index, encoding='utf-8'):
+        """
+        Index of the words of a vocabulary by prefix. Words are kept sorted (as unicode strings), so the words
+        starting by a given prefix form a contiguous range, located by binary search.
+        :param word2index: Dictionary {word: index} (words may be byte strings, encoded with 'encoding')
+        :param encoding: Encoding of the byte string words
+        """
+        entries = sorted((word.decode(encoding) if isinstance(word, str) else word, word, index)
+                         for word, index in word2index.iteritems())
+        self.keys = [entry[0] for entry in entries]
+        self.words = [entry[1] for entry in entries]
+        self.indices = [entry[2] for entry in entries]
+
+    def range(self, prefix):
+        """
+        :return: (start, end) positions of the words starting by prefix in the sorted vocabulary
+        """
+        if not prefix:
+            return 0, len(self.keys)
+        start = bisect_left(self.keys, prefix)
+        # Binary search of the first word after start not starting by prefix (the last character of prefix may be the
+        # greatest code point, so there is no string to bisect for)
+        end = len(self.keys)
+        lo = start
+        while lo < end:
+            mid = (lo + end) // 2
+            if self.keys[mid].startswith(prefix):
+                lo = mid + 1
+            else:
+                end = mid
+        return start, end
+
+    def completions(self, prefix):
+        """
+        Words starting by prefix.
+        :param prefix: Unicode prefix
+        :return: Dictionary {index: word}
+        """
+        start, end = self.range(prefix)
+        return dict(zip(self.indices[start:end], self.words[start:end]))
+
+    def __len__(self):
+        return len(self.keys)
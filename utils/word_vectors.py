@@ -0,0 +1,201 @@
+import io
+import logging
+import os
+import struct
+
+import numpy as np
+
+# Size of the header of the .npy matrices written by WordVectorsWriter, which is rewritten when closing the writer
+NPY_HEADER_SIZE = 128
+
+
+def word_vectors_paths(filepath):
+    """
+    Files of a set of word vectors:
+        * base + '.npy': float32 matrix with a row per word.
+        * base + '.words.npy': Words (utf-8 encoded bytes), sorted.
+        * base + '.rows.npy': int64 row of the matrix of each sorted word.
+    :param filepath: Path of the matrix (base + '.npy'), or its base
+    :return: Paths of the matrix, the sorted words and their rows
+    """
+    base = filepath[:-len('.npy')] if filepath.endswith('.npy') else filepath
+    return base + '.npy', base + '.words.npy', base + '.rows.npy'
+
+
+def encode_word(word):
+    """
+    Utf-8 encoding of a word, as stored in the word index.
+    """
+    return word.encode('utf-8') if isinstance(word, unicode) else word
+
+
+def save_word_index(words, filepath):
+    """
+    Stores the word index of a matrix of word vectors.
+    :param words: Words of the rows of the matrix, in order (list, or array of utf-8 byte strings)
+    :param filepath: Path of the matrix (see word_vectors_paths)
+    """
+    _, words_path, rows_path = word_vectors_paths(filepath)
+    if not isinstance(words, np.ndarray) or words.dtype.kind != 'S':
+        words = np.asarray([encode_word(word) for word in words], dtype='S')
+    rows = np.argsort(words, kind='mergesort')
+    np.save(words_path, words[rows])
+    np.save(rows_path, rows.astype('int64'))
+
+
+def save_word_vectors(words, vectors, filepath):
+    """
+    Stores a set of word vectors: their float32 matrix and the word index.
+    :param words: Words of the vectors
+    :param vectors: Matrix of vectors (one row per word)
+    :param filepath: Path of the matrix (see word_vectors_paths)
+    """
+    matrix_path, _, _ = word_vectors_paths(filepath)
+    np.save(matrix_path, np.asarray(vectors, dtype='float32'))
+    save_word_index(words, filepath)
+
+
+def npy_header(n_rows, dimension):
+    """
+    Header (format version 1.0) of a .npy float32 matrix, padded to NPY_HEADER_SIZE bytes.
+    """
+    magic = '\x93NUMPY\x01\x00'
+    header_len = NPY_HEADER_SIZE - len(magic) - 2
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (n_rows, dimension)
+    return magic + struct.pack('<H', header_len) + header.ljust(header_len - 1) + '\n'
+
+
+class WordVectorsWriter:
+    def __init__(self, filepath, dimension, chunk_size=100000):
+        """
+        Incrementally writes a set of word vectors (see word_vectors_paths) with bounded memory. The vectors are
+        appended to the float32 matrix file, whose .npy header gets the final number of rows when closing the writer.
+        Only the words are kept in memory (as arrays of byte strings), for building the word index.
+        :param filepath: Path of the matrix
+        :param dimension: Size of the vectors
+        :param chunk_size: Number of words converted to an array at once
+        """
+        self.filepath = filepath
+        self.dimension = dimension
+        self.chunk_size = chunk_size
+        self.n_words = 0
+        self.words = []
+        self.chunk = []
+        self.matrix_file = io.open(word_vectors_paths(filepath)[0], 'wb')
+        self.matrix_file.write(npy_header(0, dimension))
+
+    def append(self, word, vector):
+        """
+        Appends the vector of a word.
+        :param word: Word
+        :param vector: 1D array of dimension values
+        """
+        vector = np.asarray(vector, dtype='<f4')
+        if vector.shape != (self.dimension,):
+            raise ValueError('The vector of "%s" has shape %s instead of (%d,).' %
+                             (word, str(vector.shape), self.dimension))
+        self.matrix_file.write(vector.tostring())
+        self.chunk.append(encode_word(word))
+        self.n_words += 1
+        if len(self.chunk) >= self.chunk_size:
+            self.words.append(np.asarray(self.chunk, dtype='S'))
+            self.chunk = []
+
+    def close(self):
+        """
+        Completes the matrix and stores the word index.
+        """
+        self.words.append(np.asarray(self.chunk, dtype='S'))
+        self.chunk = []
+        self.matrix_file.seek(0)
+        self.matrix_file.write(npy_header(self.n_words, self.dimension))
+        self.matrix_file.close()
+        save_word_index(np.concatenate(self.words), self.filepath)
+        self.words = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_vocabulary(filepath):
+    """
+    Reads a list of words: the first field of each line of a text file (e.g. a vocabulary file with frequencies).
+    :param filepath: Text file
+    :return: Set of words (utf-8 encoded)
+    """
+    with open(filepath, 'r') as f:
+        return set(line.split()[0] for line in f if line.strip())
+
+
+def is_word_vectors(filepath):
+    """
+    Whether a file is the matrix of a set of word vectors (with its word index), instead of a pickled dictionary of
+    vectors (as stored by former versions of the preprocessing scripts).
+    """
+    _, words_path, rows_path = word_vectors_paths(filepath)
+    return os.path.isfile(words_path) and os.path.isfile(rows_path)
+
+
+def load_word_vectors(filepath):
+    """
+    Memory-maps a set of word vectors.
+    :param filepath: Path of the matrix (see word_vectors_paths)
+    :return: Matrix, sorted words and their rows (memory-mapped arrays)
+    """
+    return tuple(np.load(path, mmap_mode='r') for path in word_vectors_paths(filepath))
+
+
+def lookup_word_vectors(filepath, words):
+    """
+    Finds the vectors of a list of words with a binary search in the sorted word index. Only the rows of the found
+    words are read from the memory-mapped matrix.
+    :param filepath: Path of the matrix (see word_vectors_paths)
+    :param words: List of words
+    :return: Boolean array of the words found and float32 matrix of their vectors
+    """
+    matrix, sorted_words, rows = load_word_vectors(filepath)
+    queries = np.asarray([encode_word(word) for word in words], dtype='S')
+    found = np.zeros(len(words), dtype='bool')
+    if len(sorted_words) == 0 or len(queries) == 0:
+        return found, np.zeros((0, matrix.shape[1]), dtype='float32')
+    # The words longer than the stored ones are not in the index (and would be truncated by the cast)
+    candidates = np.where(np.char.str_len(queries) <= sorted_words.dtype.itemsize)[0]
+    queries = queries[candidates].astype(sorted_words.dtype)
+    positions = np.minimum(np.searchsorted(sorted_words, queries), len(sorted_words) - 1)
+    matches = sorted_words[positions] == queries
+    found[candidates[matches]] = True
+    found_rows = rows[positions[matches]]
+    # The rows are read in order from the matrix
+    order = np.argsort(found_rows)
+    vectors = np.empty((len(found_rows), matrix.shape[1]), dtype='float32')
+    vectors[order] = matrix[found_rows[order]]
+    return found, vectors
+
+
+def pretrained_embedding_weights(filepath, words2idx, vocabulary_size, embedding_size):
+    """
+    Embedding matrix of a vocabulary initialized with pretrained word vectors. The words without a pretrained vector
+    are initialized randomly.
+    :param filepath: Pretrained word vectors: a matrix with its word index (see word_vectors_paths) or a pickled
+                     dictionary {word: vector}
+    :param words2idx: Vocabulary
+    :param vocabulary_size: Number of rows of the embedding matrix
+    :param embedding_size: Size of the embeddings (must be the size of the pretrained vectors)
+    :return: Embedding matrix
+    """
+    embedding_weights = np.random.rand(vocabulary_size, embedding_size)
+    if not is_word_vectors(filepath):
+        word_vectors = np.load(filepath).item()
+        for word, index in words2idx.iteritems():
+            if word_vectors.get(word) is not None:
+                embedding_weights[index, :] = word_vectors[word]
+        return embedding_weights
+    words = list(words2idx)
+    found, vectors = lookup_word_vectors(filepath, words)
+    indices = np.asarray([words2idx[word] for word in words], dtype='int64')
+    embedding_weights[indices[found]] = vectors
+    logging.info('Found pretrained vectors for %d of the %d words of the vocabulary' % (found.sum(), len(words)))
+    return embedding_weights